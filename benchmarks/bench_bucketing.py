@@ -0,0 +1,127 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Measure how much padding length bucketing saves, for several window sizes.
+
+Sample lengths are token counts drawn from the corpus's length distribution, or read from a split
+of a pretokenized dataset, truncated to ``max_seq_len`` as the truncate group method does. A
+window of 1 is the padding of batches in plain shuffled order.
+
+    python -m benchmarks.bench_bucketing --batch_size 8 --windows 1,4,16,64,256
+"""
+
+import json
+import random
+from argparse import ArgumentParser, Namespace
+from time import time
+from typing import List
+
+from benchmarks.synthetic import random_length
+from bucketing import bucket_batches, padding_efficiency
+
+CHARS_PER_TOKEN = 3.5
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--in_split_dir',
+        type=str,
+        default='',
+        help='Read sample lengths from this split of a pretokenized dataset instead of ' +
+        'drawing them. Default: draw them',
+    )
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=100_000,
+        help='Number of sample lengths to draw. Default: 100000',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=8,
+        help='Samples per batch. Default: 8',
+    )
+    args.add_argument(
+        '--max_seq_len',
+        type=int,
+        default=2048,
+        help='Length samples are truncated to. Default: 2048',
+    )
+    args.add_argument(
+        '--pad_to_multiple_of',
+        type=int,
+        default=0,
+        help='Round padded batch lengths up to a multiple of this. Default: 0, disabled',
+    )
+    args.add_argument(
+        '--windows',
+        type=str,
+        default='1,4,16,64,256',
+        help='Numbers of batches sorted together to try. Default: 1,4,16,64,256',
+    )
+    args.add_argument(
+        '--seed',
+        type=int,
+        default=42,
+        help='Random seed. Default: 42',
+    )
+    return args.parse_args()
+
+
+def read_lengths(split_dir: str) -> List[int]:
+    """Read the token count of every sample of a pretokenized split, in order.
+    Args:
+        split_dir (str): Split directory of the pretokenized dataset.
+    Returns:
+        List[int]: Token counts.
+    """
+    from mds_util import iter_shard, read_index
+    from pretokenize import TOKEN_DTYPE
+    itemsize = TOKEN_DTYPE().itemsize
+    lengths = []
+    for info in read_index(split_dir):
+        lengths += [len(sample['tokens']) // itemsize for sample in iter_shard(split_dir, info)]
+    return lengths
+
+
+def main(args: Namespace) -> None:
+    """Bucket the shuffled sample lengths with each window size and print the padding efficiency.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    rng = random.Random(args.seed)
+    if args.in_split_dir:
+        lengths = read_lengths(args.in_split_dir)
+    else:
+        lengths = [
+            max(1, int(random_length(rng) / CHARS_PER_TOKEN)) for _ in range(args.num_docs)
+        ]
+    lengths = [min(length, args.max_seq_len) for length in lengths]
+    rng.shuffle(lengths)
+
+    base = None
+    for window in map(int, args.windows.split(',')):
+        start = time()
+        batches = list(bucket_batches(lengths, int, args.batch_size, window, [args.seed]))
+        elapsed = time() - start
+        efficiency = padding_efficiency(batches, args.pad_to_multiple_of or None,
+                                        args.max_seq_len)
+        if base is None:
+            base = efficiency
+        obj = {
+            'window': window,
+            'padding_efficiency': round(efficiency, 4),
+            'padded_positions_saved': round(1 - base / efficiency, 4),
+            'samples_per_sec': round(len(lengths) / elapsed, 1),
+        }
+        print(json.dumps(obj, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
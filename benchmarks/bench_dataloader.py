@@ -0,0 +1,293 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Measure the throughput of build_pile_of_law_dataloader over a grid of loader settings.
+
+Reads a local copy of a converted dataset, or writes a synthetic one with Pile-of-Law-like
+document lengths. Each combination of ``num_workers``, ``prefetch_factor``, batch size and
+``group_method`` runs in a fresh process, so that its CPU time and peak RSS, and those of its
+DataLoader workers, are its own. Results are printed as JSON lines and saved together with the
+git commit they were measured at, to compare versions.
+
+    python -m benchmarks.bench_dataloader --num_workers 1,4,8 --group_methods none,truncate,concat
+"""
+
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+from argparse import ArgumentParser, Namespace
+from inspect import signature
+from itertools import islice
+from time import time
+from typing import Any, Dict, Optional
+
+from benchmarks.synthetic import SUBSETS, each_text
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        default='',
+        help='Local copy of a converted dataset to read. Default: write a synthetic one',
+    )
+    args.add_argument(
+        '--synthetic_root',
+        type=str,
+        default='/tmp/pol-synthetic',
+        help='Where to write the synthetic dataset, if it is not there yet. ' +
+        'Default: /tmp/pol-synthetic',
+    )
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=5000,
+        help='Number of synthetic documents. Default: 5000',
+    )
+    args.add_argument(
+        '--tokenizer',
+        type=str,
+        default='gpt2',
+        help='Name or path of the HuggingFace tokenizer. Default: gpt2',
+    )
+    args.add_argument(
+        '--max_seq_len',
+        type=int,
+        default=2048,
+        help='Max sequence length. Default: 2048',
+    )
+    args.add_argument(
+        '--num_workers',
+        type=str,
+        default='1,4,8',
+        help='DataLoader worker counts to try. Default: 1,4,8',
+    )
+    args.add_argument(
+        '--prefetch_factors',
+        type=str,
+        default='2',
+        help='DataLoader prefetch factors to try. Default: 2',
+    )
+    args.add_argument(
+        '--batch_sizes',
+        type=str,
+        default='8',
+        help='Device batch sizes to try. Default: 8',
+    )
+    args.add_argument(
+        '--group_methods',
+        type=str,
+        default='none,truncate,concat',
+        help='Group methods to try: none (SimpleStreamingPileOfLaw), truncate, concat or ' +
+        'window. Default: none,truncate,concat',
+    )
+    args.add_argument(
+        '--num_batches',
+        type=int,
+        default=200,
+        help='Batches to read per run. Default: 200',
+    )
+    args.add_argument(
+        '--out_file',
+        type=str,
+        default='bench_dataloader.json',
+        help='Path to save the results to. Default: bench_dataloader.json',
+    )
+    args.add_argument(
+        '--run_config',
+        type=str,
+        default='',
+        help='Internal: run one configuration, given as JSON, and print its result',
+    )
+    return args.parse_args()
+
+
+def write_synthetic(root: str, num_docs: int) -> None:
+    """Write a synthetic train split of Pile-of-Law-like documents, unless it is there already.
+    Args:
+        root (str): Dataset directory.
+        num_docs (int): Number of documents.
+    """
+    from mds_util import PoLMDSWriter
+
+    split_dir = os.path.join(root, 'train')
+    if os.path.exists(os.path.join(split_dir, 'index.json')):
+        return
+    columns = {'text': 'str', 'pol_set_name': 'str'}
+    with PoLMDSWriter(split_dir, columns, 'zstd:7', ['sha1', 'xxh64'], 1 << 27) as out:
+        batch = {'text': [], 'pol_set_name': []}
+        for idx, text in enumerate(each_text(num_docs)):
+            batch['text'].append(text)
+            batch['pol_set_name'].append(SUBSETS[idx % len(SUBSETS)])
+            if len(batch['text']) == 512:
+                out.write_batch(batch)
+                batch = {'text': [], 'pol_set_name': []}
+        if batch['text']:
+            out.write_batch(batch)
+
+
+def peak_rss_mb(who: int) -> float:
+    """Get the peak resident set size of this process or of its largest waited-for child.
+    Args:
+        who (int): ``resource.RUSAGE_SELF`` or ``resource.RUSAGE_CHILDREN``.
+    Returns:
+        float: Peak RSS in MiB.
+    """
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def cpu_seconds(who: int) -> float:
+    """Get the user and system CPU time of this process or of its waited-for children.
+    Args:
+        who (int): ``resource.RUSAGE_SELF`` or ``resource.RUSAGE_CHILDREN``.
+    Returns:
+        float: CPU seconds.
+    """
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Read batches with one loader configuration, in this process.
+    Args:
+        config (Dict[str, Any]): Dataset root, tokenizer and loader settings.
+    Returns:
+        Dict[str, Any]: The configuration and its measurements.
+    """
+    import torch
+    from omegaconf import OmegaConf as om
+    from torch.utils.data import DataLoader
+
+    from test_load import build_pile_of_law_dataloader
+
+    prefetch_factor: Optional[int] = config['prefetch_factor']
+    if not config['num_workers']:
+        # Only worker processes prefetch; leave it at the DataLoader default.
+        prefetch_factor = signature(DataLoader).parameters['prefetch_factor'].default
+    cfg = om.create({
+        'name': 'pile_of_law',
+        'dataset': {
+            'remote': None,
+            'local': config['root'],
+            'split': 'train',
+            'shuffle': True,
+            'tokenizer_name': config['tokenizer'],
+            'max_seq_len': config['max_seq_len'],
+            'group_method': config['group_method'],
+        },
+        'drop_last': False,
+        'num_workers': config['num_workers'],
+        'pin_memory': False,
+        'prefetch_factor': prefetch_factor,
+        'persistent_workers': False,
+        'timeout': 0,
+    })
+
+    start = time()
+    loader = build_pile_of_law_dataloader(cfg, config['batch_size'])
+    build_sec = time() - start
+
+    start = time()
+    batches = iter(loader)
+    num_samples = 0
+    num_tokens = 0
+    first_batch_sec = None
+    for batch in islice(batches, config['num_batches']):
+        if first_batch_sec is None:
+            first_batch_sec = time() - start
+        num_samples += len(batch['input_ids'])
+        mask = batch.get('attention_mask')
+        if isinstance(mask, torch.Tensor) and mask.dim() == 2:
+            num_tokens += int(mask.sum())
+        else:
+            num_tokens += batch['input_ids'].numel()
+    elapsed = time() - start
+    # Shut the workers down and wait for them, so that their usage is counted.
+    del batches
+    result = {
+        **config,
+        'build_sec': round(build_sec, 3),
+        'first_batch_sec': round(first_batch_sec or 0, 3),
+        'samples_per_sec': round(num_samples / elapsed, 2),
+        'tokens_per_sec': round(num_tokens / elapsed, 1),
+        'main_cpu_sec': round(cpu_seconds(resource.RUSAGE_SELF), 2),
+        'main_peak_rss_mb': round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+    }
+    if config['num_workers']:
+        worker_cpu_sec = cpu_seconds(resource.RUSAGE_CHILDREN)
+        result['cpu_sec_per_worker'] = round(worker_cpu_sec / config['num_workers'], 2)
+        result['worker_peak_rss_mb'] = round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1)
+    return result
+
+
+def git_commit() -> Optional[str]:
+    """Get the commit of the code being measured.
+    Returns:
+        Optional[str]: Commit hash, or ``None`` outside of a git checkout.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: Namespace) -> None:
+    """Run every configuration of the grid in its own process, and save the results.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    if args.run_config:
+        print(json.dumps(run_config(json.loads(args.run_config)), sort_keys=True))
+        return
+
+    root = args.root
+    if not root:
+        root = args.synthetic_root
+        write_synthetic(root, args.num_docs)
+
+    results = []
+    grid = itertools.product(map(int, args.num_workers.split(',')),
+                             map(int, args.prefetch_factors.split(',')),
+                             map(int, args.batch_sizes.split(',')),
+                             args.group_methods.split(','))
+    for num_workers, prefetch_factor, batch_size, group_method in grid:
+        config = {
+            'root': root,
+            'tokenizer': args.tokenizer,
+            'max_seq_len': args.max_seq_len,
+            'num_workers': num_workers,
+            'prefetch_factor': prefetch_factor,
+            'batch_size': batch_size,
+            'group_method': group_method,
+            'num_batches': args.num_batches,
+        }
+        command = [sys.executable, '-m', 'benchmarks.bench_dataloader', '--run_config',
+                   json.dumps(config)]
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode:
+            result = {**config, 'error': proc.stderr.strip().splitlines()[-1:]}
+        else:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(json.dumps(result, sort_keys=True))
+        results.append(result)
+
+    obj = {
+        'commit': git_commit(),
+        'time': time(),
+        'results': results,
+    }
+    with open(args.out_file, 'w') as out:
+        json.dump(obj, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,135 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare the list-concatenating concat packer of StreamingPileOfLaw with TokenPacker.
+
+Documents get the corpus's length distribution, in tokens, so the long tail that makes list
+concatenation quadratic is present.
+
+    python -m benchmarks.bench_packing --num_docs 2000 --max_seq_len 2048
+"""
+
+import json
+import random
+from argparse import ArgumentParser, Namespace
+from time import time
+from typing import Any, Dict, Iterator, List
+
+from benchmarks.synthetic import random_length
+from packing import TokenPacker
+
+CHARS_PER_TOKEN = 3.5
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=2000,
+        help='Number of synthetic tokenized documents to pack. Default: 2000',
+    )
+    args.add_argument(
+        '--max_seq_len',
+        type=int,
+        default=2048,
+        help='Tokens per packed block. Default: 2048',
+    )
+    return args.parse_args()
+
+
+def make_samples(num_docs: int, seed: int = 42) -> List[Dict[str, List[int]]]:
+    """Generate tokenizer outputs of synthetic documents.
+    Args:
+        num_docs (int): Number of documents.
+        seed (int): Random seed. Default: 42.
+    Returns:
+        List[Dict[str, List[int]]]: Input ids and attention mask of each document.
+    """
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(num_docs):
+        num_tokens = max(1, int(random_length(rng) / CHARS_PER_TOKEN))
+        input_ids = [rng.randrange(52_000) for _ in range(num_tokens)]
+        samples.append({'input_ids': input_ids, 'attention_mask': [1] * num_tokens})
+    return samples
+
+
+def pack_lists(samples: List[Dict[str, List[int]]], max_seq_len: int) -> Iterator[Dict[str, Any]]:
+    """The concat loop of StreamingPileOfLaw.__iter__ before TokenPacker, over one epoch.
+    Args:
+        samples (List[Dict[str, List[int]]]): Token samples.
+        max_seq_len (int): Tokens per block.
+    Returns:
+        Iterator[Dict[str, Any]]: Blocks.
+    """
+    buffer = {}
+    for sample in samples:
+        for k, v in sample.items():
+            buffer[k] = buffer.get(k, []) + v
+        while len(buffer['input_ids']) >= max_seq_len:
+            concat_sample = {}
+            for k, v in buffer.items():
+                concat_sample[k] = v[:max_seq_len]
+                buffer[k] = v[max_seq_len:]
+            yield concat_sample
+
+
+def pack_numpy(samples: List[Dict[str, List[int]]], max_seq_len: int) -> Iterator[Dict[str, Any]]:
+    """The concat loop of StreamingPileOfLaw.__iter__ with TokenPacker, over one epoch.
+    Args:
+        samples (List[Dict[str, List[int]]]): Token samples.
+        max_seq_len (int): Tokens per block.
+    Returns:
+        Iterator[Dict[str, Any]]: Blocks.
+    """
+    packer = TokenPacker(max_seq_len)
+    for sample in samples:
+        for block in packer.push(sample):
+            yield {k: v.tolist() for k, v in block.items()}
+
+
+def pack_arrays(samples: List[Dict[str, List[int]]], max_seq_len: int) -> Iterator[Dict[str, Any]]:
+    """TokenPacker on its own, keeping blocks as arrays.
+    Args:
+        samples (List[Dict[str, List[int]]]): Token samples.
+        max_seq_len (int): Tokens per block.
+    Returns:
+        Iterator[Dict[str, Any]]: Blocks.
+    """
+    packer = TokenPacker(max_seq_len)
+    for sample in samples:
+        yield from packer.push(sample)
+
+
+def main(args: Namespace) -> None:
+    """Time both packers and print their throughput.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    samples = make_samples(args.num_docs)
+    num_tokens = sum(len(sample['input_ids']) for sample in samples)
+    results = {}
+    packers = [('lists', pack_lists), ('numpy', pack_numpy), ('numpy_arrays', pack_arrays)]
+    for name, pack in packers:
+        start = time()
+        results[name] = list(pack(samples, args.max_seq_len))
+        elapsed = time() - start
+        obj = {
+            'packer': name,
+            'tokens_per_sec': round(num_tokens / elapsed, 1),
+            'blocks': len(results[name]),
+            'seconds': round(elapsed, 3),
+        }
+        print(json.dumps(obj, sort_keys=True))
+    assert results['lists'] == results['numpy'], 'Packers disagree'
+    arrays = [{k: v.tolist() for k, v in block.items()} for block in results['numpy_arrays']]
+    assert results['lists'] == arrays, 'Packers disagree'
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,118 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare truncating whole documents with tokenizing only the prefix that truncation keeps.
+
+Documents get the corpus's length distribution, and are reported by length bucket, so the long
+tail (e.g. court opinions and the federal register, hundreds of thousands of characters) shows
+separately from the short documents that gain nothing. Both ways must give the same tokens.
+
+    python -m benchmarks.bench_prefix_tokenize --tokenizer gpt2 --max_seq_len 2048
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from time import time
+from typing import Any, List
+
+from benchmarks.synthetic import make_texts
+from prefix_tokenize import supports_prefix_tokenization, tokenize_prefixes
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--tokenizer',
+        type=str,
+        default='gpt2',
+        help='Name or path of the HuggingFace tokenizer. Default: gpt2',
+    )
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=1000,
+        help='Number of synthetic documents to tokenize. Default: 1000',
+    )
+    args.add_argument(
+        '--max_seq_len',
+        type=int,
+        default=2048,
+        help='Tokens to keep per document. Default: 2048',
+    )
+    args.add_argument(
+        '--chars_per_token',
+        type=float,
+        default=6.0,
+        help='Initial prefix characters per token kept. Default: 6.0',
+    )
+    args.add_argument(
+        '--buckets',
+        type=str,
+        default='0,10000,50000,200000',
+        help='Lower bounds, in characters, of the document length buckets to report. ' +
+        'Default: 0,10000,50000,200000',
+    )
+    return args.parse_args()
+
+
+def tokenize_whole(tokenizer: Any, texts: List[str], max_seq_len: int) -> List[List[int]]:
+    """Tokenize whole texts and truncate them, as the truncate group method did.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer.
+        texts (List[str]): Texts to tokenize.
+        max_seq_len (int): Tokens to keep per text.
+    Returns:
+        List[List[int]]: Token ids of each text.
+    """
+    return [
+        tokenizer(text, truncation=True, padding=False, max_length=max_seq_len)['input_ids']
+        for text in texts
+    ]
+
+
+def main(args: Namespace) -> None:
+    """Time both ways on each length bucket and print their throughput.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    os.environ['TRANSFORMERS_NO_ADVISORY_WARNINGS'] = '1'
+    import transformers
+
+    tokenizer = transformers.AutoTokenizer.from_pretrained(args.tokenizer)
+    tokenizer.model_max_length = int(1e30)
+    if not supports_prefix_tokenization(tokenizer):
+        raise ValueError(f'Tokenizer {args.tokenizer} does not support prefix tokenization.')
+    texts = make_texts(args.num_docs)
+
+    bounds = list(map(int, args.buckets.split(','))) + [len(max(texts, key=len)) + 1]
+    for low, high in zip(bounds, bounds[1:]):
+        bucket = [text for text in texts if low <= len(text) < high]
+        if not bucket:
+            continue
+        start = time()
+        expected = tokenize_whole(tokenizer, bucket, args.max_seq_len)
+        whole_time = time() - start
+        start = time()
+        ids = [
+            tokenize_prefixes(tokenizer, [text], args.max_seq_len, args.chars_per_token)[0]
+            for text in bucket
+        ]
+        prefix_time = time() - start
+        assert ids == expected, f'Prefix tokenization differs on documents of {low}+ chars'
+        obj = {
+            'min_chars': low,
+            'docs': len(bucket),
+            'whole_docs_per_sec': round(len(bucket) / whole_time, 1),
+            'prefix_docs_per_sec': round(len(bucket) / prefix_time, 1),
+            'speedup': round(whole_time / prefix_time, 2),
+        }
+        print(json.dumps(obj, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,87 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare the JSONL record decoders of experiments/convert.py on legal-document-sized records.
+
+    python -m benchmarks.bench_records --num_docs 20000
+"""
+
+import json
+from argparse import ArgumentParser, Namespace
+from time import time
+from typing import List
+
+from benchmarks.synthetic import make_texts
+from experiments.records import RECORD_DECODERS
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=20_000,
+        help='Number of synthetic records to decode. Default: 20000',
+    )
+    args.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Decode the records this many times and keep the fastest. Default: 3',
+    )
+    return args.parse_args()
+
+
+def make_lines(num_docs: int) -> List[str]:
+    """Serialize synthetic documents as Pile of Law JSONL lines.
+    Args:
+        num_docs (int): Number of documents.
+    Returns:
+        List[str]: JSON lines.
+    """
+    lines = []
+    for idx, text in enumerate(make_texts(num_docs)):
+        obj = {
+            'url': f'https://www.courtlistener.com/opinion/{idx}/',
+            'created_timestamp': '06-21-2022',
+            'downloaded_timestamp': '08-05-2022',
+            'text': text,
+        }
+        lines.append(json.dumps(obj) + '\n')
+    return lines
+
+
+def main(args: Namespace) -> None:
+    """Time each decoder and print its throughput.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    lines = make_lines(args.num_docs)
+    num_chars = sum(map(len, lines))
+    expected = None
+    base = None
+    for name, decode in RECORD_DECODERS.items():
+        elapsed = float('inf')
+        for _ in range(args.repeat):
+            start = time()
+            texts = list(map(decode, lines))
+            elapsed = min(elapsed, time() - start)
+        if expected is None:
+            expected = texts
+            base = elapsed
+        assert texts == expected, f'{name} decodes differently'
+        obj = {
+            'decoder': name,
+            'records_per_sec': round(len(lines) / elapsed, 1),
+            'mb_per_sec': round(num_chars / elapsed / 1e6, 1),
+            'speedup': round(base / elapsed, 2),  # pyright: ignore
+        }
+        print(json.dumps(obj, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,237 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare the regex sentence splitter of legal_sentences.py against spaCy: speed and agreement.
+
+Segments the same seeded sample of documents from every Pile of Law subset (using the index built
+by subset_index.py), or synthetic documents if no dataset is given, with both, one subset per
+worker process. For each subset it reports MB/s and docs/s of each on one core, and how well the
+regex sentence ends agree with spaCy's: the precision and recall of its sentence ends, taking
+spaCy's as the reference, and their F1. Documents are cut to the same length prepare_tokenize.py
+cuts them to.
+
+    python -m benchmarks.bench_sentences --root mds-pol --docs_per_subset 200
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from multiprocessing import Pool
+from time import perf_counter, time
+from typing import Any, Dict, List, Set, Tuple
+
+from benchmarks.synthetic import make_texts
+from experiments.sentpiece_tokenize.legal_sentences import sentence_spans
+from experiments.sentpiece_tokenize.prepare_tokenize import p75
+from mds_util import iter_samples
+from subset_index import SubsetIndex
+
+# spaCy pipeline of each worker process, loaded once by init_worker.
+nlp = None
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        default='',
+        help='Directory path of the converted MDS dataset, indexed by subset_index.py. ' +
+        'Default: use synthetic documents',
+    )
+    args.add_argument(
+        '--split',
+        type=str,
+        default='validation',
+        help='Split to sample documents from. Default: validation',
+    )
+    args.add_argument(
+        '--docs_per_subset',
+        type=int,
+        default=200,
+        help='Documents to sample from each subset, or synthetic documents. Default: 200',
+    )
+    args.add_argument(
+        '--max_doc_chars',
+        type=int,
+        default=p75,
+        help=f'Characters of each document to keep at most. Default: {p75}',
+    )
+    args.add_argument(
+        '--spacy_model',
+        type=str,
+        default='en_core_web_sm',
+        help='spaCy pipeline to compare against. Default: en_core_web_sm',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=64,
+        help='Documents per batch. Default: 64',
+    )
+    args.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed of the sample. Default: 0',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of processes. Default: all available cores',
+    )
+    args.add_argument(
+        '--out_file',
+        type=str,
+        default='',
+        help='Path to also save the results to, as JSON. Default: do not save',
+    )
+    return args.parse_args()
+
+
+def init_worker(model: str) -> None:
+    """Load the spaCy pipeline of a worker process, as prepare_tokenize.py does.
+    Args:
+        model (str): spaCy pipeline name.
+    """
+    global nlp
+    import spacy
+
+    nlp = spacy.load(model, exclude=['ner'])
+
+
+def sentence_ends(text: str, spans: List[Tuple[int, int]]) -> Set[int]:
+    """Get where the sentences of a text end, but for the last, ignoring whitespace around them.
+    Args:
+        text (str): Text.
+        spans (List[Tuple[int, int]]): Begin and end of each sentence.
+    Returns:
+        Set[int]: End of each sentence, after its last non-whitespace character.
+    """
+    ends = set()
+    for begin, end in spans:
+        if text[begin:end].strip():
+            ends.add(begin + len(text[begin:end].rstrip()))
+    ends.discard(len(text.rstrip()))
+    return ends
+
+
+def bench_subset(task: Tuple[str, List[int]], args: Namespace) -> Tuple[str, Dict[str, Any]]:
+    """Segment the sample of one subset both ways. This is the unit of work of the process pool.
+    Args:
+        task (Tuple[str, List[int]]): Subset name, and the sample ids of its sample.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Tuple[str, Dict[str, Any]]: Subset name, and its counts and times.
+    """
+    subset, ids = task
+    if args.root:
+        split_dir = os.path.join(args.root, args.split)
+        texts = [sample['text'] for _, sample in iter_samples(split_dir, ids)]
+    else:
+        texts = make_texts(len(ids), args.seed)
+    texts = [text[:args.max_doc_chars] for text in texts]
+    batch_size = args.batch_size
+
+    start = perf_counter()
+    regex_spans = []
+    for begin in range(0, len(texts), batch_size):
+        regex_spans += [sentence_spans(text) for text in texts[begin:begin + batch_size]]
+    regex_sec = perf_counter() - start
+
+    start = perf_counter()
+    spacy_spans = []
+    for doc in nlp.pipe(texts, batch_size=batch_size):  # pyright: ignore
+        spacy_spans.append([(sent.start_char, sent.end_char) for sent in doc.sents])
+    spacy_sec = perf_counter() - start
+
+    counts = {
+        'docs': len(texts),
+        'bytes': sum(len(text.encode('utf-8')) for text in texts),
+        'regex_sec': regex_sec,
+        'spacy_sec': spacy_sec,
+        'regex_ends': 0,
+        'spacy_ends': 0,
+        'both_ends': 0,
+    }
+    for text, regex, spacy in zip(texts, regex_spans, spacy_spans):
+        regex_ends = sentence_ends(text, regex)
+        spacy_ends = sentence_ends(text, spacy)
+        counts['regex_ends'] += len(regex_ends)
+        counts['spacy_ends'] += len(spacy_ends)
+        counts['both_ends'] += len(regex_ends & spacy_ends)
+    return subset, counts
+
+
+def summarize(counts: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the speed and agreement of the splitters on a sample.
+    Args:
+        counts (Dict[str, Any]): Documents, bytes, seconds and sentence end counts.
+    Returns:
+        Dict[str, Any]: Statistics.
+    """
+    obj = {'docs': counts['docs']}
+    for name in ['regex', 'spacy']:
+        sec = counts[f'{name}_sec'] or float('inf')
+        obj[f'{name}_mb_per_sec'] = round(counts['bytes'] / sec / 1e6, 3)
+        obj[f'{name}_docs_per_sec'] = round(counts['docs'] / sec, 1)
+        obj[f'{name}_sents_per_doc'] = round(counts[f'{name}_ends'] / counts['docs'] + 1, 2) \
+            if counts['docs'] else 0
+    obj['speedup'] = round(counts['spacy_sec'] / counts['regex_sec'], 1) \
+        if counts['regex_sec'] else None
+    precision = counts['both_ends'] / counts['regex_ends'] if counts['regex_ends'] else 1.0
+    recall = counts['both_ends'] / counts['spacy_ends'] if counts['spacy_ends'] else 1.0
+    obj['precision'] = round(precision, 4)
+    obj['recall'] = round(recall, 4)
+    obj['f1'] = round(2 * precision * recall / (precision + recall), 4) \
+        if precision + recall else 0.0
+    return obj
+
+
+def main(args: Namespace) -> None:
+    """Segment the sample of each subset both ways and print the comparison.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    tasks = []
+    if args.root:
+        index = SubsetIndex.load(os.path.join(args.root, args.split))
+        for subset in index.subsets:
+            ids = index.sample({subset: args.docs_per_subset}, seed=args.seed)
+            tasks.append((subset, ids.tolist()))
+    else:
+        tasks.append(('synthetic', list(range(args.docs_per_subset))))
+
+    results = {}
+    totals = {}
+    with Pool(min(args.num_proc, len(tasks)), init_worker, (args.spacy_model,)) as pool:
+        for subset, counts in pool.imap_unordered(partial(bench_subset, args=args), tasks):
+            results[subset] = summarize(counts)
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+            print(json.dumps({'subset': subset, **results[subset]}, sort_keys=True))
+    results['all'] = summarize(totals)
+    print(json.dumps({'subset': 'all', **results['all']}, sort_keys=True))
+
+    if args.out_file:
+        obj = {
+            'root': args.root or None,
+            'split': args.split,
+            'docs_per_subset': args.docs_per_subset,
+            'spacy_model': args.spacy_model,
+            'seed': args.seed,
+            'time': time(),
+            'results': results,
+        }
+        with open(args.out_file, 'w') as out:
+            json.dump(obj, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,106 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Measure tokens/s of one tokenizer call per sample against batched calls of several sizes.
+
+Tokenizes synthetic legal documents the way StreamingPileOfLaw does with
+``tokenize_batch_size`` samples per call, and checks that every group size gives the same tokens.
+
+    python -m benchmarks.bench_tokenize --tokenizer gpt2 --group_sizes 1,4,16,64
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from time import time
+from typing import Any, List
+
+from benchmarks.synthetic import make_texts
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--tokenizer',
+        type=str,
+        default='gpt2',
+        help='Name or path of the HuggingFace tokenizer. Default: gpt2',
+    )
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=2000,
+        help='Number of synthetic documents to tokenize. Default: 2000',
+    )
+    args.add_argument(
+        '--group_sizes',
+        type=str,
+        default='1,4,16,64',
+        help='Samples per tokenizer call to try. Default: 1,4,16,64',
+    )
+    args.add_argument(
+        '--tokenizers_parallelism',
+        type=str,
+        default='false',
+        help='Value of TOKENIZERS_PARALLELISM. DataLoader workers forked after the tokenizer ' +
+        'was used run with it off. Default: false',
+    )
+    return args.parse_args()
+
+
+def tokenize(tokenizer: Any, texts: List[str], group_size: int) -> List[List[int]]:
+    """Tokenize texts in groups, as the concat group method does.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer.
+        texts (List[str]): Texts to tokenize.
+        group_size (int): Texts per tokenizer call.
+    Returns:
+        List[List[int]]: Token ids of each text.
+    """
+    if group_size == 1:
+        return [tokenizer(text, truncation=False, padding=False)['input_ids'] for text in texts]
+    ids = []
+    for begin in range(0, len(texts), group_size):
+        group = texts[begin:begin + group_size]
+        ids += tokenizer(group, truncation=False, padding=False)['input_ids']
+    return ids
+
+
+def main(args: Namespace) -> None:
+    """Time each group size and print its throughput.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    os.environ['TOKENIZERS_PARALLELISM'] = args.tokenizers_parallelism
+    os.environ['TRANSFORMERS_NO_ADVISORY_WARNINGS'] = '1'
+    import transformers
+
+    tokenizer = transformers.AutoTokenizer.from_pretrained(args.tokenizer)
+    tokenizer.model_max_length = int(1e30)
+    texts = make_texts(args.num_docs)
+
+    expected = None
+    base = None
+    for group_size in map(int, args.group_sizes.split(',')):
+        start = time()
+        ids = tokenize(tokenizer, texts, group_size)
+        elapsed = time() - start
+        if expected is None:
+            expected = ids
+            base = elapsed
+        assert ids == expected, f'Group size {group_size} tokenizes differently'
+        obj = {
+            'group_size': group_size,
+            'tokens_per_sec': round(sum(map(len, ids)) / elapsed, 1),
+            'docs_per_sec': round(len(texts) / elapsed, 1),
+            'speedup': round(base / elapsed, 2),  # pyright: ignore
+        }
+        print(json.dumps(obj, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
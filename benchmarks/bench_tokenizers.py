@@ -0,0 +1,212 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare tokenizers on a fixed sample of each Pile of Law subset: compression and throughput.
+
+Draws the same seeded sample of documents from every subset of a split, using the index built by
+subset_index.py, and tokenizes each subset's sample with every tokenizer, one subset per worker
+process. For each tokenizer and subset it reports tokens per character, encode throughput in MB/s
+of UTF-8 text and docs/s on one core, and the tokens the whole subset would take, extrapolated
+from its character count. Fewer tokens per document is fewer sequences to train on.
+
+    python -m benchmarks.bench_tokenizers --root mds-pol --tokenizers gpt2,pile-of-law-tokenizer
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from multiprocessing import Pool
+from time import perf_counter, time
+from typing import Any, Dict, List, Tuple
+
+from mds_util import iter_samples
+from subset_index import SubsetIndex
+
+# Tokenizers of each worker process, loaded once by init_worker.
+tokenizers: Dict[str, Any] = {}
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        required=True,
+        help='Directory path of the converted MDS dataset, indexed by subset_index.py',
+    )
+    args.add_argument(
+        '--split',
+        type=str,
+        default='validation',
+        help='Split to sample documents from. Default: validation',
+    )
+    args.add_argument(
+        '--tokenizers',
+        type=str,
+        default='gpt2,pile-of-law-tokenizer',
+        help='Names or paths of the HuggingFace tokenizers to compare. ' +
+        'Default: gpt2,pile-of-law-tokenizer',
+    )
+    args.add_argument(
+        '--docs_per_subset',
+        type=int,
+        default=1000,
+        help='Documents to sample from each subset. Default: 1000',
+    )
+    args.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed of the sample. Default: 0',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=64,
+        help='Documents per tokenizer call. Default: 64',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of tokenizing processes. Default: all available cores',
+    )
+    args.add_argument(
+        '--out_file',
+        type=str,
+        default='',
+        help='Path to also save the results to, as JSON. Default: do not save',
+    )
+    return args.parse_args()
+
+
+def init_worker(names: List[str]) -> None:
+    """Load the tokenizers of a worker process.
+    Args:
+        names (List[str]): Names or paths of the HuggingFace tokenizers.
+    """
+    # The pool already uses every core, and throughput is per core.
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    os.environ['TRANSFORMERS_NO_ADVISORY_WARNINGS'] = '1'
+    import transformers
+
+    for name in names:
+        tokenizers[name] = transformers.AutoTokenizer.from_pretrained(name)
+        # Documents are far longer than any model context.
+        tokenizers[name].model_max_length = int(1e30)
+
+
+def bench_subset(task: Tuple[str, str, List[int]],
+                 batch_size: int) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+    """Tokenize the sample of one subset with every tokenizer. This is the unit of work of the
+    process pool.
+    Args:
+        task (Tuple[str, str, List[int]]): Dataset directory of the split, subset name, and the
+            sample ids of its sample.
+        batch_size (int): Documents per tokenizer call.
+    Returns:
+        Tuple[str, Dict[str, Dict[str, Any]]]: Subset name, and the counts and encode time of
+            each tokenizer.
+    """
+    split_dir, subset, ids = task
+    texts = [sample['text'] for _, sample in iter_samples(split_dir, ids)]
+    num_chars = sum(map(len, texts))
+    num_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    results = {}
+    for name, tokenizer in tokenizers.items():
+        # Warm up, so that whichever tokenizer runs first is not charged for it.
+        tokenizer(texts[:batch_size], return_attention_mask=False)
+        num_tokens = 0
+        elapsed = 0
+        for begin in range(0, len(texts), batch_size):
+            batch = texts[begin:begin + batch_size]
+            start = perf_counter()
+            ids = tokenizer(batch, return_attention_mask=False)['input_ids']
+            elapsed += perf_counter() - start
+            num_tokens += sum(map(len, ids))
+        results[name] = {
+            'docs': len(texts),
+            'chars': num_chars,
+            'bytes': num_bytes,
+            'tokens': num_tokens,
+            'sec': elapsed,
+        }
+    return subset, results
+
+
+def summarize(counts: Dict[str, Any], subset_chars: int) -> Dict[str, Any]:
+    """Get the compression and throughput of a tokenizer on a sample.
+    Args:
+        counts (Dict[str, Any]): Documents, characters, bytes, tokens and encode seconds.
+        subset_chars (int): Characters of everything the sample was drawn from.
+    Returns:
+        Dict[str, Any]: Statistics.
+    """
+    tokens_per_char = counts['tokens'] / counts['chars'] if counts['chars'] else 0
+    sec = counts['sec'] or float('inf')
+    return {
+        'sample_docs': counts['docs'],
+        'tokens_per_char': round(tokens_per_char, 4),
+        'tokens_per_doc': round(counts['tokens'] / counts['docs'], 1) if counts['docs'] else 0,
+        'mb_per_sec': round(counts['bytes'] / sec / 1e6, 2),
+        'docs_per_sec': round(counts['docs'] / sec, 1),
+        'est_tokens': round(tokens_per_char * subset_chars),
+    }
+
+
+def main(args: Namespace) -> None:
+    """Tokenize the sample of each subset with each tokenizer and print the comparison.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    split_dir = os.path.join(args.root, args.split)
+    index = SubsetIndex.load(split_dir)
+    names = args.tokenizers.split(',')
+    tasks = []
+    for subset in index.subsets:
+        ids = index.sample({subset: args.docs_per_subset}, seed=args.seed)
+        tasks.append((split_dir, subset, ids.tolist()))
+
+    results = {}
+    totals = {name: {'docs': 0, 'chars': 0, 'bytes': 0, 'tokens': 0, 'sec': 0} for name in names}
+    est_tokens = dict.fromkeys(names, 0)
+    with Pool(min(args.num_proc, len(tasks)) or 1, init_worker, (names,)) as pool:
+        for subset, counts in pool.imap_unordered(partial(bench_subset,
+                                                          batch_size=args.batch_size), tasks):
+            results[subset] = {}
+            for name in names:
+                obj = summarize(counts[name], index.num_chars(subset))
+                results[subset][name] = obj
+                est_tokens[name] += obj['est_tokens']
+                for key in totals[name]:
+                    totals[name][key] += counts[name][key]
+                print(json.dumps({'subset': subset, 'tokenizer': name, **obj}, sort_keys=True))
+
+    # Over all subsets, the token estimate is the sum of theirs; the rest is over the samples.
+    results['all'] = {}
+    for name in names:
+        obj = summarize(totals[name], 0)
+        obj['est_tokens'] = est_tokens[name]
+        results['all'][name] = obj
+        print(json.dumps({'subset': 'all', 'tokenizer': name, **obj}, sort_keys=True))
+
+    if args.out_file:
+        obj = {
+            'root': args.root,
+            'split': args.split,
+            'docs_per_subset': args.docs_per_subset,
+            'seed': args.seed,
+            'time': time(),
+            'results': results,
+        }
+        with open(args.out_file, 'w') as out:
+            json.dump(obj, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(parse_args())
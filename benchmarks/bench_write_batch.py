@@ -0,0 +1,113 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare per-sample MDSWriter.write against PoLMDSWriter.write_batch.
+
+    python -m benchmarks.bench_write_batch --num_docs 20000 --compression zstd:7
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from typing import List
+
+from streaming.base import MDSWriter
+
+from benchmarks.synthetic import make_texts
+from mds_util import PoLMDSWriter
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=20_000,
+        help='Number of synthetic documents to write. Default: 20000',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=512,
+        help='Samples per write_batch call, as in hf_convert. Default: 512',
+    )
+    args.add_argument(
+        '--compression',
+        type=str,
+        default='',
+        help='Compression algorithm, or empty to time the write loop alone. Default: none',
+    )
+    args.add_argument(
+        '--size_limit',
+        type=int,
+        default=1 << 27,
+        help='Shard size limit. Default: 1 << 27',
+    )
+    return args.parse_args()
+
+
+def bench_write(texts: List[str], args: Namespace) -> float:
+    """Time the per-sample write path.
+    Args:
+        texts (List[str]): Documents to write.
+        args (Namespace): Command-line arguments.
+    Returns:
+        float: Samples per second.
+    """
+    dirname = mkdtemp()
+    start = time()
+    with MDSWriter(os.path.join(dirname, 'out'), {'text': 'str'}, args.compression or None,
+                   [], args.size_limit) as out:
+        for text in texts:
+            out.write({'text': text})
+    elapsed = time() - start
+    rmtree(dirname)
+    return len(texts) / elapsed
+
+
+def bench_write_batch(texts: List[str], args: Namespace) -> float:
+    """Time the batched write path.
+    Args:
+        texts (List[str]): Documents to write.
+        args (Namespace): Command-line arguments.
+    Returns:
+        float: Samples per second.
+    """
+    dirname = mkdtemp()
+    start = time()
+    with PoLMDSWriter(os.path.join(dirname, 'out'), {'text': 'str'}, args.compression or None,
+                      [], args.size_limit) as out:
+        for begin in range(0, len(texts), args.batch_size):
+            out.write_batch({'text': texts[begin:begin + args.batch_size]})
+    elapsed = time() - start
+    rmtree(dirname)
+    return len(texts) / elapsed
+
+
+def main(args: Namespace) -> None:
+    """Run the benchmark and print samples/s for both write paths.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    texts = make_texts(args.num_docs)
+    before = bench_write(texts, args)
+    after = bench_write_batch(texts, args)
+    obj = {
+        'num_docs': args.num_docs,
+        'compression': args.compression,
+        'write_samples_per_sec': round(before, 1),
+        'write_batch_samples_per_sec': round(after, 1),
+        'speedup': round(after / before, 2),
+    }
+    print(json.dumps(obj, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,138 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compare lzma.open against the multi-threaded block reader on a .jsonl.xz file.
+
+Pass a real input file, or let the benchmark write a synthetic multi-block one:
+
+    python -m benchmarks.bench_xz --in_file data/train.courtlisteneropinions.0.jsonl.xz
+    python -m benchmarks.bench_xz --num_docs 20000 --threads 1,2,4,8
+"""
+
+import json
+import lzma
+import os
+from argparse import ArgumentParser, Namespace
+from tempfile import mkstemp
+from time import time
+from typing import Iterator, Tuple
+
+from benchmarks.synthetic import each_text
+from experiments.xz_reader import iter_xz_lines, xz_blocks
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--in_file',
+        type=str,
+        default='',
+        help='Input .jsonl.xz file. Default: write a synthetic one',
+    )
+    args.add_argument(
+        '--num_docs',
+        type=int,
+        default=20_000,
+        help='Number of documents in the synthetic file. Default: 20000',
+    )
+    args.add_argument(
+        '--block_size',
+        type=int,
+        default=1 << 24,
+        help='Uncompressed bytes per xz block of the synthetic file. Default: 1 << 24',
+    )
+    args.add_argument(
+        '--threads',
+        type=str,
+        default='1,2,4,8',
+        help='Thread counts to try. Default: 1,2,4,8',
+    )
+    return args.parse_args()
+
+
+def write_synthetic(filename: str, num_docs: int, block_size: int) -> None:
+    """Write synthetic JSONL records as an xz file with one block per ``block_size`` bytes.
+    Args:
+        filename (str): Output path.
+        num_docs (int): Number of documents.
+        block_size (int): Uncompressed bytes per block.
+    """
+    buf = []
+    size = 0
+    with open(filename, 'wb') as out:
+        for idx, text in enumerate(each_text(num_docs)):
+            obj = {
+                'created_timestamp': '',
+                'downloaded_timestamp': '',
+                'text': text,
+                'url': f'https://example.com/{idx}',
+            }
+            line = (json.dumps(obj) + '\n').encode('utf-8')
+            buf.append(line)
+            size += len(line)
+            if size >= block_size:
+                out.write(lzma.compress(b''.join(buf)))
+                buf = []
+                size = 0
+        if buf:
+            out.write(lzma.compress(b''.join(buf)))
+
+
+def consume(lines: Iterator[str]) -> Tuple[int, int, float]:
+    """Read every line.
+    Args:
+        lines (Iterator[str]): Lines.
+    Returns:
+        Tuple[int, int, float]: Number of lines, number of characters, and seconds taken.
+    """
+    start = time()
+    num_lines = 0
+    num_chars = 0
+    for line in lines:
+        num_lines += 1
+        num_chars += len(line)
+    return num_lines, num_chars, time() - start
+
+
+def main(args: Namespace) -> None:
+    """Time both readers and print their throughput.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    filename = args.in_file
+    if not filename:
+        _, filename = mkstemp(suffix='.jsonl.xz')
+        write_synthetic(filename, args.num_docs, args.block_size)
+
+    num_blocks = len(xz_blocks(filename))
+    num_lines, num_chars, base = consume(lzma.open(open(filename, 'rb'), 'rt', encoding='utf-8'))
+    results = [{
+        'reader': 'lzma.open',
+        'threads': 1,
+        'seconds': round(base, 3),
+        'mb_per_sec': round(num_chars / base / 1e6, 1),
+    }]
+    for num_threads in map(int, args.threads.split(',')):
+        lines, chars, elapsed = consume(iter_xz_lines(filename, num_threads))
+        assert (lines, chars) == (num_lines, num_chars), 'Readers disagree'
+        results.append({
+            'reader': 'iter_xz_lines',
+            'threads': num_threads,
+            'seconds': round(elapsed, 3),
+            'mb_per_sec': round(num_chars / elapsed / 1e6, 1),
+            'speedup': round(base / elapsed, 2),
+        })
+
+    print(json.dumps({'file': filename, 'blocks': num_blocks, 'lines': num_lines}))
+    for obj in results:
+        print(json.dumps(obj, sort_keys=True))
+    if not args.in_file:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,90 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Synthetic Pile-of-Law-like documents for the benchmarks.
+
+Document lengths follow a log-normal fit of the measured GPT-2 token lengths (p50 ~7.9k chars,
+p99 ~273k chars at ~3.5 chars per token), and the text is drawn from legal boilerplate so that
+tokenizers and compressors see realistic input.
+"""
+
+import random
+from typing import Iterator, List
+
+P50_CHARS = 7882
+SIGMA = 1.52
+MAX_CHARS = 1 << 20
+
+SUBSETS = [
+    'courtlisteneropinions', 'courtlistenerdocketentries', 'atticus_contracts', 'federal_register',
+    'bva', 'us_bills', 'cfr', 'uscode', 'frcp', 'constitutions'
+]
+
+SENTENCES = [
+    'The court of appeals reversed the judgment of the district court.',
+    'See Fed. R. Civ. P. 12(b)(6); Bell Atl. Corp. v. Twombly, 550 U.S. 544, 570 (2007).',
+    'Pursuant to 42 U.S.C. § 1983, the plaintiff seeks declaratory and injunctive relief.',
+    'No. 19-1392. Argued December 1, 2021. Decided June 24, 2022.',
+    'The Secretary shall prescribe such regulations as may be necessary to carry out this section.',
+    'This Agreement shall be governed by the laws of the State of Delaware.',
+    'Id. at 1234. The motion to dismiss is therefore GRANTED in part and DENIED in part.',
+    'Mr. Smith testified that he did not receive notice of the hearing until Jan. 3, 2019.',
+    '(a) In general.—Except as provided in subsection (b), no person shall be liable.',
+    'The Board finds that the evidence is in relative equipoise as to the claim for service '
+    'connection.',
+    'ORDERED, ADJUDGED AND DECREED that the petition is dismissed with prejudice.',
+    'Effective date: this rule is effective on January 1, 2023; comments are due by Dec. 1.',
+]
+
+
+def random_length(rng: random.Random) -> int:
+    """Draw a document length in characters.
+    Args:
+        rng (random.Random): Random number generator.
+    Returns:
+        int: Document length in characters.
+    """
+    return max(1, min(MAX_CHARS, int(rng.lognormvariate(0, SIGMA) * P50_CHARS)))
+
+
+def random_text(rng: random.Random, num_chars: int) -> str:
+    """Generate a legal-looking document of about the given length.
+    Args:
+        rng (random.Random): Random number generator.
+        num_chars (int): Target length in characters.
+    Returns:
+        str: Document text.
+    """
+    parts = []
+    size = 0
+    while size < num_chars:
+        sentence = rng.choice(SENTENCES)
+        parts.append(sentence)
+        size += len(sentence) + 1
+        if rng.random() < 0.1:
+            parts.append('\n\n')
+    return ' '.join(parts)[:num_chars]
+
+
+def each_text(num_docs: int, seed: int = 42) -> Iterator[str]:
+    """Generate synthetic documents.
+    Args:
+        num_docs (int): Number of documents.
+        seed (int): Random seed. Default: 42.
+    Returns:
+        Iterator[str]: Document texts.
+    """
+    rng = random.Random(seed)
+    for _ in range(num_docs):
+        yield random_text(rng, random_length(rng))
+
+
+def make_texts(num_docs: int, seed: int = 42) -> List[str]:
+    """Generate synthetic documents into a list.
+    Args:
+        num_docs (int): Number of documents.
+        seed (int): Random seed. Default: 42.
+    Returns:
+        List[str]: Document texts.
+    """
+    return list(each_text(num_docs, seed))
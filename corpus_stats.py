@@ -0,0 +1,269 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Compute length statistics of every document of a Pile of Law MDS dataset, in parallel.
+
+Each shard is read by a worker process, which counts the documents and sums the characters and
+tokens of each, per split and Pile of Law subset (the ``pol_set_name`` column, if the dataset has
+one). Lengths also go into quantile sketches (see quantile_sketch.py), which merge exactly and take
+the same memory however large the corpus is. Works on converted text datasets, where tokens are
+only counted given ``--tokenizer``, and on pretokenized ones, whose token counts are stored.
+
+    python corpus_stats.py --root mds-pol --tokenizer gpt2 --out_file stats.json
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from streaming.base.util import get_list_arg
+from tqdm import tqdm
+
+import pretokenize
+from mds_util import iter_shard, read_index, write_json
+from quantile_sketch import QuantileSketch
+
+QUANTILES = [0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 0.999]
+
+# Documents are tokenized in batches of this many, when counting tokens of a text dataset.
+TOKENIZE_BATCH_SIZE = 64
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        required=True,
+        help='Directory path of the MDS dataset, text or pretokenized, with one subdirectory ' +
+        'per split',
+    )
+    args.add_argument(
+        '--out_file',
+        type=str,
+        default='stats.json',
+        help='Path to write the statistics to. Default: stats.json',
+    )
+    args.add_argument(
+        '--tokenizer',
+        type=str,
+        default='',
+        help='Name or path of the HuggingFace tokenizer to count the tokens of a text dataset ' +
+        'with. Default: do not count tokens',
+    )
+    args.add_argument(
+        '--splits',
+        type=str,
+        default='train,validation',
+        help='Splits to scan. Default: train,validation',
+    )
+    args.add_argument(
+        '--relative_accuracy',
+        type=float,
+        default=0.01,
+        help='Relative error of the length quantiles. Default: 0.01',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of scanning processes. Default: all available cores',
+    )
+    return args.parse_args()
+
+
+class LengthStats:
+    """Exact count, sum, minimum and maximum of lengths, and a sketch of their quantiles.
+    Args:
+        relative_accuracy (float): Relative error of the quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float) -> None:
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, lengths: np.ndarray) -> None:
+        """Add lengths.
+        Args:
+            lengths (np.ndarray): Lengths.
+        """
+        if not len(lengths):
+            return
+        self.count += len(lengths)
+        self.total += int(lengths.sum())
+        low = int(lengths.min())
+        high = int(lengths.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.sketch.add(lengths)
+
+    def merge(self, other: 'LengthStats') -> None:
+        """Add the lengths counted by another one.
+        Args:
+            other (LengthStats): The other one.
+        """
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)  # pyright: ignore
+        self.max = other.max if self.max is None else max(self.max, other.max)  # pyright: ignore
+        self.sketch.merge(other.sketch)
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the statistics as JSON-compatible data.
+        Returns:
+            Dict[str, Any]: Sum, mean, minimum, maximum, quantiles, and the sketch.
+        """
+        obj: Dict[str, Any] = {
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+        }
+        for q in QUANTILES:
+            obj[f'p{q * 100:g}'] = round(self.sketch.quantile(q)) if self.count else None
+        obj['sketch'] = self.sketch.to_dict()
+        return obj
+
+
+# Statistics of one group of documents: metric name (chars, tokens) to its lengths.
+GroupStats = Dict[str, LengthStats]
+
+# Tokenizer of each worker process, loaded once by init_worker.
+tokenizer = None
+
+
+def init_worker(name: str) -> None:
+    """Load the tokenizer of a worker process, if tokens are to be counted.
+    Args:
+        name (str): Name or path of the HuggingFace tokenizer, or empty.
+    """
+    global tokenizer
+    if name:
+        # The pool already uses every core.
+        os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+        tokenizer = pretokenize.load_tokenizer(name)
+
+
+def shard_stats(task: Tuple[str, Dict[str, Any]], args: Namespace) -> Dict[str, GroupStats]:
+    """Compute the statistics of one shard. This is the unit of work of the process pool.
+    Args:
+        task (Tuple[str, Dict[str, Any]]): Dataset directory of the split, and metadata of the
+            shard.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Dict[str, GroupStats]: Statistics of each subset in the shard.
+    """
+    split_dir, info = task
+    lengths = defaultdict(lambda: defaultdict(list))
+    batch = []
+
+    def count_tokens() -> None:
+        ids = tokenizer([text for _, text in batch])['input_ids']  # pyright: ignore
+        for (subset, _), sample_ids in zip(batch, ids):
+            lengths[subset]['tokens'].append(len(sample_ids))
+        batch.clear()
+
+    token_size = np.dtype(pretokenize.TOKEN_DTYPE).itemsize
+    for sample in iter_shard(split_dir, info):
+        subset = sample.get('pol_set_name', 'all')
+        if 'tokens' in sample:
+            lengths[subset]['tokens'].append(len(sample['tokens']) // token_size)
+        if 'text' in sample:
+            lengths[subset]['chars'].append(len(sample['text']))
+            if tokenizer is not None:
+                batch.append((subset, sample['text']))
+                if len(batch) == TOKENIZE_BATCH_SIZE:
+                    count_tokens()
+    if batch:
+        count_tokens()
+
+    stats = {}
+    for subset, metrics in lengths.items():
+        stats[subset] = {}
+        for metric, values in metrics.items():
+            stats[subset][metric] = LengthStats(args.relative_accuracy)
+            stats[subset][metric].add(np.array(values, np.int64))
+    return stats
+
+
+def merge_stats(total: Dict[str, GroupStats], part: Dict[str, GroupStats],
+                relative_accuracy: float) -> None:
+    """Merge the statistics of part of a split into those of the split, in place.
+    Args:
+        total (Dict[str, GroupStats]): Statistics of each subset of the split.
+        part (Dict[str, GroupStats]): Statistics of each subset of the part.
+        relative_accuracy (float): Relative error of the quantiles.
+    """
+    for subset, metrics in part.items():
+        for name in [subset, 'all'] if subset != 'all' else ['all']:
+            for metric, stats in metrics.items():
+                group = total.setdefault(name, {})
+                group.setdefault(metric, LengthStats(relative_accuracy)).merge(stats)
+
+
+def split_stats(split_dir: str, split: str, args: Namespace) -> Dict[str, Any]:
+    """Compute the statistics of a split, scanning its shards in parallel.
+    Args:
+        split_dir (str): Dataset directory of the split.
+        split (str): Split name.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Dict[str, Any]: Statistics of the whole split, and of each subset.
+    """
+    infos = read_index(split_dir)
+    total = {}
+    with Pool(args.num_proc, init_worker, (args.tokenizer,)) as pool:
+        tasks = [(split_dir, info) for info in infos]
+        for part in tqdm(pool.imap_unordered(partial(shard_stats, args=args), tasks),
+                         total=len(tasks),
+                         desc=split):
+            merge_stats(total, part, args.relative_accuracy)
+
+    def summarize(metrics: GroupStats) -> Dict[str, Any]:
+        docs = max(stats.count for stats in metrics.values())
+        return {'docs': docs, **{name: stats.summary() for name, stats in metrics.items()}}
+
+    obj = summarize(total.pop('all')) if 'all' in total else {'docs': 0}
+    obj['subsets'] = {subset: summarize(metrics) for subset, metrics in sorted(total.items())}
+    return obj
+
+
+def main(args: Namespace) -> None:
+    """Compute the statistics of each split and write them to a JSON file.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    obj = {
+        'root': args.root,
+        'tokenizer': args.tokenizer or None,
+        'relative_accuracy': args.relative_accuracy,
+        'splits': {},
+    }
+    for split in get_list_arg(args.splits):
+        obj['splits'][split] = stats = split_stats(os.path.join(args.root, split), split, args)
+        summary = {'split': split, 'docs': stats['docs']}
+        for metric in ['chars', 'tokens']:
+            if metric in stats:
+                summary[metric] = stats[metric]['sum']
+                summary[f'{metric}_p50'] = stats[metric]['p50']
+                summary[f'{metric}_p99'] = stats[metric]['p99']
+        print(json.dumps(summary, sort_keys=True))
+    write_json(args.out_file, obj)
+
+
+if __name__ == '__main__':
+    main(parse_args())
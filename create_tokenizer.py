@@ -2,37 +2,372 @@
 # sequences process at ~1000samples / sec, total of 1M => ~20min to preprocess at 1M samples
 # followed by unknown tokenization time
 
-import datasets
+"""Train a byte-level BPE tokenizer on documents sampled from a converted Pile of Law MDS dataset.
+
+Documents are read straight from the MDS shards of a split, without loading or shuffling the
+whole dataset, and each one is cut to at most ``--max_doc_chars`` characters. They are sampled one
+of three ways:
+
+* ``reservoir``: one pass over every shard keeps a uniform sample of documents. The sample is held
+  in memory, so at most ``--memory_budget_gb`` worth of documents are kept, however many are asked
+  for.
+* ``shard``: whole shards are read in random order until enough documents are seen. Nothing is
+  held but a few batches in flight, so any number of documents fits, at the cost of documents of
+  a shard coming together.
+* ``stratified``: documents are drawn from each subset to ``--subset_quotas``, of documents or
+  characters, using the index that subset_index.py builds, so that the small subsets are not
+  drowned out by courtlistener. Only the shards that hold drawn documents are read.
+
+Shards are read and decoded by a background thread, a few batches ahead of the trainer.
+
+    python create_tokenizer.py --root mds-pol --num_samples 10000000 --sampling shard
+"""
+
+import os
+import random
+import re
+import sys
+from argparse import ArgumentParser, Namespace
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import Any, Dict, Iterator, List, Optional
+
 from transformers import AutoTokenizer
 
+from mds_util import iter_samples, iter_shard, read_index
+from subset_index import SubsetIndex, parse_quotas
+
+# Whitespace, the last of which before the character cap is where a document is cut.
+_SPACE = re.compile(r'\s')
+
+# Memory of a document's slot in the reservoir list, on top of the str itself.
+LIST_SLOT_BYTES = 8
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        default='mds-pol',
+        help='Directory path of the converted MDS dataset, with one subdirectory per split. ' +
+        'Default: mds-pol',
+    )
+    args.add_argument(
+        '--split',
+        type=str,
+        default='train',
+        help='Split to sample documents from. Default: train',
+    )
+    args.add_argument(
+        '--num_samples',
+        type=int,
+        default=1_000_000,
+        help='Number of documents to train on. Default: 1000000',
+    )
+    args.add_argument(
+        '--sampling',
+        type=str,
+        default='reservoir',
+        choices=['reservoir', 'shard', 'stratified'],
+        help='How to sample documents: reservoir (uniform, held in memory), shard (whole ' +
+        'shards in random order, streamed) or stratified (per-subset quotas, streamed). ' +
+        'Default: reservoir',
+    )
+    args.add_argument(
+        '--subset_quotas',
+        type=str,
+        default='20000',
+        help='With stratified sampling, comma-separated subset=quota pairs, and a bare quota ' +
+        'for every other subset, e.g. 20000,courtlisteneropinions=200000. Default: 20000',
+    )
+    args.add_argument(
+        '--quota_unit',
+        type=str,
+        default='docs',
+        choices=['docs', 'chars'],
+        help='What subset quotas count, documents or characters. Default: docs',
+    )
+    args.add_argument(
+        '--max_doc_chars',
+        type=int,
+        default=100_000,
+        help='Characters of each document to keep at most. Default: 100000',
+    )
+    args.add_argument(
+        '--memory_budget_gb',
+        type=float,
+        default=8,
+        help='Memory for the reservoir of documents, as the Python strs it holds measure ' +
+        'with sys.getsizeof. Default: 8',
+    )
+    args.add_argument(
+        '--seed',
+        type=int,
+        default=42,
+        help='Random seed of the sample. Default: 42',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=1000,
+        help='Documents per batch given to the trainer. Default: 1000',
+    )
+    args.add_argument(
+        '--prefetch',
+        type=int,
+        default=8,
+        help='Batches to read ahead of the trainer. Default: 8',
+    )
+    args.add_argument(
+        '--base_tokenizer',
+        type=str,
+        default='gpt2',
+        help='Tokenizer whose pipeline and special tokens to train a new vocab for. Default: gpt2',
+    )
+    args.add_argument(
+        '--vocab_size',
+        type=int,
+        default=52_000,  # 65_563; 52_000 for gpt5, 256_000 for PaLM
+        help='Vocab size. Default: 52000',
+    )
+    args.add_argument(
+        '--tokenizer_name',
+        type=str,
+        default='pile-of-law-tokenizer',
+        help='Directory, and Hub repo, to save the tokenizer to. Default: pile-of-law-tokenizer',
+    )
+    args.add_argument(
+        '--no_push_to_hub',
+        action='store_true',
+        help='Only save the tokenizer locally. By default it is also pushed to the HF Hub, ' +
+        'which needs huggingface-cli login first',
+    )
+    return args.parse_args()
+
+
+def cap_chars(text: str, max_chars: int) -> str:
+    """Cut a text to at most a number of characters, at whitespace if it has any in that range.
+    Cutting inside a word would count a word fragment that is not in the data.
+    Args:
+        text (str): Text.
+        max_chars (int): Maximum length.
+    Returns:
+        str: The text, or a prefix of it.
+    """
+    if len(text) <= max_chars:
+        return text
+    end = max_chars
+    for match in _SPACE.finditer(text, max_chars // 2, max_chars + 1):
+        end = match.start()
+    return text[:end]
+
+
+def iter_split_texts(split_dir: str, infos: List[Dict[str, Any]],
+                     max_chars: int) -> Iterator[str]:
+    """Read the documents of the given shards of a split, in order, capped in length.
+    Args:
+        split_dir (str): Dataset directory of the split.
+        infos (List[Dict[str, Any]]): Metadata of the shards to read.
+        max_chars (int): Characters of each document to keep at most.
+    Returns:
+        Iterator[str]: Document texts.
+    """
+    for info in infos:
+        for sample in iter_shard(split_dir, info):
+            yield cap_chars(sample['text'], max_chars)
+
+
+def doc_bytes(text: str) -> int:
+    """Get the memory a document takes in the reservoir.
+    Args:
+        text (str): Document text.
+    Returns:
+        int: Size of the str, which Python stores at 1, 2 or 4 bytes per character by its widest
+            one, plus its list slot.
+    """
+    return sys.getsizeof(text) + LIST_SLOT_BYTES
+
+
+def reservoir_sample(texts: Iterator[str], num_samples: int, max_bytes: int,
+                     seed: int) -> List[str]:
+    """Keep a uniform random sample of texts, in one pass (Algorithm R), within a memory budget.
+    The reservoir grows until it holds ``num_samples`` texts or the next would not fit in
+    ``max_bytes``. When a longer text replaces a shorter one and the budget is exceeded, random
+    texts are dropped until it fits again, which keeps the sample uniform.
+    Args:
+        texts (Iterator[str]): Texts.
+        num_samples (int): Sample size at most.
+        max_bytes (int): Memory the sampled texts may take, as measured by ``doc_bytes``.
+        seed (int): Random seed.
+    Returns:
+        List[str]: Sampled texts, all of them if there are no more than ``num_samples`` and they
+            fit.
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    held = 0
+    full = False
+    for seen, text in enumerate(texts):
+        size = doc_bytes(text)
+        if not full and len(reservoir) < num_samples and held + size <= max_bytes:
+            reservoir.append(text)
+            held += size
+            continue
+        full = True
+        slot = rng.randrange(seen + 1)
+        if slot < len(reservoir):
+            held += size - doc_bytes(reservoir[slot])
+            reservoir[slot] = text
+            while held > max_bytes:
+                slot = rng.randrange(len(reservoir))
+                held -= doc_bytes(reservoir[slot])
+                reservoir[slot] = reservoir[-1]
+                reservoir.pop()
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+def batched(texts: Iterator[str], batch_size: int) -> Iterator[List[str]]:
+    """Group texts into lists.
+    Args:
+        texts (Iterator[str]): Texts.
+        batch_size (int): Texts per list, but for the last.
+    Returns:
+        Iterator[List[str]]: Lists of texts.
+    """
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterator[Any], depth: int) -> Iterator[Any]:
+    """Produce items on a background thread, a bounded number ahead of the consumer.
+    Args:
+        items (Iterator[Any]): Items.
+        depth (int): Items to hold at most, waiting to be consumed.
+    Returns:
+        Iterator[Any]: The same items, in order. Errors of the producer are raised here.
+    """
+    queue = Queue(maxsize=depth)
+    done = object()
+    errors = []
+    stop = Event()
+
+    def put(item: Any) -> bool:
+        # Wait for room, unless the consumer has stopped and will never make any.
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    break
+        except Exception as err:
+            errors.append(err)
+        finally:
+            put(done)
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while (item := queue.get()) is not done:
+            yield item
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
 
-def get_training_corpus(dataset, total_samples):
-    for start_idx in range(0, total_samples, 1000):
-        samples = dataset[start_idx : start_idx + 1000]
-        yield samples["text"]
 
+def sample_size(args: Namespace, total: int) -> Optional[int]:
+    """Get the number of documents to train on.
+    Args:
+        args (Namespace): Command-line arguments.
+        total (int): Number of documents in the split.
+    Returns:
+        Optional[int]: ``num_samples``, or fewer if the split has fewer. A reservoir may end up
+            smaller still, if that many documents do not fit the memory budget. ``None`` for
+            stratified sampling, which only knows once it draws.
+    """
+    if args.sampling == 'stratified':
+        return None
+    return min(args.num_samples, total)
 
-def main():
-    VOCAB_SIZE = 52_000 # 65_563 # 52_000 for gpt5, 256_000 for PaLM
-    TOKENIZER_NAME = "pile-of-law-tokenizer"
 
-    ds = datasets.load_dataset("pile-of-law/pile-of-law", "all", cache_dir="hf_pol")
-    dataset = ds['train'].shuffle(seed=42)
+def get_training_corpus(args: Namespace) -> Iterator[List[str]]:
+    """Sample documents of a split and yield them in batches for the trainer.
+    Args:
+        args (Namespace): Command-line arguments.
+    Returns:
+        Iterator[List[str]]: Batches of document texts.
+    """
+    split_dir = os.path.join(args.root, args.split)
+    infos = read_index(split_dir)
+    num_samples = sample_size(args, sum(info['samples'] for info in infos))
+    if args.sampling == 'stratified':
+        index = SubsetIndex.load(split_dir)
+        quotas = parse_quotas(args.subset_quotas, index.subsets)
+        ids = index.sample(quotas, args.quota_unit, args.seed)
+        print(f'Sampled {len(ids)} documents from {len(quotas)} subsets.')
+        texts = (cap_chars(sample['text'], args.max_doc_chars)
+                 for _, sample in iter_samples(split_dir, ids))
+        yield from prefetch(batched(texts, args.batch_size), args.prefetch)
+    elif args.sampling == 'shard':
+        random.Random(args.seed).shuffle(infos)
+        texts = iter_split_texts(split_dir, infos, args.max_doc_chars)
+        batches = prefetch(batched(texts, args.batch_size), args.prefetch)
+        taken = 0
+        for batch in batches:
+            batch = batch[:num_samples - taken]
+            taken += len(batch)
+            yield batch
+            if taken == num_samples:
+                return
+    else:
+        texts = iter_split_texts(split_dir, infos, args.max_doc_chars)
+        batches = prefetch(batched(texts, args.batch_size), args.prefetch)
+        sample = reservoir_sample((text for batch in batches for text in batch), num_samples,
+                                  int(args.memory_budget_gb * (1 << 30)), args.seed)
+        if len(sample) < num_samples:
+            print(f'Sampled {len(sample)} documents, which fit in {args.memory_budget_gb} GB, ' +
+                  f'instead of {num_samples}.')
+        yield from batched(iter(sample), args.batch_size)
 
-    # total_samples = len(dataset)
-    total_samples = 1_000_000
 
-    training_corpus = get_training_corpus(dataset, total_samples)
+def main(args: Namespace) -> None:
+    """Train a tokenizer on sampled documents, save it, and push it to the HF Hub.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    total = sum(info['samples'] for info in read_index(os.path.join(args.root, args.split)))
+    training_corpus = get_training_corpus(args)
 
-    old_tokenizer = AutoTokenizer.from_pretrained("gpt2")
-    tokenizer = old_tokenizer.train_new_from_iterator(training_corpus, VOCAB_SIZE, length=total_samples)
+    old_tokenizer = AutoTokenizer.from_pretrained(args.base_tokenizer)
+    tokenizer = old_tokenizer.train_new_from_iterator(training_corpus,
+                                                      args.vocab_size,
+                                                      length=sample_size(args, total))
     # save
-    tokenizer.save_pretrained(TOKENIZER_NAME)
+    tokenizer.save_pretrained(args.tokenizer_name)
 
     # upload
     # you must have run hunggingface_cli login prior to this
-    tokenizer.push_to_hub(TOKENIZER_NAME, use_auth_token=True)
+    if not args.no_push_to_hub:
+        tokenizer.push_to_hub(args.tokenizer_name, use_auth_token=True)
 
 
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+if __name__ == '__main__':
+    main(parse_args())
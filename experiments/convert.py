@@ -24,24 +24,31 @@ and no test file
 You then run this script specifying --in_root (the above dir), --out_root (the dir to create),
 and any other flags as appropriate, e.g.
 
-python convert.py --in_root $(pwd)/data --out_root $(pwd)/mds-pol --train_only
+python -m experiments.convert --in_root $(pwd)/data --out_root $(pwd)/mds-pol --train_only
 or
-python convert.py --in_root $(pwd)/data --out_root $(pwd)/mds-pol --num_proc 1
+python -m experiments.convert --in_root $(pwd)/data --out_root $(pwd)/mds-pol --num_proc 1
 """
 
 import json
-import lzma
 import os
 from argparse import ArgumentParser, Namespace
 from collections import Counter
+from functools import partial
 from glob import glob
 from multiprocessing import Pool
-from typing import Dict, Iterator, List, Tuple
+from shutil import rmtree
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import tqdm
-from streaming.base import MDSWriter
 from streaming.base.util import get_list_arg
 
+from experiments.records import RECORD_DECODERS
+from experiments.xz_reader import iter_xz_lines, xz_blocks, xz_size
+from mds_util import (ConversionJournal, PoLMDSWriter, StageTimer, commit_split, file_fingerprint,
+                      finalize_group, is_converted, merge_shard_groups, partial_dirname,
+                      profile_report, remove_partial_groups, split_and_group, write_json)
+
 
 def parse_args() -> Namespace:
     """Parse command-line arguments.
@@ -87,11 +94,46 @@ def parse_args() -> Namespace:
         default=None,
         help='Number of processes to use, defaults to all available cores',
     )
+    args.add_argument(
+        '--xz_threads',
+        type=int,
+        default=1,
+        help='Threads per process for decompressing the xz blocks of an input file in parallel. ' +
+        'Only helps with multi-block files, such as those written by xz -T. Default: 1',
+    )
+    args.add_argument(
+        '--range_size',
+        type=int,
+        default=1 << 32,
+        help='Split multi-block input files that decompress to more than this many bytes into ' +
+        'ranges of about this size, at block starts, each converted by its own task into its ' +
+        'own shard group. Set to 0 to convert whole files. Default: 1 << 32',
+    )
+    args.add_argument(
+        '--record_decoder',
+        type=str,
+        default='fast',
+        choices=sorted(RECORD_DECODERS),
+        help='How to decode and validate JSONL records: fast extracts the text without ' +
+        'building a dict of every field, json uses json.loads. Default: fast',
+    )
+    args.add_argument(
+        '--profile_file',
+        type=str,
+        default='',
+        help='If set, time each stage of the conversion (decompress, parse, encode, ' +
+        'hash, compress_write) and write a JSON report of the totals per input file, per ' +
+        'worker and overall to this path. Default: disabled',
+    )
     return args.parse_args()
 
 
+# Input file, output directory, compression, hashes, size limit, and decompressed byte range.
+Task = Tuple[str, str, str, List[str], int, Tuple[int, Optional[int]]]
+
+
 def each_task(in_root: str, out_root: str, compression: str, hashes: List[str], size_limit: int,
-              in_files: List[str]) -> Iterator[Tuple[str, str, str, List[str], int]]:
+              in_files: List[str]) -> Iterator[Task]:
     """Get the arg tuple corresponding to each JSONL input file to convert to streaming.
     Args:
         in_root (str): Root directory of input JSONL files.
@@ -101,49 +143,113 @@ def each_task(in_root: str, out_root: str, compression: str, hashes: List[str],
         size_limit (int): Shard size limit, after which point to start a new shard.
         in_files (List[str]): List of input files to generate arguments for.
     Returns:
-        Iterator[Tuple[str, str, str, List[str], int]]: Each argument tuple.
+        Iterator[Task]: Each argument tuple, covering the whole input file.
     """
     for in_file in in_files:
         assert in_file.startswith(in_root)
         assert in_file.endswith('.jsonl.xz')
-        name = in_file[len(in_root) + 1 : -len('.jsonl.xz')]  # train.eoir
-        name = name.replace('.', os.path.sep)  # train/eoir
-        sub_out_dir, name = name.split(os.path.sep)[0], name.split(os.path.sep)[1]
+        # train.courtlisteneropinions.7 -> train/courtlisteneropinions.7
+        sub_out_dir, name = split_and_group(in_file)
         out_dir = os.path.join(out_root, sub_out_dir, name)
-        yield in_file, out_dir, compression, hashes, size_limit
+        yield in_file, out_dir, compression, hashes, size_limit, (0, None)
+
+
+def file_ranges(in_file: str, range_size: int) -> List[Tuple[int, Optional[int]]]:
+    """Split an input file into ranges of decompressed bytes to convert independently.
+    Boundaries are moved to the nearest xz block start, so that no block is decompressed twice.
+    A single-block file, which is how the Pile of Law ships, is not split: every range would have
+    to decompress it from the start up to where it begins.
+    Args:
+        in_file (str): Path to the .jsonl.xz input file.
+        range_size (int): Target decompressed bytes per range, or 0 to not split.
+    Returns:
+        List[Tuple[int, Optional[int]]]: Start and end offset of each range, in order. A file
+            that is not split is one range, ``(0, None)``.
+    """
+    blocks = xz_blocks(in_file)
+    size = sum(block.uncompressed_size for block in blocks)
+    if not range_size or size <= range_size or len(blocks) == 1:
+        return [(0, None)]
+    block_starts = [0]
+    for block in blocks:
+        block_starts.append(block_starts[-1] + block.uncompressed_size)
+    num_ranges = -(-size // range_size)
+    bounds = [0]
+    for idx in range(1, num_ranges):
+        target = size * idx // num_ranges
+        target = min(block_starts, key=lambda start: abs(start - target))
+        if bounds[-1] < target < size:
+            bounds.append(target)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def range_dirname(out_dir: str, idx: int) -> str:
+    """Get the shard group directory of a range of an input file.
+    Args:
+        out_dir (str): Shard group directory of the input file.
+        idx (int): Index of the range.
+    Returns:
+        str: Shard group directory of the range.
+    """
+    return f'{out_dir}.range{idx:05}'
 
 
-def file_to_dir(args: Tuple[str, str, str, List[str], int]) -> Dict[str, int]:
-    """Convert a JSONL input file into a directory of MDS shards.
-    This is the unit of work executed by the process pool.
+def remove_stale_ranges(out_dir: str, range_dirs: List[str]) -> None:
+    """Delete the range shard groups of an input file that are not among its current ranges,
+    such as those left by a run with another ``--range_size``.
+    Args:
+        out_dir (str): Shard group directory of the input file.
+        range_dirs (List[str]): Shard group directories of its current ranges.
+    """
+    for dirname in glob(f'{out_dir}.range*'):
+        if dirname not in range_dirs:
+            rmtree(dirname)
+
+
+def file_to_dir(args: Task,
+                timer: Optional[StageTimer] = None,
+                xz_threads: int = 1,
+                record_decoder: str = 'fast') -> Dict[str, int]:
+    """Convert a JSONL input file, or a range of it, into a directory of MDS shards.
+    This is the unit of work executed by the process pool. The shards are written to a partial
+    directory which is only moved to ``out_dir`` once the whole file has been converted.
     Args:
-        args (Tuple[str, str, str, List[str], int): All arguments, packed into a tuple because
-            process pools only pass one argument.
+        args (Task): All arguments, packed into a tuple because process pools only pass one
+            argument.
+        timer (StageTimer, optional): If set, time each stage of the conversion into it.
+            Defaults to ``None``.
+        xz_threads (int): Number of threads to decompress the input file with. Default: ``1``.
+        record_decoder (str): Name of the JSONL record decoder. Default: ``fast``.
     Returns:
         Dict[str, int]: Count of how many samples belonged to each Pile dataset subset.
     """
-    in_file, out_dir, compression, hashes, size_limit = args
+    in_file, out_dir, compression, hashes, size_limit, (start, end) = args
 
     columns = {
         'text': 'str',
         'pol_set_name': 'str',
     }
 
+    # mostly the file name is the set name, but when there is more than one shard per set
+    # it has an int suffix, e.g. courtlisteneropinions.7
+    pol_set_name = split_and_group(in_file)[1].split('.')[0]
+
+    lines = iter_xz_lines(in_file, xz_threads, start, end)
+    decode = RECORD_DECODERS[record_decoder]
+    if timer:
+        # Text stages count characters, which for this corpus is close to bytes.
+        lines = timer.timed('decompress', lines)
+        decode = timer.wrap('parse', decode)
+
     counts = Counter()
-    with MDSWriter(out_dir, columns, compression, hashes, size_limit) as out:
-        print(in_file)
-        for line in tqdm.tqdm(lzma.open(open(in_file, 'rb'), 'rt', encoding='utf-8')):
-            obj = json.loads(line)
-            if obj is None:
+    with PoLMDSWriter(partial_dirname(out_dir), columns, compression, hashes, size_limit,
+                      timer=timer) as out:
+        print(in_file if end is None and not start else f'{in_file} [{start}, {end})')
+        for line in tqdm.tqdm(lines):
+            text = decode(line)
+            if text is None:
                 continue
-            pol_set_name = out_dir.split(os.path.sep)[-1]
-            if pol_set_name[-1].isnumeric():
-                # mostly the file name is the set name, but when there is more than one shard per set
-                # it has an int suffix, e.g. courtlisteneropinions.7
-                pol_set_name = pol_set_name.split('.')[0]
-            if sorted(obj.keys()) != ['created_timestamp', 'downloaded_timestamp', 'text', 'url']:
-                raise ValueError('Invalid sample fields.')
-            text = obj['text']
 
             sample = {
                 'text': text,
@@ -151,61 +257,111 @@ def file_to_dir(args: Tuple[str, str, str, List[str], int]) -> Dict[str, int]:
             }
             out.write(sample)
             counts[pol_set_name] += 1
+    finalize_group(out_dir)
+    if timer:
+        # Attribute the compressed bytes of a split file to its ranges in proportion.
+        bytes_in = os.path.getsize(in_file)
+        if end is not None:
+            bytes_in = bytes_in * (end - start) // xz_size(in_file)
+        timer.add('decompress', 0, bytes_in=bytes_in, calls=0)
     return counts
 
 
-def with_id(basename: str, shard_id: int) -> str:
-    """Get a new basename with the given shard_id.
+def convert_task(
+    args: Task,
+    profile: bool = False,
+    xz_threads: int = 1,
+    record_decoder: str = 'fast'
+) -> Tuple[Task, Dict[str, int], Optional[Dict[str, Any]]]:
+    """Run ``file_to_dir``, keeping track of which task the result belongs to.
     Args:
-        basename (str): Old basename of file.
-        shard_id (int): New shard ID.
+        args (Task): All arguments of ``file_to_dir``.
+        profile (bool): Whether to time the stages of the conversion. Default: ``False``.
+        xz_threads (int): Number of threads to decompress the input file with. Default: ``1``.
+        record_decoder (str): Name of the JSONL record decoder. Default: ``fast``.
     Returns:
-        str: New basename of file.
+        Tuple[Task, Dict[str, int], Optional[Dict[str, Any]]]: The arguments, the result, and
+            the stage timings if profiling.
     """
-    parts = basename.split('.')
-    parts[1] = f'{shard_id:05}'
-    return '.'.join(parts)
+    timer = StageTimer() if profile else None
+    counts = file_to_dir(args, timer, xz_threads, record_decoder)
+    unit = None
+    if timer:
+        unit = {
+            'file': args[0],
+            'range': list(args[5]),
+            'worker': os.getpid(),
+            'stages': timer.stages,
+        }
+    return args, counts, unit
+
+
+def task_key(out_dir: str) -> str:
+    """Get the journal key of the task converting into the given shard group.
+    Args:
+        out_dir (str): Shard group directory, ``out_root/split/group``.
+    Returns:
+        str: Journal key, ``split/group``.
+    """
+    return '/'.join(out_dir.split(os.path.sep)[-2:])
 
 
-def merge_shard_groups(root: str) -> None:
-    """Merge ephemeral sub-datasets created in parallel into one dataset.
+def record_task(journal: ConversionJournal, task: Task, counts: Dict[str, int],
+                fingerprint: str) -> None:
+    """Print the result of a finished task and record it in the journal.
     Args:
-        root (str): Root directory.
+        journal (ConversionJournal): Conversion journal.
+        task (Task): Arguments of the task.
+        counts (Dict[str, int]): Count of how many samples belonged to each Pile dataset subset.
+        fingerprint (str): Fingerprint of the input file when the task was planned, which is
+            what the output was converted from.
     """
-    pattern = os.path.join(root, '*')
-    subdirs = sorted(glob(pattern))
-    shard_id = 0
-    infos = []
-    for subdir in subdirs:
-        index_filename = os.path.join(subdir, 'index.json')
-        obj = json.load(open(index_filename))
-        for info in obj['shards']:
-            old_basename = info['raw_data']['basename']
-            new_basename = with_id(old_basename, shard_id)
-            info['raw_data']['basename'] = new_basename
-
-            old_basename = info['zip_data']['basename']
-            new_basename = with_id(old_basename, shard_id)
-            info['zip_data']['basename'] = new_basename
-
-            old_filename = os.path.join(subdir, old_basename)
-            new_filename = os.path.join(root, new_basename)
-            assert not os.rename(old_filename, new_filename)
-
-            shard_id += 1
-            infos.append(info)
-
-        assert not os.remove(index_filename)
-        assert not os.rmdir(subdir)
-
-    index_filename = os.path.join(root, 'index.json')
+    in_file, out_dir = task[:2]
     obj = {
-        'version': 2,
-        'shards': infos,
+        'file': in_file,
+        'counts': counts,
     }
-    text = json.dumps(obj, sort_keys=True)
-    with open(index_filename, 'w') as out:
-        out.write(text)
+    fields = {}
+    if task[5] != (0, None):
+        obj['range'] = fields['range'] = list(task[5])
+    print(json.dumps(obj, sort_keys=True))
+    journal.record(task_key(out_dir),
+                   file=in_file,
+                   fingerprint=fingerprint,
+                   counts=counts,
+                   samples=sum(counts.values()),
+                   **fields)
+
+
+def is_range_converted(journal: ConversionJournal, task: Task, fingerprint: str) -> bool:
+    """Check whether a range of an input file's current contents is already converted.
+    Args:
+        journal (ConversionJournal): Conversion journal.
+        task (Task): Arguments of the task converting the range.
+        fingerprint (str): Current fingerprint of the input file.
+    Returns:
+        bool: Whether the range can be skipped.
+    """
+    entry = journal.get(task_key(task[1]))
+    return bool(entry) and entry.get('fingerprint') == fingerprint and \
+        entry.get('range') == list(task[5])
+
+
+def merge_ranges(journal: ConversionJournal, task: Task, range_tasks: List[Task],
+                 fingerprint: str) -> None:
+    """Merge the converted ranges of an input file into its shard group and journal the file.
+    Args:
+        journal (ConversionJournal): Conversion journal.
+        task (Task): Arguments of the whole-file task.
+        range_tasks (List[Task]): Arguments of the tasks that converted its ranges, in order.
+        fingerprint (str): Fingerprint of the input file the ranges were converted from.
+    """
+    in_file, out_dir = task[:2]
+    merge_shard_groups(out_dir, [range_task[1] for range_task in range_tasks])
+    counts = Counter()
+    for range_task in range_tasks:
+        counts.update(journal.get(task_key(range_task[1]))['counts'])  # pyright: ignore
+    record_task(journal, task, dict(counts), fingerprint)
 
 
 def main(args: Namespace) -> None:
@@ -223,35 +379,102 @@ def main(args: Namespace) -> None:
 
     in_files = trains + validations
 
-    # Get the arguments for each JSONL file conversion.
-    arg_tuples = each_task(args.in_root, args.out_root, args.compression, hashes, args.size_limit,
-                           in_files)
-
-    # Process each JSONL file in parallel into directories of shards.
+    # Skip the files that an earlier run already converted, according to the journal.
+    journal = ConversionJournal(os.path.join(args.out_root, 'journal.jsonl'))
+    tasks = list(
+        each_task(args.in_root, args.out_root, args.compression, hashes, args.size_limit,
+                  in_files))
+    for split in ['train', 'validation']:
+        remove_partial_groups(os.path.join(args.out_root, split))
+
+    # Split large input files into ranges, each converted into a shard group of its own, so that
+    # the biggest files do not bound the wall time. Ranges converted by an earlier run are kept.
+    pending = []
+    sizes = {}  # Output directory of each pending task -> decompressed bytes to convert.
+    file_tasks = {}  # Output directory of each split input file -> its whole-file task.
+    range_tasks = {}  # Output directory of each split input file -> its range tasks.
+    ranges_left = {}  # Output directory of each split input file -> those of its ranges left.
+    fingerprints = {}  # Input file -> its fingerprint, taken before it is converted.
+    for task in tasks:
+        in_file, out_dir = task[:2]
+        split, group = task_key(out_dir).split('/')
+        split_root = os.path.join(args.out_root, split)
+        fingerprint = fingerprints[in_file] = file_fingerprint(in_file)
+        if is_converted(journal, split_root, split, group, fingerprint):
+            remove_stale_ranges(out_dir, [])
+            continue
+        ranges = file_ranges(in_file, args.range_size)
+        if len(ranges) == 1:
+            remove_stale_ranges(out_dir, [])
+            pending.append(task)
+            sizes[out_dir] = xz_size(in_file)
+            continue
+        file_tasks[out_dir] = task
+        range_tasks[out_dir] = [
+            task[:1] + (range_dirname(out_dir, idx),) + task[2:5] + (bounds,)
+            for idx, bounds in enumerate(ranges)
+        ]
+        ranges_left[out_dir] = set()
+        remove_stale_ranges(out_dir, [range_task[1] for range_task in range_tasks[out_dir]])
+        for range_task in range_tasks[out_dir]:
+            begin, end = range_task[5]
+            if not is_range_converted(journal, range_task, fingerprint):
+                pending.append(range_task)
+                sizes[range_task[1]] = end - begin  # pyright: ignore
+                ranges_left[out_dir].add(range_task[1])
+        if not ranges_left[out_dir]:
+            merge_ranges(journal, task, range_tasks[out_dir], fingerprint)
+    num_pending = len(pending) - sum(map(len, ranges_left.values())) + len(ranges_left)
+    if num_pending < len(tasks):
+        print(f'{len(tasks) - num_pending} of {len(tasks)} input files are up to date')
+
+    # Start the biggest conversions first.
+    pending.sort(key=lambda task: sizes[task[1]], reverse=True)
+    range_files = {}  # Output directory of each pending range task -> that of its input file.
+    for out_dir, left in ranges_left.items():
+        for range_dir in left:
+            range_files[range_dir] = out_dir
+
+    def finish(task: Task, counts: Dict[str, int]) -> None:
+        fingerprint = fingerprints[task[0]]
+        record_task(journal, task, counts, fingerprint)
+        out_dir = range_files.get(task[1])
+        if out_dir:
+            ranges_left[out_dir].remove(task[1])
+            if not ranges_left[out_dir]:
+                merge_ranges(journal, file_tasks[out_dir], range_tasks[out_dir], fingerprint)
+
+    # Process each JSONL file or range in parallel into directories of shards.
+    start = time()
+    units = []
+    run_task = partial(convert_task,
+                       profile=bool(args.profile_file),
+                       xz_threads=args.xz_threads,
+                       record_decoder=args.record_decoder)
     if args.num_proc and args.num_proc > 1:
         with Pool(processes=args.num_proc) as pool:
-            counters = pool.imap(file_to_dir, arg_tuples)
-            for in_file, counts in zip(in_files, counters):
-                obj = {
-                    'file': in_file,
-                    'counts': counts,
-                }
-                print(json.dumps(obj, sort_keys=True))
+            for task, counts, unit in pool.imap_unordered(run_task, pending):
+                finish(task, counts)
+                units.append(unit)
     else:
-        counters = [file_to_dir(arg_tup) for arg_tup in arg_tuples]
-        for in_file, counts in zip(in_files, counters):
-            obj = {
-                'file': in_file,
-                'counts': counts,
-            }
-            print(json.dumps(obj, sort_keys=True))
-
-    # Merge shard groups.
-    train_root = os.path.join(args.out_root, 'train')
-    merge_shard_groups(train_root)
-
-    validation_root = os.path.join(args.out_root, 'validation')
-    merge_shard_groups(validation_root)
+        for task, counts, unit in map(run_task, pending):
+            finish(task, counts)
+            units.append(unit)
+
+    # Merge new and changed shard groups into each split.
+    for split in ['train', 'validation']:
+        split_root = os.path.join(args.out_root, split)
+        groups = []
+        for task in tasks:
+            task_split, group = task_key(task[1]).split('/')
+            if task_split == split:
+                groups.append(group)
+        commit_split(journal, split_root, split, groups)
+
+    if args.profile_file:
+        report = profile_report(units, time() - start)
+        write_json(args.profile_file, report)
+        print(json.dumps(report['total'], indent=2, sort_keys=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Decoders that turn a Pile of Law JSONL line into the text of its record.
+
+Every record has the same four string fields. ``decode_json`` builds the whole dict and checks its
+keys. ``decode_fast`` matches the three short fields with a regex on either side of the text,
+decodes only the text, and hands any line it does not expect to ``decode_json``, so that both
+accept and reject exactly the same lines.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Callable, Dict, Optional
+
+FIELDS = frozenset(['created_timestamp', 'downloaded_timestamp', 'text', 'url'])
+OTHER_FIELDS = FIELDS - {'text'}
+
+# A short field without escapes or control characters, e.g. "url": "https://...".
+_FIELD = r'"(\w+)"[ \t]*:[ \t]*"[^"\\\x00-\x1f]*"'
+_SEP = r'[ \t]*,[ \t]*'
+_TEXT = r'"text"[ \t]*:[ \t]*"'
+
+# Text last: everything up to the opening quote of the text, then the end of the line after it.
+_HEAD_BEFORE_TEXT = re.compile(r'[ \t]*\{[ \t]*' + (_FIELD + _SEP) * 3 + _TEXT)
+_TAIL_AFTER_TEXT = re.compile(r'[ \t]*\}[ \t\r\n]*')
+
+# Text first: the start of the line, then everything after the closing quote of the text.
+_HEAD_TEXT = re.compile(r'[ \t]*\{[ \t]*' + _TEXT)
+_TAIL_FIELDS = re.compile((_SEP + _FIELD) * 3 + r'[ \t]*\}[ \t\r\n]*')
+
+
+def decode_json(line: str) -> Optional[str]:
+    """Decode a record with ``json.loads`` and check that it has exactly the expected fields.
+    Args:
+        line (str): JSON line.
+    Returns:
+        Optional[str]: Text of the record, or ``None`` if the line is ``null``.
+    """
+    obj = json.loads(line)
+    if obj is None:
+        return None
+    if sorted(obj.keys()) != sorted(FIELDS):
+        raise ValueError('Invalid sample fields.')
+    return obj['text']
+
+
+def decode_fast(line: str) -> Optional[str]:
+    """Extract the text of a record without building a dict of its fields.
+    Handles records with the text first or last. Any other line is passed on to ``decode_json``.
+    Args:
+        line (str): JSON line.
+    Returns:
+        Optional[str]: Text of the record, or ``None`` if the line is ``null``.
+    """
+    try:
+        match = _HEAD_BEFORE_TEXT.match(line)
+        if match:
+            if set(match.groups()) == OTHER_FIELDS:
+                text, end = scanstring(line, match.end())
+                if _TAIL_AFTER_TEXT.fullmatch(line, end):
+                    return text
+        else:
+            match = _HEAD_TEXT.match(line)
+            if match:
+                text, end = scanstring(line, match.end())
+                match = _TAIL_FIELDS.fullmatch(line, end)
+                if match and set(match.groups()) == OTHER_FIELDS:
+                    return text
+    except ValueError:
+        pass
+    return decode_json(line)
+
+
+RECORD_DECODERS: Dict[str, Callable[[str], Optional[str]]] = {
+    'json': decode_json,
+    'fast': decode_fast,
+}
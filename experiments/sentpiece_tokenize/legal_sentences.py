@@ -0,0 +1,130 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Split legal text into sentences with compiled regular expressions, as a fast spaCy alternative.
+
+A sentence ends at a blank line, or at ``.``, ``?`` or ``!`` (and any closing quotes or brackets
+after it) followed by whitespace and then something that can start a sentence: a capital letter,
+a digit, ``§``, an opening quote or bracket, or a marker such as "(a)". A period does not end a
+sentence after a known abbreviation, such as the parts of "Fed. R. Civ. P.", "U.S.", "v." or
+"Id.", after "No." or "Nos." followed by a number, after a single letter (an initial), or after a
+capitalized word of letters and digits with periods inside it, which covers citation forms such as
+"U.S.C.", "F.2d" or "S.Ct." but not amounts such as "$1,234.56" or addresses such as
+"www.uscourts.gov". A sentence that really does end with
+an abbreviation is joined to the next one, which is the usual trade for not splitting citations
+apart.
+"""
+
+import re
+from typing import Iterable, List, Tuple
+
+# Abbreviations, lowercased and without their final period, that are abbreviations however they
+# are capitalized.
+LEGAL_ABBREVIATIONS = frozenset('''
+    a.m p.m e.g i.e cf viz et al etc id ibid supra infra v vs art arts sec secs ch cl pt
+    para paras p pp n nn fn vol ed eds amend supp
+'''.split())
+
+# Abbreviations, lowercased and without their final period, that are only abbreviations before a
+# number, as in "No. 19-1392"; "there is no. The" ends a sentence.
+NUMBER_ABBREVIATIONS = frozenset(['no', 'nos'])
+
+# Abbreviations that are only abbreviations when capitalized; "so." or "ill." can end a sentence.
+CAPITALIZED_ABBREVIATIONS = frozenset('''
+    fed reg stat pub cong rep sess res doc r civ crim evid app bankr prac proc const ann rev gen
+    admin cir ct dist f so
+    mr mrs ms dr jr sr hon prof messrs esq
+    inc co corp ltd llc llp bros assn ass'n dep't gov't att'y comm'n int'l nat'l
+    dept govt atty commn intl natl univ sch bd cnty twp mun st ave blvd rd
+    am atl auth bhd cas chem cmty comm constr coop corp corr ctr dev distrib div econ educ elec
+    emp eng'g envtl equip exch fin found grp hosp hous indus ins inv mfg mgmt med mkt mut ne nw
+    org pac pharm prods prop ry sav sci serv soc sw sys tech tel transp tr util vill
+    jan feb mar apr jun jul aug sep sept oct nov dec
+    ala ariz ark cal colo conn del fla ga ill ind kan ky la md mass mich minn miss mo mont
+    neb nev okla or pa tenn tex vt va wash wis wyo
+'''.split())
+
+# Candidate ends of sentences: terminal punctuation, closers, whitespace, then a sentence opener,
+# which may also be a paragraph marker such as "(a)" or "(iv)".
+_BOUNDARY = re.compile(r'''([.?!]["'”’)\]]*)\s+''' +
+                       r'''(?=["'“‘(\[]?[A-Z0-9§]|\([a-z0-9]{1,4}\)\s)''')
+
+# Blank lines, which always end a sentence.
+_PARAGRAPH = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+
+# Citation forms with periods inside them, such as "U.S.C", "F.2d" or "L.Ed.2d".
+_DOTTED = re.compile(r'[A-Z][A-Za-z]*(\.[A-Za-z0-9]+)+')
+
+# Characters that can open a word before an abbreviation, as in "(Fed. R. Civ. P. 12)".
+_OPENERS = '("\'“‘['
+
+
+def _is_abbreviation(word: str, following: str) -> bool:
+    """Check whether a period after a word is part of an abbreviation rather than a full stop.
+    Args:
+        word (str): The word, without the period.
+        following (str): Text after the period and the whitespace that follows it.
+    Returns:
+        bool: Whether the period does not end a sentence.
+    """
+    if len(word) == 1 and word.isalpha():
+        return True
+    if _DOTTED.fullmatch(word):
+        return True
+    lower = word.lower()
+    if lower in NUMBER_ABBREVIATIONS:
+        return following[:1].isdigit()
+    return lower in LEGAL_ABBREVIATIONS or \
+        (word[:1].isupper() and lower in CAPITALIZED_ABBREVIATIONS)
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """Find the sentences of a text.
+    Args:
+        text (str): Text.
+    Returns:
+        List[Tuple[int, int]]: Begin and end of each sentence, without surrounding whitespace.
+    """
+    ends = []
+    for match in _PARAGRAPH.finditer(text):
+        ends.append(match.start())
+    for match in _BOUNDARY.finditer(text):
+        end = match.end(1)
+        if text[match.start()] == '.':
+            words = text[max(0, match.start() - 64):match.start()].rsplit(None, 1)
+            if words and _is_abbreviation(words[-1].lstrip(_OPENERS), text[match.end():]):
+                continue
+        ends.append(end)
+    ends.sort()
+    ends.append(len(text))
+
+    spans = []
+    begin = 0
+    for end in ends:
+        chunk = text[begin:end]
+        stripped = chunk.strip()
+        if stripped:
+            left = begin + len(chunk) - len(chunk.lstrip())
+            spans.append((left, left + len(stripped)))
+        begin = end
+    return spans
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text into sentences.
+    Args:
+        text (str): Text.
+    Returns:
+        List[str]: Non-empty sentences, without surrounding whitespace.
+    """
+    return [text[begin:end] for begin, end in sentence_spans(text)]
+
+
+def split_batch(texts: Iterable[str]) -> List[List[str]]:
+    """Split a batch of texts into sentences.
+    Args:
+        texts (Iterable[str]): Texts.
+    Returns:
+        List[List[str]]: Sentences of each text.
+    """
+    return [split_sentences(text) for text in texts]
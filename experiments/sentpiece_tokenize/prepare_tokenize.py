@@ -1,10 +1,19 @@
-"""
-convert to sentences on newlines text file for sentencepiece
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Convert a Pile of Law MDS split to a text file of sentences, one per line, for sentencepiece.
+
+Each worker process takes a contiguous range of shards at a time, segments its documents in that
+process, with spaCy or with the much faster regex splitter of legal_sentences.py, and streams the
+sampled sentences of each document to a file of its own, so the work is spread over every core
+and memory stays at one shard per worker. A range's file is renamed into place when it is
+complete and recorded in ``journal.jsonl`` in the output directory, so an interrupted run picks up
+at the ranges that did not finish. The range files are then concatenated, in order, into one file.
 
 only have lengths in gpt2 tokens, estimate to get chars
 
 #################### Sequence Length distribution ####################
-p50: 2252 * 3.5 = 7882 
+p50: 2252 * 3.5 = 7882
 p75: 5378 * 3.5 = 18_823
 p99: 77989 * 3.5 = 273_000
 
@@ -12,39 +21,109 @@ p99: 77989 * 3.5 = 273_000
 mean sample length: 7019 tokens *3.5 = 24_566
 51987222437 tokens
 
-run with 
-composer prepare_tokenize.py ../mds-pol
+run from the root of the repo with
 
-or
-
-torchrun \
-    --rdzv_backend=c10d \
-    --rdzv_endpoint=localhost:0 \
-    --nnodes=1 \
-    --nproc_per_node=1 \
-    prepare_tokenize.py ../mds-pol
+    python -m experiments.sentpiece_tokenize.prepare_tokenize --root mds-pol --num_proc 48
 """
 
+import os
 import random
 import shutil
-from typing import List, Optional
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from glob import glob
 from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Tuple
 
-import spacy
-import tqdm
-from omegaconf import OmegaConf
-import streaming as ms
+from tqdm import tqdm
 
+from experiments.sentpiece_tokenize.legal_sentences import split_batch
+from mds_util import ConversionJournal, iter_shard, read_index
 
-p50 = 7882 
+p50 = 7882
 p75 = 18_823
 p99 = 273_000
 
+# spaCy pipeline of each worker process, loaded once by init_worker.
+nlp = None
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        default='mds-pol',
+        help='Directory path of the converted MDS dataset. Default: mds-pol',
+    )
+    args.add_argument(
+        '--split',
+        type=str,
+        default='train',
+        help='Split to segment. Default: train',
+    )
+    args.add_argument(
+        '--out_dir',
+        type=str,
+        default='pol_sentences',
+        help='Directory for the sentence file of each shard range, and the journal. ' +
+        'Default: pol_sentences',
+    )
+    args.add_argument(
+        '--out_file',
+        type=str,
+        default='pol_sentences.txt',
+        help='Path of the file of all sentences. Default: pol_sentences.txt',
+    )
+    args.add_argument(
+        '--shards_per_range',
+        type=int,
+        default=4,
+        help='Shards per unit of work, which is written, and resumed, as a whole. Default: 4',
+    )
+    args.add_argument(
+        '--segmenter',
+        type=str,
+        default='spacy',
+        choices=['spacy', 'regex'],
+        help='How to split sentences: with a spaCy parse, or with the rule-based splitter of ' +
+        'legal_sentences.py, which is far faster. Default: spacy',
+    )
+    args.add_argument(
+        '--spacy_model',
+        type=str,
+        default='en_core_web_sm',
+        help='spaCy pipeline to segment sentences with. Default: en_core_web_sm',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=64,
+        help='Documents per segmenter batch. Default: 64',
+    )
+    args.add_argument(
+        '--seed',
+        type=int,
+        default=42,
+        help='Random seed of the sentences kept of each document. Default: 42',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of segmenting processes. Default: all available cores',
+    )
+    return args.parse_args()
+
 
-def get_sents(sents: List[str], k:int) -> List[str]:
+def get_sents(sents: List[str], k: int, rng: random.Random) -> List[str]:
     if len(sents) < k:
         return sents
-    return random.sample(sents, k)
+    return rng.sample(sents, k)
 
 
 def num_sents_from_len(doc: str) -> int:
@@ -56,140 +135,163 @@ def num_sents_from_len(doc: str) -> int:
         return 2
 
 
-class SentencesPileOfLaw(ms.StreamingDataset):
-    def __init__(self,
-                 nlp,
-                 local: str,
-                 remote: Optional[str] = None,
-                 split: Optional[str] = None,
-                 shuffle: bool = False,
-                 predownload: Optional[int] = 100_000,
-                 keep_zip: Optional[bool] = None,
-                 download_retry: int = 2,
-                 download_timeout: float = 60,
-                 validate_hash: Optional[str] = None,
-                 shuffle_seed: Optional[int] = None,
-                 num_canonical_nodes: Optional[int] = None,
-                 batch_size: Optional[int] = None) -> None:
-
-        super().__init__(local, remote, split, shuffle, predownload, keep_zip, download_retry,
-                         download_timeout, validate_hash, shuffle_seed, num_canonical_nodes,
-                         batch_size)
-        self.nlp = nlp
-
-    def __getitem__(self, idx: int) -> List[str]:
-        """Get sample by global index, blocking to load its shard if missing.
-        Args:
-            idx (int): Sample index.
-        Returns:
-            Any: Sample data.
-        """
-        text_sample = super().__getitem__(idx)
-        text = text_sample['text']
-        if len(text) > p75:
-            # sorry, for speed
-            text = text[:p75]
-        return text
-
-
-def process_chunk(chunk, file_index):
-    with open(f'pol_sentences_{file_index}.txt', 'w') as f:
-        for sample in chunk:
-            for sentence in sample:
-                f.write(sentence + "\n")
-
-
-def chunkify(iterable, chunk_size):
-    iterator = iter(iterable)
-    while True:
-        chunk = []
-        try:
-            for _ in range(chunk_size):
-                chunk.append(next(iterator))
-            yield chunk
-        except StopIteration:
-            if chunk:
-                yield chunk
-            break
-
-
-def get_ds_chunks(nlp, PROCS):
-    remote = '../mds-pol'
-    local = '../mds-pol'
-    cfg = {
-        'name': 'pile_of_law',
-        'dataset': {
-            'remote': remote,
-            'local': local,
-            'split': 'train',
-            'shuffle': True,
-            'prefetch': 1000,
-        },
-        'drop_last': False,
-        'num_workers': 1,
-        'pin_memory': True,
-        'prefetch_factor': 2,
-        'persistent_workers': True,
-        'timeout': 1200,
-    }
-    cfg = OmegaConf.create(cfg)
-    # check this
-    device_batch_size = 1
-    print(f'Reading {cfg.dataset.split} split from {remote} -> {local}')
-
-    ds_train = SentencesPileOfLaw(
-        nlp,
-        split='train',
-        local=cfg.dataset.local,
-        remote=cfg.dataset.remote,
-        shuffle=cfg.dataset.shuffle,
-        batch_size=device_batch_size,
-    )
-
-    chunks = chunkify(ds_train, chunk_size=7406292//PROCS)
-    return chunks
+def init_worker(segmenter: str, model: str) -> None:
+    """Load the spaCy pipeline of a worker process, if sentences are split with spaCy.
+    Args:
+        segmenter (str): ``spacy`` or ``regex``.
+        model (str): spaCy pipeline name.
+    """
+    global nlp
+    if segmenter != 'spacy':
+        return
+    import spacy
 
-
-def main():
     try:
-        nlp = spacy.load('en_core_web_sm', exclude=["ner"])
+        nlp = spacy.load(model, exclude=['ner'])
     except OSError:
         # need model for sentence segmenting
-        print("MISSING SENTENCE SEGMENTING MODEL\n\nrun:\npython -m spacy download en_core_web_sm\n\n")
-        exit()
-
-    # how much parallelism
-    PROCS = 48
-
-    print("chunking")
-    chunks = get_ds_chunks(nlp, PROCS)
-
-    for i, chunk in enumerate(chunks):
-        print(f"processing chunk {i}")
-        docs = nlp.pipe(chunk, n_process=PROCS)
-        chunk_sents = []
-        for doc in docs:
-            k = num_sents_from_len(doc.text)
-            sents = [s.text for s in doc.sents if s.text.strip() != '']
-            sents = [s.replace('\n', '\\n') for s in sents]  # there are so many newlines, preserve?
-            # need to do that bc output format is newline separated strings
-            sents = get_sents(sents=sents, k=k)
-            chunk_sents += sents
-        with open(f'pol_sentences_{i}.txt', 'w') as f:
-            for sample in chunk_sents:
-                for sentence in sample:
-                    f.write(sentence + "\n")
-
-    # with Pool(PROCS) as p:
-    #     for _ in tqdm.tqdm(p.imap_unordered(process_chunk, chunks), total=PROCS):
-    #         pass
+        raise OSError(f'Missing sentence segmenting model, run: python -m spacy download {model}')
+
+
+def range_filename(out_dir: str, begin: int, end: int) -> str:
+    """Get the sentence file of a range of shards.
+    Args:
+        out_dir (str): Output directory.
+        begin (int): First shard of the range.
+        end (int): Shard after the last of the range.
+    Returns:
+        str: Path to the file.
+    """
+    return os.path.join(out_dir, f'sentences_{begin:05}_{end:05}.txt')
+
+
+def range_key(split: str, begin: int, end: int) -> str:
+    """Get the journal key of a range of shards.
+    Args:
+        split (str): Split name.
+        begin (int): First shard of the range.
+        end (int): Shard after the last of the range.
+    Returns:
+        str: Key.
+    """
+    return f'{split}/{begin:05}-{end:05}'
+
+
+def iter_texts(split_dir: str, infos: List[Dict[str, Any]]) -> Iterator[str]:
+    """Read the documents of shards, in order.
+    Args:
+        split_dir (str): Dataset directory of the split.
+        infos (List[Dict[str, Any]]): Metadata of the shards.
+    Returns:
+        Iterator[str]: Document texts, cut to ``p75`` characters.
+    """
+    for info in infos:
+        for sample in iter_shard(split_dir, info):
+            # sorry, for speed
+            yield sample['text'][:p75]
+
+
+def iter_doc_sentences(texts: Iterator[str], segmenter: str,
+                       batch_size: int) -> Iterator[Tuple[str, List[str]]]:
+    """Split documents into sentences, a batch at a time.
+    Args:
+        texts (Iterator[str]): Document texts.
+        segmenter (str): ``spacy`` or ``regex``.
+        batch_size (int): Documents per batch.
+    Returns:
+        Iterator[Tuple[str, List[str]]]: Each document text, and its sentences.
+    """
+    if segmenter == 'spacy':
+        for doc in nlp.pipe(texts, batch_size=batch_size):  # pyright: ignore
+            yield doc.text, [s.text for s in doc.sents]
+        return
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield from zip(batch, split_batch(batch))
+            batch = []
+    yield from zip(batch, split_batch(batch))
+
+
+def segment_range(task: Tuple[int, int], split_dir: str, infos: List[Dict[str, Any]],
+                  args: Namespace) -> Tuple[int, int, int, int]:
+    """Segment the documents of a range of shards into a sentence file. This is the unit of work
+    of the process pool.
+    Args:
+        task (Tuple[int, int]): First shard of the range, and the shard after its last.
+        split_dir (str): Dataset directory of the split.
+        infos (List[Dict[str, Any]]): Metadata of every shard of the split.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Tuple[int, int, int, int]: The range, number of documents and number of sentences.
+    """
+    begin, end = task
+    # Seeded by range, so a resumed run keeps the same sentences.
+    rng = random.Random(f'{args.seed}/{begin}')
+    filename = range_filename(args.out_dir, begin, end)
+    num_docs = 0
+    num_sents = 0
+    with open(filename + '.partial', 'w') as out:
+        texts = iter_texts(split_dir, infos[begin:end])
+        for text, sents in iter_doc_sentences(texts, args.segmenter, args.batch_size):
+            k = num_sents_from_len(text)
+            sents = [s for s in sents if s.strip() != '']
+            # there are so many newlines, preserve? need to do that bc output format is newline
+            # separated strings
+            sents = [s.replace('\n', '\\n') for s in sents]
+            for sentence in get_sents(sents=sents, k=k, rng=rng):
+                out.write(sentence + '\n')
+                num_sents += 1
+            num_docs += 1
+    os.replace(filename + '.partial', filename)
+    return begin, end, num_docs, num_sents
+
+
+def main(args: Namespace) -> None:
+    """Segment every shard range of the split in parallel, then merge the sentence files.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    split_dir = os.path.join(args.root, args.split)
+    infos = read_index(split_dir)
+    os.makedirs(args.out_dir, exist_ok=True)
+    for filename in glob(os.path.join(args.out_dir, '*.partial')):
+        os.remove(filename)
+    journal = ConversionJournal(os.path.join(args.out_dir, 'journal.jsonl'))
+
+    ranges = []
+    for begin in range(0, len(infos), args.shards_per_range):
+        ranges.append((begin, min(begin + args.shards_per_range, len(infos))))
+    todo = []
+    for begin, end in ranges:
+        # Ranges split by another segmenter are redone, so as not to mix the two. Ranges journaled
+        # before there was a choice were split with spaCy.
+        obj = journal.get(range_key(args.split, begin, end))
+        if obj is None or obj.get('segmenter', 'spacy') != args.segmenter:
+            todo.append((begin, end))
+
+    progbar = tqdm(total=len(infos), initial=len(infos) - sum(end - begin for begin, end in todo),
+                   unit='shard', desc=args.split)
+    with Pool(args.num_proc, init_worker, (args.segmenter, args.spacy_model)) as pool:
+        func = partial(segment_range, split_dir=split_dir, infos=infos, args=args)
+        for begin, end, num_docs, num_sents in pool.imap_unordered(func, todo):
+            journal.record(range_key(args.split, begin, end),
+                           segmenter=args.segmenter,
+                           docs=num_docs,
+                           sentences=num_sents)
+            progbar.update(end - begin)
+    progbar.close()
 
     # Merge the files
-    with open('pol_sentences.txt', 'w') as outfile:
-        for i in range(PROCS):
-            with open(f'pol_sentences_{i}.txt') as infile:
+    with open(args.out_file, 'w') as outfile:
+        for begin, end in ranges:
+            with open(range_filename(args.out_dir, begin, end)) as infile:
                 shutil.copyfileobj(infile, outfile)
+    num_sents = sum(journal.get(range_key(args.split, begin, end))['sentences']  # pyright: ignore
+                    for begin, end in ranges)
+    print(f'Wrote {num_sents} sentences to {args.out_file}')
 
 
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+if __name__ == '__main__':
+    main(parse_args())
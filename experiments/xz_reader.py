@@ -0,0 +1,259 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Read JSONL lines out of .xz files, decompressing independent xz blocks in parallel.
+
+An xz file is one or more streams, each made of independently compressed blocks followed by an
+index of their sizes. Files written by multi-threaded ``xz -T`` have many blocks. We read the
+indexes from the end of the file, wrap each block in a minimal single-block stream of its own,
+and decompress those on a thread pool (liblzma releases the GIL), yielding lines in order.
+"""
+
+import lzma
+import struct
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+HEADER_MAGIC = b'\xfd7zXZ\x00'
+FOOTER_MAGIC = b'YZ'
+
+
+class XZBlock(NamedTuple):
+    """Location of one xz block in a file.
+    Args:
+        offset (int): Byte offset of the block in the file.
+        unpadded_size (int): Size of the block header, data and check, without padding.
+        uncompressed_size (int): Size of the block's decompressed data.
+        stream_header (bytes): Header of the stream the block belongs to.
+    """
+    offset: int
+    unpadded_size: int
+    uncompressed_size: int
+    stream_header: bytes
+
+
+def _round_up(size: int) -> int:
+    return (size + 3) & ~3
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def xz_blocks(filename: str) -> List[XZBlock]:
+    """List the blocks of an xz file, in order, by reading the index of each stream.
+    Args:
+        filename (str): Path to the .xz file.
+    Returns:
+        List[XZBlock]: Every block of every stream.
+    """
+    streams = []
+    with open(filename, 'rb') as file:
+        pos = file.seek(0, 2)
+        while pos > 0:
+            # Skip stream padding, which is a multiple of four null bytes.
+            file.seek(pos - 4)
+            if file.read(4) == b'\0\0\0\0':
+                pos -= 4
+                continue
+
+            file.seek(pos - 12)
+            footer = file.read(12)
+            if footer[10:] != FOOTER_MAGIC:
+                raise ValueError(f'{filename} is not an xz file')
+            backward_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+            index_start = pos - 12 - backward_size
+            file.seek(index_start)
+            index = file.read(backward_size)
+            if index[0] != 0:
+                raise ValueError(f'{filename} has a corrupt xz index')
+
+            num_records, idx = _decode_varint(index, 1)
+            records = []
+            for _ in range(num_records):
+                unpadded_size, idx = _decode_varint(index, idx)
+                uncompressed_size, idx = _decode_varint(index, idx)
+                records.append((unpadded_size, uncompressed_size))
+
+            stream_start = index_start - sum(_round_up(size) for size, _ in records) - 12
+            file.seek(stream_start)
+            stream_header = file.read(12)
+            if stream_header[:6] != HEADER_MAGIC:
+                raise ValueError(f'{filename} has a corrupt xz stream header')
+
+            blocks = []
+            offset = stream_start + 12
+            for unpadded_size, uncompressed_size in records:
+                blocks.append(XZBlock(offset, unpadded_size, uncompressed_size, stream_header))
+                offset += _round_up(unpadded_size)
+            streams.append(blocks)
+            pos = stream_start
+    return [block for blocks in reversed(streams) for block in blocks]
+
+
+def decode_block(filename: str, block: XZBlock) -> bytes:
+    """Decompress one block of an xz file on its own.
+    Args:
+        filename (str): Path to the .xz file.
+        block (XZBlock): The block.
+    Returns:
+        bytes: Decompressed data of the block.
+    """
+    with open(filename, 'rb') as file:
+        file.seek(block.offset)
+        data = file.read(_round_up(block.unpadded_size))
+
+    # Wrap the block in a stream of its own: header, block, single-record index, footer.
+    index = b'\0\1' + _encode_varint(block.unpadded_size) + \
+        _encode_varint(block.uncompressed_size)
+    index += b'\0' * (_round_up(len(index)) - len(index))
+    index += struct.pack('<I', zlib.crc32(index))
+    flags = block.stream_header[6:8]
+    backward_size = struct.pack('<I', len(index) // 4 - 1)
+    footer = struct.pack('<I', zlib.crc32(backward_size + flags)) + backward_size + flags + \
+        FOOTER_MAGIC
+    return lzma.decompress(block.stream_header + data + index + footer, format=lzma.FORMAT_XZ)
+
+
+def xz_size(filename: str) -> int:
+    """Get the decompressed size of an xz file from its indexes.
+    Args:
+        filename (str): Path to the .xz file.
+    Returns:
+        int: Decompressed size in bytes.
+    """
+    return sum(block.uncompressed_size for block in xz_blocks(filename))
+
+
+def _iter_chunks(filename: str, blocks: List[XZBlock], start: int,
+                 num_threads: int) -> Iterator[Tuple[int, bytes]]:
+    """Decompress an xz file from (at least) the given offset onwards, in chunks.
+    Args:
+        filename (str): Path to the .xz file.
+        blocks (List[XZBlock]): Blocks of the file.
+        start (int): Decompressed offset of the first byte needed.
+        num_threads (int): Number of decompression threads.
+    Returns:
+        Iterator[Tuple[int, bytes]]: Decompressed offset and data of each chunk.
+    """
+    if len(blocks) < 2:
+        # A single block can only be decompressed from its beginning.
+        with lzma.open(open(filename, 'rb')) as file:
+            offset = file.seek(start)
+            while True:
+                chunk = file.read(1 << 24)
+                if not chunk:
+                    return
+                yield offset, chunk
+                offset += len(chunk)
+
+    offsets = []
+    offset = 0
+    for block in blocks:
+        offsets.append(offset)
+        offset += block.uncompressed_size
+    next_block = max(bisect_right(offsets, start) - 1, 0)
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        futures = []
+        while futures or next_block < len(blocks):
+            while next_block < len(blocks) and len(futures) < 2 * num_threads:
+                future = pool.submit(decode_block, filename, blocks[next_block])
+                futures.append((offsets[next_block], future))
+                next_block += 1
+            offset, future = futures.pop(0)
+            yield offset, future.result()
+
+
+def iter_xz_lines(filename: str,
+                  num_threads: int = 1,
+                  start: int = 0,
+                  end: Optional[int] = None) -> Iterator[str]:
+    """Iterate over the lines of an xz-compressed UTF-8 text file, in order.
+    Blocks are decompressed on ``num_threads`` threads, a bounded number of blocks ahead of the
+    line being read. Single-block files, or ``num_threads`` of 1, are read with ``lzma.open``.
+
+    Given a range of decompressed byte offsets, only the lines that begin inside it are yielded,
+    so ranges that tile the file split its lines between them exactly once, wherever the range
+    boundaries fall. Reading starts at the block holding ``start``; a single-block file has to be
+    decompressed from the beginning up to there.
+    Args:
+        filename (str): Path to the .xz file.
+        num_threads (int): Number of decompression threads. Default: ``1``.
+        start (int): Decompressed offset the range starts at. Default: ``0``.
+        end (int, optional): Decompressed offset the range ends at. Defaults to ``None``, the
+            end of the file.
+    Returns:
+        Iterator[str]: Lines, including their line terminators.
+    """
+    whole = not start and end is None
+    blocks = xz_blocks(filename) if num_threads > 1 or not whole else []
+    if whole and len(blocks) < 2:
+        yield from lzma.open(open(filename, 'rb'), 'rt', encoding='utf-8')
+        return
+
+    # The line holding byte start - 1 belongs to the previous range, so skip through the first
+    # newline at or after it. Blocks end mid-line and mid-character: carry the tail over.
+    skip_from = start - 1 if start else None
+    carry = b''
+    pos = None
+    for offset, chunk in _iter_chunks(filename, blocks, max(start - 1, 0), num_threads):
+        if pos is None:
+            pos = offset
+        data = carry + chunk
+        begin = 0
+        if skip_from is not None:
+            newline = data.find(b'\n', max(skip_from - pos, 0))
+            if newline < 0:
+                carry = b''
+                pos += len(data)
+                continue
+            begin = newline + 1
+            skip_from = None
+        if end is not None and pos + begin >= end:
+            return
+        stop = data.rfind(b'\n') + 1
+        if end is not None and pos + stop > end:
+            # The last line of the range is the one holding byte end - 1.
+            stop = data.find(b'\n', max(end - 1 - pos, begin)) + 1
+            if stop:
+                yield from _split_lines(data[begin:stop])
+                return
+            stop = begin
+        if begin < stop:
+            yield from _split_lines(data[begin:stop])
+        carry = data[stop:]
+        pos += stop
+    if carry and skip_from is None and (end is None or pos < end):
+        yield carry.decode('utf-8')
+
+
+def _split_lines(data: bytes) -> Iterator[str]:
+    """Split complete newline-terminated lines.
+    Args:
+        data (bytes): UTF-8 data ending with a newline.
+    Returns:
+        Iterator[str]: Lines, including their line terminators.
+    """
+    lines = data.decode('utf-8').split('\n')
+    lines.pop()
+    for line in lines:
+        yield line + '\n'
@@ -3,18 +3,26 @@
 
 """Pile of Law streaming dataset conversion scripts using HF dataset."""
 
+import heapq
+import json
 import os
 from argparse import ArgumentParser, Namespace
-from typing import Any, Dict, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, Dict, Iterator, List, Optional
 
 import datasets
+import fsspec
 from datasets.arrow_dataset import Dataset
 from torch.utils.data import DataLoader, IterableDataset, get_worker_info
 from tqdm import tqdm
 
-from streaming.base import MDSWriter
 from streaming.base.util import get_list_arg
 
+from mds_util import (ConversionJournal, PoLMDSWriter, StageTimer, commit_split, file_fingerprint,
+                      finalize_group, is_converted, partial_dirname, profile_report,
+                      remove_partial_groups, split_and_group, write_json)
+
 
 def parse_args() -> Namespace:
     """Parse command-line arguments.
@@ -52,6 +60,29 @@ def parse_args() -> Namespace:
         default=512,
         help='DataLoader batch size. Default: 512',
     )
+    args.add_argument(
+        '--num_workers',
+        type=int,
+        default=os.cpu_count(),
+        help='DataLoader number of workers. Input files are balanced across the workers by ' +
+        'size, so any count works. Default: number of CPUs',
+    )
+    args.add_argument(
+        '--parallel_writers',
+        type=int,
+        default=1,
+        help='Write one shard group per input file inside each DataLoader worker, then merge ' +
+        'the groups, instead of writing every sample from the main process. Only this mode ' +
+        'keeps a journal in out_root, so that a rerun resumes where it stopped. Default: 1 (True)',
+    )
+    args.add_argument(
+        '--profile_file',
+        type=str,
+        default='',
+        help='If set, time each stage of the conversion (read, encode, hash, compress_write) ' +
+        'and write a JSON report of the totals per input file, per worker and overall to this ' +
+        'path. Default: disabled',
+    )
     args.add_argument(
         '--progbar',
         type=int,
@@ -68,6 +99,47 @@ def parse_args() -> Namespace:
     return args.parse_args()
 
 
+def get_file_sizes(filepaths: List[str]) -> List[Optional[int]]:
+    """Look up the size in bytes of each input file, which may be local or remote.
+    Args:
+        filepaths (List[str]): Input file paths or URLs.
+    Returns:
+        List[Optional[int]]: Size of each file, or ``None`` if it could not be determined.
+    """
+
+    def get_size(path: str) -> Optional[int]:
+        fs, fs_path = fsspec.core.url_to_fs(path)
+        try:
+            return fs.size(fs_path)
+        except (OSError, ValueError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        return list(pool.map(get_size, filepaths))
+
+
+def balance_shards(sizes: List[Optional[int]], num_workers: int) -> List[List[int]]:
+    """Assign input files to workers, longest first, each to the currently least loaded worker.
+    Files of unknown size are counted as the median known size.
+    Args:
+        sizes (List[Optional[int]]): Size in bytes of each input file.
+        num_workers (int): Number of workers to balance over.
+    Returns:
+        List[List[int]]: The input file indices of each worker, largest first.
+    """
+    known = sorted(size for size in sizes if size is not None)
+    default = known[len(known) // 2] if known else 1
+    sizes = [default if size is None else size for size in sizes]
+    order = sorted(range(len(sizes)), key=lambda idx: (-sizes[idx], idx))
+    loads = [(0, worker_id) for worker_id in range(num_workers)]
+    assignment = [[] for _ in range(num_workers)]
+    for idx in order:
+        load, worker_id = heapq.heappop(loads)
+        assignment[worker_id].append(idx)
+        heapq.heappush(loads, (load + sizes[idx], worker_id))
+    return assignment
+
+
 def get(split: str) -> IterableDataset:
     """Collect the samples for this dataset split.
     Args:
@@ -81,34 +153,59 @@ def get(split: str) -> IterableDataset:
         def __init__(self):
             self.dataset = datasets.load_dataset("pile-of-law/pile-of-law",
                                                  "all", cache_dir="hf_pol", streaming=True)[split]
+            self.filepaths = list(self.dataset._ex_iterable.kwargs['filepaths'])  # pyright: ignore
+            self.sizes = get_file_sizes(self.filepaths)
 
         def num_shards(self):
-            return len(self.dataset._ex_iterable.kwargs['filepaths'])  # pyright: ignore
+            return len(self.filepaths)
 
-        def __iter__(self):
+        def group_name(self, idx: int) -> str:
+            return split_and_group(self.filepaths[idx])[1]
+
+        def worker_shards(self, indices: Optional[List[int]] = None) -> List[int]:
+            """Get the indices of the input files this DataLoader worker is responsible for.
+            Args:
+                indices (List[int], optional): Input files to balance over the workers. Defaults
+                    to all of them.
+            Returns:
+                List[int]: Input file indices.
+            """
+            if indices is None:
+                indices = list(range(len(self.filepaths)))
             worker_info = get_worker_info()
-            if worker_info:
-                num_workers = worker_info.num_workers
-                worker_id = worker_info.id
-                shards = self.dataset._ex_iterable.kwargs['filepaths']  # pyright: ignore
-                if len(shards) % num_workers:
-                    print(len(shards), num_workers)
-                    raise ValueError('Shards must divide evenly by num_workers')
-                self.dataset._ex_iterable.kwargs['filepaths'] = (  # pyright: ignore
-                    shards[worker_id::num_workers])
+            if not worker_info:
+                return indices
+            sizes = [self.sizes[idx] for idx in indices]
+            assignment = balance_shards(sizes, worker_info.num_workers)[worker_info.id]
+            return [indices[idx] for idx in assignment]
+
+        def iter_shard(self, idx: int) -> Iterator[Dict[str, Any]]:
+            """Iterate over the samples of a single input file.
+            Args:
+                idx (int): Input file index.
+            Returns:
+                Iterator[Dict[str, Any]]: Sample dicts.
+            """
+            filepaths = [self.filepaths[idx]]
+            self.dataset._ex_iterable.kwargs['filepaths'] = filepaths  # pyright: ignore
+            return iter(self.dataset)
+
+        def __iter__(self):
+            self.dataset._ex_iterable.kwargs['filepaths'] = [  # pyright: ignore
+                self.filepaths[idx] for idx in self.worker_shards()]
             return iter(self.dataset)
 
     return ShardedPoL()
 
 
-def each(dataset: Dataset, num_workers: int, batch_size: int) -> Iterator[Dict[str, Any]]:
-    """Iterate over each dataset sample.
+def each(dataset: Dataset, num_workers: int, batch_size: int) -> Iterator[Dict[str, List[Any]]]:
+    """Iterate over each dataset batch, as columns.
     Args:
         dataset (Dataset): A HuggingFace Dataset locally downloaded.
         num_workers (int): DataLoader number of workers.
         batch_size (int): DataLoader batch size.
     Returns:
-        Iterator[Dict[str, Any]]: Sample dicts.
+        Iterator[Dict[str, List[Any]]]: Batches of samples, as one list per column.
     """
     prefetch_factor = max(1, 2 * batch_size // num_workers)
     loader = DataLoader(
@@ -117,10 +214,146 @@ def each(dataset: Dataset, num_workers: int, batch_size: int) -> Iterator[Dict[s
         num_workers=num_workers,
         prefetch_factor=prefetch_factor)
     for batch in loader:
-        keys = list(batch.keys())
-        current_bs = len(batch[keys[0]])
-        for idx in range(current_bs):
-            yield {'text': batch['text'][idx]}
+        yield {'text': batch['text']}
+
+
+class ShardGroupWriter(IterableDataset):
+    """Write each input file of a split into its own shard group inside the DataLoader workers.
+    Compression and hashing then run in every worker instead of in the main process. The shard
+    groups are merged into a single index afterwards with ``commit_split``.
+    Args:
+        dataset (IterableDataset): The ``ShardedPoL`` dataset of the split.
+        split_dir (str): Output directory of the split. Groups are written to subdirectories.
+        fields (Dict[str, str]): MDS column names and encodings.
+        compression (str): Compression algorithm to use.
+        hashes (List[str]): Hashing algorithms to apply to shard files.
+        size_limit (int): Shard size limit, after which point to start a new shard.
+        report_every (int): How many samples to write between progress reports. Default: 512.
+        indices (List[int], optional): Input files to convert. Defaults to all of them.
+        profile (bool): Whether to time the stages of converting each input file. Default:
+            ``False``.
+    """
+
+    def __init__(self,
+                 dataset: IterableDataset,
+                 split_dir: str,
+                 fields: Dict[str, str],
+                 compression: str,
+                 hashes: List[str],
+                 size_limit: int,
+                 report_every: int = 512,
+                 indices: Optional[List[int]] = None,
+                 profile: bool = False):
+        self.dataset = dataset
+        self.split_dir = split_dir
+        self.fields = fields
+        self.compression = compression
+        self.hashes = hashes
+        self.size_limit = size_limit
+        self.report_every = report_every
+        self.indices = indices
+        self.profile = profile
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Convert this worker's input files, reporting progress as we go.
+        Each group is written to a partial directory which is only moved into place when it is
+        complete, after which the input file index is reported as ``done``.
+        Returns:
+            Iterator[Dict[str, Any]]: Progress reports, with the number of new samples ``count``
+                and the index of the input file that was just completed ``done``, if any. When
+                profiling, the report of a completed file also has its stage timings ``unit``.
+        """
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info else 0
+        for idx in self.dataset.worker_shards(self.indices):  # pyright: ignore
+            group = self.dataset.group_name(idx)  # pyright: ignore
+            group_dir = os.path.join(self.split_dir, group)
+            timer = StageTimer() if self.profile else None
+            samples = self.dataset.iter_shard(idx)  # pyright: ignore
+            if timer:
+                # Reading covers download, decompression and JSON parsing inside datasets. Its
+                # output is counted in UTF-8 bytes, the unit of every other stage.
+                samples = timer.timed('read', samples,
+                                      size=lambda sample: len(sample['text'].encode('utf-8')))
+            with PoLMDSWriter(partial_dirname(group_dir), self.fields, self.compression,
+                              self.hashes, self.size_limit, timer=timer) as out:
+                texts = []
+                total = 0
+                for sample in samples:
+                    texts.append(sample['text'])
+                    if len(texts) == self.report_every:
+                        out.write_batch({'text': texts})
+                        total += len(texts)
+                        yield {'count': len(texts), 'done': None, 'samples': total}
+                        texts = []
+                out.write_batch({'text': texts})
+                total += len(texts)
+            finalize_group(group_dir)
+            unit = None
+            if timer:
+                unit = {'file': group, 'worker': worker_id, 'stages': timer.stages}
+            yield {'count': len(texts), 'done': idx, 'samples': total, 'unit': unit}
+
+
+def write_shard_groups(dataset: IterableDataset, split_dir: str, fields: Dict[str, str],
+                       args: Namespace, hashes: List[str], num_samples: int,
+                       num_workers: int) -> List[Dict[str, Any]]:
+    """Convert a split with one writer per DataLoader worker, then merge the shard groups.
+    Completed input files and the final merge are recorded in ``out_root/journal.jsonl``, along
+    with a fingerprint of each input file. A rerun only converts the input files that are new,
+    changed upstream or were interrupted, and merges them into the existing dataset.
+    Args:
+        dataset (IterableDataset): The ``ShardedPoL`` dataset of the split.
+        split_dir (str): Output directory of the split.
+        fields (Dict[str, str]): MDS column names and encodings.
+        args (Namespace): Command-line arguments.
+        hashes (List[str]): Hashing algorithms to apply to shard files.
+        num_samples (int): Expected number of samples, for the progress bar.
+        num_workers (int): DataLoader number of workers.
+    Returns:
+        List[Dict[str, Any]]: Stage timings of each converted input file, if profiling.
+    """
+    split = os.path.basename(split_dir)
+    journal = ConversionJournal(os.path.join(args.out_root, 'journal.jsonl'))
+    groups = [dataset.group_name(idx) for idx in range(dataset.num_shards())]  # pyright: ignore
+    keys = [f'{split}/{group}' for group in groups]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        fingerprints = list(pool.map(file_fingerprint, dataset.filepaths))  # pyright: ignore
+
+    remove_partial_groups(split_dir)
+    pending = []
+    done_samples = 0
+    for idx, (group, key, fingerprint) in enumerate(zip(groups, keys, fingerprints)):
+        if is_converted(journal, split_dir, split, group, fingerprint):
+            done_samples += journal.get(key)['samples']  # pyright: ignore
+        else:
+            pending.append(idx)
+    if len(pending) < len(keys):
+        print(f'{split}: {len(keys) - len(pending)} of {len(keys)} input files are up to date')
+
+    units = []
+    if pending:
+        writer = ShardGroupWriter(dataset, split_dir, fields, args.compression, hashes,
+                                  args.size_limit, args.batch_size, pending,
+                                  bool(args.profile_file))
+        num_workers = min(num_workers, len(pending))
+        loader = DataLoader(dataset=writer, batch_size=None, num_workers=num_workers)
+        progbar = tqdm(total=num_samples, initial=done_samples, leave=args.leave,
+                       disable=not args.progbar)
+        for report in loader:
+            progbar.update(report['count'])
+            if report['done'] is not None:
+                idx = report['done']
+                journal.record(keys[idx],
+                               file=dataset.filepaths[idx],  # pyright: ignore
+                               fingerprint=fingerprints[idx],
+                               samples=report['samples'])
+                if report['unit']:
+                    units.append(dict(report['unit'], file=f'{split}/{report["unit"]["file"]}'))
+        progbar.close()
+
+    commit_split(journal, split_dir, split, groups)
+    return units
 
 
 def main(args: Namespace) -> None:
@@ -129,20 +362,42 @@ def main(args: Namespace) -> None:
         args (Namespace): command-line arguments.
     """
     splits = [
-        ('train', 'train', 7406292, 51),
-        ('validation', 'validation', 2466152, 40),
+        ('train', 'train', 7406292),
+        ('validation', 'validation', 2466152),
     ]
     fields = {'text': 'str'}
     hashes = get_list_arg(args.hashes)
-    for old_split, new_split, num_samples, num_workers in splits:
+    start = time()
+    units = []
+    for old_split, new_split, num_samples in splits:
         dataset = get(old_split)
+        # Workers beyond one per input file would have nothing to do.
+        num_workers = max(1, min(args.num_workers, dataset.num_shards()))  # pyright: ignore
         split_dir = os.path.join(args.out_root, new_split)
-        with MDSWriter(split_dir, fields, args.compression, hashes, args.size_limit) as out:
-            samples = each(dataset, num_workers, args.batch_size)  # pyright: ignore
-            if args.progbar:
-                samples = tqdm(samples, total=num_samples, leave=args.leave)
-            for sample in samples:
-                out.write(sample)
+        if args.parallel_writers:
+            units += write_shard_groups(dataset, split_dir, fields, args, hashes, num_samples,
+                                        num_workers)
+            continue
+        timer = StageTimer() if args.profile_file else None
+        batches = each(dataset, num_workers, args.batch_size)  # pyright: ignore
+        if timer:
+            batches = timer.timed('read', batches,
+                                  size=lambda batch: sum(len(text.encode('utf-8'))
+                                                         for text in batch['text']))
+        with PoLMDSWriter(split_dir, fields, args.compression, hashes, args.size_limit,
+                          timer=timer) as out:
+            progbar = tqdm(total=num_samples, leave=args.leave, disable=not args.progbar)
+            for batch in batches:
+                out.write_batch(batch)
+                progbar.update(len(batch['text']))
+            progbar.close()
+        if timer:
+            units.append({'file': new_split, 'worker': 'main', 'stages': timer.stages})
+
+    if args.profile_file:
+        report = profile_report(units, time() - start)
+        write_json(args.profile_file, report)
+        print(json.dumps(report['total'], indent=2, sort_keys=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,668 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Helpers shared by the Pile of Law MDS conversion scripts."""
+
+import json
+import os
+import struct
+from glob import glob
+from shutil import rmtree
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import fsspec
+from streaming.base import MDSWriter
+from streaming.base.compression import decompress
+from streaming.base.format.mds.encodings import mds_decode, mds_encode
+
+
+def with_id(basename: str, shard_id: int) -> str:
+    """Get a new basename with the given shard_id.
+    Args:
+        basename (str): Old basename of file.
+        shard_id (int): New shard ID.
+    Returns:
+        str: New basename of file.
+    """
+    parts = basename.split('.')
+    parts[1] = f'{shard_id:05}'
+    return '.'.join(parts)
+
+
+def split_and_group(filename: str) -> Tuple[str, str]:
+    """Get the split and shard group name of a Pile of Law input file.
+    Args:
+        filename (str): Path or URL of the input file, e.g.
+            ``data/train.courtlisteneropinions.7.jsonl.xz``.
+    Returns:
+        Tuple[str, str]: Split and group name, e.g. ``('train', 'courtlisteneropinions.7')``.
+    """
+    name = filename.rstrip('/').split('/')[-1]
+    if name.endswith('.jsonl.xz'):
+        name = name[:-len('.jsonl.xz')]
+    split, group = name.split('.', 1)
+    return split, group
+
+
+def file_fingerprint(filename: str) -> str:
+    """Fingerprint an input file cheaply, without reading it.
+    Uses the size plus the modification time of local files, or the ETag of remote ones.
+    Args:
+        filename (str): Path or URL of the input file.
+    Returns:
+        str: Fingerprint, which changes when the file is replaced.
+    """
+    fs, path = fsspec.core.url_to_fs(filename)
+    info = fs.info(path)
+    obj = {key: info[key] for key in ['size', 'mtime', 'ETag'] if info.get(key) is not None}
+    return json.dumps(obj, sort_keys=True)
+
+
+def write_json(filename: str, obj: Any) -> None:
+    """Atomically write a JSON file.
+    Args:
+        filename (str): Path to the file.
+        obj (Any): JSON-serializable object.
+    """
+    text = json.dumps(obj, sort_keys=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as out:
+        out.write(text)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def write_index(root: str, infos: List[Dict[str, Any]]) -> None:
+    """Atomically write the index of a dataset.
+    Args:
+        root (str): Dataset directory.
+        infos (List[Dict[str, Any]]): Shard metadata, in order.
+    """
+    obj = {
+        'version': 2,
+        'shards': infos,
+    }
+    write_json(os.path.join(root, 'index.json'), obj)
+
+
+def merge_shard_groups(root: str, subdirs: Optional[List[str]] = None) -> None:
+    """Merge ephemeral sub-datasets created in parallel into one dataset.
+    Safe to run again after being interrupted: shards that were already moved are left alone, and
+    the groups are only removed once the merged index has been written, so if any group is gone
+    only the removal of the rest is left to do. That is checked against the merged index first.
+    Args:
+        root (str): Root directory.
+        subdirs (List[str], optional): Shard group directories to merge, in order. Defaults to
+            every directory under ``root``, sorted by name.
+    """
+    if subdirs is None:
+        pattern = os.path.join(root, '*')
+        subdirs = sorted(filter(os.path.isdir, glob(pattern)))
+    if not all(map(os.path.isdir, subdirs)):
+        # The groups that are left must be the last ones, and the merged index must list their
+        # shards as well as those of the groups already removed, all of them moved into place.
+        left = [subdir for subdir in subdirs if os.path.isdir(subdir)]
+        infos = read_index(root) if os.path.exists(os.path.join(root, 'index.json')) else []
+        # A group whose removal was cut short may have lost its index already.
+        num_left = sum(len(read_index(subdir))
+                       for subdir in left
+                       if os.path.exists(os.path.join(subdir, 'index.json')))
+        basenames = [(info['zip_data'] or info['raw_data'])['basename'] for info in infos]
+        if left != subdirs[len(subdirs) - len(left):] or len(infos) <= num_left or \
+                not all(os.path.exists(os.path.join(root, name)) for name in basenames):
+            raise ValueError(f'Shard groups to merge into {root} are missing, but its index ' +
+                             'does not list their shards.')
+        remove_shard_groups(subdirs)
+        return
+    os.makedirs(root, exist_ok=True)
+    shard_id = 0
+    infos = []
+    for subdir in subdirs:
+        index_filename = os.path.join(subdir, 'index.json')
+        obj = json.load(open(index_filename))
+        for info in obj['shards']:
+            for key in ['raw_data', 'zip_data']:
+                if not info[key]:
+                    continue
+                old_basename = info[key]['basename']
+                new_basename = with_id(old_basename, shard_id)
+                info[key]['basename'] = new_basename
+
+            old_filename = os.path.join(subdir, old_basename)
+            new_filename = os.path.join(root, new_basename)
+            if os.path.exists(old_filename) or not os.path.exists(new_filename):
+                os.rename(old_filename, new_filename)
+
+            shard_id += 1
+            infos.append(info)
+
+    write_index(root, infos)
+    remove_shard_groups(subdirs)
+
+
+def update_shard_groups(root: str, order: List[str], fresh: Dict[str, str],
+                        merged: Dict[str, List[str]]) -> List[Tuple[str, List[str]]]:
+    """Merge new shard groups into an existing dataset, replacing or appending groups.
+    Every shard is renumbered to its position in ``order``. The renames are planned up front in
+    ``merge_plan.json`` and done in two phases through temporary names, so that shards can trade
+    places, and an interrupted update is completed by calling this again. Shards of replaced
+    groups are deleted. The caller removes the plan with ``remove_merge_plan`` once it has recorded
+    the result.
+    Args:
+        root (str): Dataset directory.
+        order (List[str]): Names of the groups to keep, in their new order. Groups of ``merged``
+            left out of it are deleted.
+        fresh (Dict[str, str]): Name of each newly converted group to its directory.
+        merged (Dict[str, List[str]]): Name of each group already in the dataset to the raw
+            basenames of its shards.
+    Returns:
+        List[Tuple[str, List[str]]]: Name of each group and the raw basenames of its shards.
+    """
+    plan_filename = os.path.join(root, 'merge_plan.json')
+    if os.path.exists(plan_filename):
+        plan = json.load(open(plan_filename))
+    else:
+        infos_by_basename = {}
+        if merged:
+            index = json.load(open(os.path.join(root, 'index.json')))
+            for info in index['shards']:
+                infos_by_basename[info['raw_data']['basename']] = info
+
+        def on_disk(info: Dict[str, Any]) -> str:
+            return (info['zip_data'] or info['raw_data'])['basename']
+
+        moves = []
+        infos = []
+        groups = []
+        for group in order:
+            if group in fresh:
+                src_dir = fresh[group]
+                group_infos = json.load(open(os.path.join(src_dir, 'index.json')))['shards']
+            else:
+                src_dir = root
+                group_infos = [infos_by_basename[basename] for basename in merged[group]]
+            basenames = []
+            for info in group_infos:
+                old_filename = os.path.join(src_dir, on_disk(info))
+                for key in ['raw_data', 'zip_data']:
+                    if info[key]:
+                        info[key]['basename'] = with_id(info[key]['basename'], len(infos))
+                new_filename = os.path.join(root, on_disk(info))
+                if old_filename != new_filename:
+                    tmp_filename = os.path.join(root, f'.merge.{len(moves):05}')
+                    moves.append([old_filename, tmp_filename, new_filename])
+                basenames.append(info['raw_data']['basename'])
+                infos.append(info)
+            groups.append([group, basenames])
+        for group, basenames in merged.items():
+            if group in fresh or group not in order:
+                for basename in basenames:
+                    old_filename = os.path.join(root, on_disk(infos_by_basename[basename]))
+                    tmp_filename = os.path.join(root, f'.merge.{len(moves):05}')
+                    moves.append([old_filename, tmp_filename, None])
+        plan = {'phase': 1, 'moves': moves, 'infos': infos, 'groups': groups}
+        write_json(plan_filename, plan)
+
+    if plan['phase'] == 1:
+        for old_filename, tmp_filename, _ in plan['moves']:
+            if os.path.exists(old_filename):
+                os.rename(old_filename, tmp_filename)
+        plan['phase'] = 2
+        write_json(plan_filename, plan)
+
+    for _, tmp_filename, new_filename in plan['moves']:
+        if not os.path.exists(tmp_filename):
+            continue
+        if new_filename:
+            os.rename(tmp_filename, new_filename)
+        else:
+            os.remove(tmp_filename)
+    write_index(root, plan['infos'])
+    return [(group, basenames) for group, basenames in plan['groups']]
+
+
+def remove_merge_plan(root: str) -> None:
+    """Remove the plan of a completed ``update_shard_groups``.
+    Args:
+        root (str): Dataset directory.
+    """
+    plan_filename = os.path.join(root, 'merge_plan.json')
+    if os.path.exists(plan_filename):
+        os.remove(plan_filename)
+
+
+def remove_shard_groups(subdirs: List[str]) -> None:
+    """Remove shard group directories whose shards have been merged.
+    Args:
+        subdirs (List[str]): Shard group directories. Missing ones are skipped.
+    """
+    for subdir in subdirs:
+        if os.path.exists(subdir):
+            rmtree(subdir)
+
+
+def partial_dirname(dirname: str) -> str:
+    """Get the directory a shard group is written to before it is complete.
+    Args:
+        dirname (str): Final directory of the shard group.
+    Returns:
+        str: Directory to write the shard group to.
+    """
+    return dirname + '.partial'
+
+
+def finalize_group(dirname: str) -> None:
+    """Atomically move a completely written shard group into place.
+    Args:
+        dirname (str): Final directory of the shard group.
+    """
+    if os.path.exists(dirname):
+        rmtree(dirname)
+    os.rename(partial_dirname(dirname), dirname)
+
+
+def remove_partial_groups(root: str) -> None:
+    """Delete shard groups left half-written by an interrupted conversion.
+    Args:
+        root (str): Directory containing the shard groups.
+    """
+    for dirname in glob(partial_dirname(os.path.join(root, '*'))):
+        rmtree(dirname)
+
+
+class ConversionJournal:
+    """Append-only record of which units of a conversion have completed.
+    Each line is a JSON object with a ``key``; a later line for the same key replaces an earlier
+    one. Lines are fsynced as they are written, and a torn last line from a crash is ignored.
+    Args:
+        filename (str): Path to the journal file. It is created if missing.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.entries = {}
+        self.torn = False
+        if os.path.exists(filename):
+            text = open(filename).read()
+            for line in text.splitlines():
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[obj['key']] = obj
+            self.torn = bool(text) and not text.endswith('\n')
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get the latest entry for a key.
+        Args:
+            key (str): Unit of work.
+        Returns:
+            Optional[Dict[str, Any]]: The entry, or ``None`` if the key was never recorded.
+        """
+        return self.entries.get(key)
+
+    def record(self, key: str, **fields: Any) -> None:
+        """Durably record that a unit of work has completed.
+        Args:
+            key (str): Unit of work.
+            **fields (Any): JSON-serializable details to store with it.
+        """
+        obj = dict(fields, key=key)
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(self.filename, 'a') as out:
+            if self.torn:
+                out.write('\n')
+                self.torn = False
+            out.write(json.dumps(obj, sort_keys=True) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        self.entries[key] = obj
+
+
+T = TypeVar('T')
+
+
+class StageTimer:
+    """Accumulate time spent, calls and bytes in and out per stage of a conversion pipeline."""
+
+    def __init__(self) -> None:
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0,
+            calls: int = 1) -> None:
+        """Account for work done in a stage.
+        Args:
+            stage (str): Stage name.
+            seconds (float): Time spent.
+            bytes_in (int): Bytes consumed. Default: ``0``.
+            bytes_out (int): Bytes produced. Default: ``0``.
+            calls (int): Number of calls the work was done in. Default: ``1``.
+        """
+        obj = self.stages.get(stage)
+        if obj is None:
+            obj = self.stages[stage] = {'seconds': 0.0, 'calls': 0, 'bytes_in': 0, 'bytes_out': 0}
+        obj['seconds'] += seconds
+        obj['calls'] += calls
+        obj['bytes_in'] += bytes_in
+        obj['bytes_out'] += bytes_out
+
+    def timed(self, stage: str, items: Iterable[T], size: Any = len) -> Iterator[T]:
+        """Time how long it takes to produce each item of an iterable.
+        Args:
+            stage (str): Stage name.
+            items (Iterable[T]): Items, e.g. decompressed lines.
+            size (Callable): Gets the output size of an item. Default: ``len``.
+        Returns:
+            Iterator[T]: The same items.
+        """
+        iterator = iter(items)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, perf_counter() - start, bytes_out=size(item))
+            yield item
+
+    def wrap(self, stage: str, func: Callable[..., T], size: Any = len) -> Callable[..., T]:
+        """Time every call of a function.
+        Args:
+            stage (str): Stage name.
+            func (Callable[..., T]): Function, e.g. ``json.loads``.
+            size (Callable): Gets the input size from the first argument. Default: ``len``.
+        Returns:
+            Callable[..., T]: Function that does the same.
+        """
+
+        def timed_func(arg: Any, *args: Any, **kwargs: Any) -> T:
+            start = perf_counter()
+            ret = func(arg, *args, **kwargs)
+            self.add(stage, perf_counter() - start, bytes_in=size(arg))
+            return ret
+
+        return timed_func
+
+
+def summarize_stages(stages: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Add up the stage totals of several timers and compute their throughput.
+    Args:
+        stages (List[Dict[str, Dict[str, Any]]]): Stage totals, as produced by ``StageTimer``.
+    Returns:
+        Dict[str, Dict[str, Any]]: Summed totals of each stage, with ``mb_per_sec`` in and out.
+    """
+    total = {}
+    for obj in stages:
+        for stage, stats in obj.items():
+            into = total.setdefault(stage, {})
+            for key in ['seconds', 'calls', 'bytes_in', 'bytes_out']:
+                into[key] = into.get(key, 0) + stats[key]
+    for stats in total.values():
+        seconds = stats['seconds']
+        for key in ['in', 'out']:
+            rate = stats[f'bytes_{key}'] / seconds / 1e6 if seconds else None
+            stats[f'mb_per_sec_{key}'] = rate and round(rate, 3)
+        stats['seconds'] = round(seconds, 3)
+    return total
+
+
+def profile_report(units: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Build the per-worker and aggregate instrumentation report of a conversion.
+    Args:
+        units (List[Dict[str, Any]]): One dict per unit of work with its ``worker`` and ``stages``.
+        wall_seconds (float): Wall time of the whole conversion.
+    Returns:
+        Dict[str, Any]: Report, with the units, a summary per worker and the overall total.
+    """
+    by_worker = {}
+    for unit in units:
+        by_worker.setdefault(str(unit['worker']), []).append(unit['stages'])
+    return {
+        'wall_seconds': round(wall_seconds, 3),
+        'units': units,
+        'workers': {worker: summarize_stages(stages) for worker, stages in by_worker.items()},
+        'total': summarize_stages([unit['stages'] for unit in units]),
+    }
+
+
+class PoLMDSWriter(MDSWriter):
+    """MDSWriter that can also write a whole batch of samples at once.
+    See ``MDSWriter`` for the other arguments.
+    Args:
+        timer (StageTimer, optional): If set, time the ``encode``, ``hash`` and ``compress_write``
+            stages of writing into it. Defaults to ``None``.
+    """
+
+    def __init__(self, *args: Any, timer: Optional[StageTimer] = None, **kwargs: Any) -> None:
+        self.timer = timer
+        super().__init__(*args, **kwargs)
+
+    def encode_sample(self, sample: Dict[str, Any]) -> bytes:
+        if not self.timer:
+            return super().encode_sample(sample)
+        start = perf_counter()
+        data = super().encode_sample(sample)
+        self.timer.add('encode', perf_counter() - start, bytes_out=len(data))
+        return data
+
+    def _hash(self, data: bytes, basename: str) -> Dict[str, Any]:
+        if not self.timer:
+            return super()._hash(data, basename)
+        start = perf_counter()
+        hashes = super()._hash(data, basename)
+        self.timer.add('hash', perf_counter() - start, bytes_in=len(data))
+        return hashes
+
+    def _process_file(self, raw_data: bytes, raw_basename: str,
+                      zip_basename: Optional[str]) -> Tuple[dict, Optional[dict]]:
+        if not self.timer:
+            return super()._process_file(raw_data, raw_basename, zip_basename)
+        hash_seconds = self.timer.stages.get('hash', {}).get('seconds', 0.0)
+        start = perf_counter()
+        raw_info, zip_info = super()._process_file(raw_data, raw_basename, zip_basename)
+        elapsed = perf_counter() - start
+        # Hashing happens inside, and is accounted for separately.
+        elapsed -= self.timer.stages.get('hash', {}).get('seconds', 0.0) - hash_seconds
+        bytes_out = (zip_info or raw_info)['bytes']
+        self.timer.add('compress_write', elapsed, bytes_in=len(raw_data), bytes_out=bytes_out)
+        return raw_info, zip_info
+
+    def _encode_column(self, encoding: str, values: List[Any]) -> List[bytes]:
+        """Encode every value of one column.
+        Args:
+            encoding (str): MDS encoding of the column.
+            values (List[Any]): Column values.
+        Returns:
+            List[bytes]: Encoded values.
+        """
+        if encoding == 'str':
+            return list(map(str.encode, values))
+        if encoding == 'bytes':
+            return list(values)
+        return [mds_encode(encoding, value) for value in values]
+
+    def encode_batch(self, batch: Dict[str, List[Any]]) -> List[bytes]:
+        """Encode a batch of samples given as one list per column.
+        Produces exactly what ``encode_sample`` would for each sample.
+        Args:
+            batch (Dict[str, List[Any]]): Column name to the values of every sample in the batch.
+        Returns:
+            List[bytes]: Encoded samples.
+        """
+        columns = [
+            self._encode_column(encoding, batch[name])
+            for name, encoding in zip(self.column_names, self.column_encodings)
+        ]
+        is_var = [size is None for size in self.column_sizes]
+        head = struct.Struct(f'={sum(is_var)}I')
+        if len(columns) == 1:
+            if is_var[0]:
+                return [head.pack(len(datum)) + datum for datum in columns[0]]
+            return columns[0]
+        samples = []
+        for data in zip(*columns):
+            sizes = [len(datum) for datum, var in zip(data, is_var) if var]
+            samples.append(head.pack(*sizes) + b''.join(data))
+        return samples
+
+    def write_batch(self, batch: Dict[str, List[Any]]) -> None:
+        """Write a batch of samples given as one list per column.
+        Equivalent to calling ``write`` on each sample, without building a dict per sample.
+        Args:
+            batch (Dict[str, List[Any]]): Column name to the values of every sample in the batch.
+        """
+        start = perf_counter()
+        new_samples = self.encode_batch(batch)
+        if self.timer:
+            self.timer.add('encode', perf_counter() - start, bytes_out=sum(map(len, new_samples)),
+                           calls=len(new_samples))
+        for new_sample in new_samples:
+            new_sample_size = len(new_sample) + self.extra_bytes_per_sample
+            if self.size_limit and self.size_limit < self.new_shard_size + new_sample_size:
+                self.flush_shard()
+                self._reset_cache()
+            self.new_samples.append(new_sample)
+            self.new_shard_size += new_sample_size
+
+
+def read_index(root: str) -> List[Dict[str, Any]]:
+    """Read the shard metadata of an MDS dataset.
+    Args:
+        root (str): Dataset directory.
+    Returns:
+        List[Dict[str, Any]]: Shard metadata, in order.
+    """
+    return json.load(open(os.path.join(root, 'index.json')))['shards']
+
+
+def iter_shard(root: str, info: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Read every sample of an MDS shard, in order, without a StreamingDataset.
+    Args:
+        root (str): Dataset directory.
+        info (Dict[str, Any]): Metadata of the shard, from its ``index.json``.
+    Returns:
+        Iterator[Dict[str, Any]]: Decoded samples.
+    """
+    raw_filename = os.path.join(root, info['raw_data']['basename'])
+    if os.path.exists(raw_filename):
+        data = open(raw_filename, 'rb').read()
+    else:
+        zip_filename = os.path.join(root, info['zip_data']['basename'])
+        data = decompress(info['compression'], open(zip_filename, 'rb').read())
+
+    # Shard: sample count, sample offsets, config, samples. Sample: sizes of the variable-size
+    # columns, then the column data.
+    num_samples, = struct.unpack_from('=I', data)
+    offsets = struct.unpack_from(f'={num_samples + 1}I', data, 4)
+    columns = list(zip(info['column_names'], info['column_encodings'], info['column_sizes']))
+    num_var = sum(size is None for _, _, size in columns)
+    head = struct.Struct(f'={num_var}I')
+    for begin in offsets[:-1]:
+        var_sizes = iter(head.unpack_from(data, begin))
+        pos = begin + head.size
+        sample = {}
+        for name, encoding, size in columns:
+            if size is None:
+                size = next(var_sizes)
+            sample[name] = mds_decode(encoding, data[pos:pos + size])
+            pos += size
+        yield sample
+
+
+def iter_samples(root: str, ids: Iterable[int]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Read given samples of an MDS dataset, reading only the shards that hold them.
+    Args:
+        root (str): Dataset directory.
+        ids (Iterable[int]): Sample ids, sorted.
+    Returns:
+        Iterator[Tuple[int, Dict[str, Any]]]: Each sample id and its decoded sample, in order.
+    """
+    infos = read_index(root)
+    ids = iter(ids)
+    want = next(ids, None)
+    begin = 0
+    for info in infos:
+        end = begin + info['samples']
+        if want is not None and want < end:
+            for idx, sample in enumerate(iter_shard(root, info), begin):
+                while want is not None and want < idx:
+                    want = next(ids, None)
+                if want == idx:
+                    yield idx, sample
+                    want = next(ids, None)
+                if want is None or end <= want:
+                    break
+        begin = end
+
+
+def is_converted(journal: ConversionJournal, root: str, split: str, group: str,
+                 fingerprint: str) -> bool:
+    """Check whether an input file's current contents are already converted.
+    That is either merged into the split's dataset, or converted and waiting to be merged.
+    Args:
+        journal (ConversionJournal): Conversion journal.
+        root (str): Dataset directory of the split.
+        split (str): Split name.
+        group (str): Shard group name of the input file.
+        fingerprint (str): Current fingerprint of the input file.
+    Returns:
+        bool: Whether the input file can be skipped.
+    """
+    entry = journal.get(split)
+    for merged in entry['groups'] if entry else []:
+        if merged['group'] == group and merged['fingerprint'] == fingerprint:
+            return True
+    entry = journal.get(f'{split}/{group}')
+    return bool(entry) and entry.get('fingerprint') == fingerprint and \
+        os.path.isdir(os.path.join(root, group))
+
+
+def commit_split(journal: ConversionJournal, root: str, split: str, groups: List[str]) -> None:
+    """Merge the newly converted shard groups of a split into its dataset and journal the result.
+    Groups already in the dataset keep their place, changed ones are replaced where they are, and
+    new ones are appended in the given order. Groups whose input file is gone are deleted, shards
+    and all. Leftover group directories are removed.
+    Args:
+        journal (ConversionJournal): Conversion journal.
+        root (str): Dataset directory of the split.
+        split (str): Split name.
+        groups (List[str]): Shard group names of the split's current input files, in order.
+    """
+    entry = journal.get(split)
+    merged_groups = entry['groups'] if entry else []
+    merged = {obj['group']: obj['shards'] for obj in merged_groups}
+    merged_fingerprints = {obj['group']: obj['fingerprint'] for obj in merged_groups}
+
+    fresh = {}
+    for group in groups:
+        subdir = os.path.join(root, group)
+        group_entry = journal.get(f'{split}/{group}')
+        if not os.path.isdir(subdir) or not group_entry:
+            continue
+        if merged_fingerprints.get(group) != group_entry.get('fingerprint'):
+            fresh[group] = subdir
+
+    removed = [group for group in merged if group not in groups]
+    has_plan = os.path.exists(os.path.join(root, 'merge_plan.json'))
+    if fresh or removed or has_plan:
+        order = [obj['group'] for obj in merged_groups if obj['group'] in groups]
+        order += [group for group in groups if group in fresh and group not in merged]
+        result = update_shard_groups(root, order, fresh, merged)
+        objs = []
+        for group, basenames in result:
+            obj = {
+                'group': group,
+                'shards': basenames,
+                'fingerprint': journal.get(f'{split}/{group}')['fingerprint'],  # pyright: ignore
+            }
+            objs.append(obj)
+        journal.record(split, groups=objs)
+        remove_merge_plan(root)
+    remove_shard_groups([os.path.join(root, group) for group in groups])
@@ -0,0 +1,264 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Pack a pretokenized Pile of Law MDS dataset into fixed-length blocks of tokens, once.
+
+Every sample of the output is exactly ``max_seq_len`` uint16 token ids, cut from the documents laid
+end to end in dataset order, as the ``concat`` group method of StreamingPileOfLaw does on the fly.
+Each block also stores the offsets at which documents start inside it, so attention that does not
+cross documents can be rebuilt per block (see packing.block_attention_mask). Load the result with
+PackedPileOfLaw in test_load.py, which has a known length.
+
+Each pretokenized shard is packed by a worker process into a shard group of its own. The tokens
+each shard leaves over are packed together in order into one last group, and whatever is left
+after that, less than one block, is dropped. Finished groups and splits are journaled with the
+``max_seq_len`` and ``eos_token_id`` they were packed with, so an interrupted run resumes where it
+stopped, and a run with other values repacks the split from scratch.
+
+    python pack.py --in_root mds-pol-tokens --out_root mds-pol-packed --max_seq_len 2048
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from multiprocessing import Pool
+from shutil import rmtree
+from typing import Dict, List, Tuple
+
+import numpy as np
+from streaming.base.util import get_list_arg
+from tqdm import tqdm
+
+from mds_util import (ConversionJournal, PoLMDSWriter, finalize_group, iter_shard,
+                      merge_shard_groups, partial_dirname, read_index, remove_partial_groups)
+from packing import concat_documents, join_runs, pack_run
+
+TOKEN_DTYPE = np.uint16
+START_DTYPE = np.uint32
+
+COLUMNS = {
+    'tokens': 'bytes',
+    'doc_starts': 'bytes',
+}
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--in_root',
+        type=str,
+        required=True,
+        help='Directory path of the pretokenized MDS dataset written by pretokenize.py',
+    )
+    args.add_argument(
+        '--out_root',
+        type=str,
+        required=True,
+        help='Directory path to store the packed MDS dataset',
+    )
+    args.add_argument(
+        '--max_seq_len',
+        type=int,
+        default=2048,
+        help='Tokens per packed sample. Default: 2048',
+    )
+    args.add_argument(
+        '--eos_token_id',
+        type=int,
+        default=-1,
+        help='If set, append this token id to every document before packing. The concat group ' +
+        'method of StreamingPileOfLaw does not. Default: -1, disabled',
+    )
+    args.add_argument(
+        '--splits',
+        type=str,
+        default='train,validation',
+        help='Splits to pack. Default: train,validation',
+    )
+    args.add_argument(
+        '--compression',
+        type=str,
+        default='zstd:7',
+        help='Compression algorithm to use. Default: zstd:7',
+    )
+    args.add_argument(
+        '--hashes',
+        type=str,
+        default='sha1,xxh64',
+        help='Hashing algorithms to apply to shard files. Default: sha1,xxh64',
+    )
+    args.add_argument(
+        '--size_limit',
+        type=int,
+        default=1 << 27,
+        help='Shard size limit, after which point to start a new shard. Default: 1 << 27',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of packing processes. Default: all available cores',
+    )
+    return args.parse_args()
+
+
+def write_blocks(out_dir: str, blocks: np.ndarray, block_starts: List[np.ndarray],
+                 args: Namespace) -> None:
+    """Write packed blocks into a shard group.
+    Args:
+        out_dir (str): Shard group directory.
+        blocks (np.ndarray): Blocks, of shape (blocks, max_seq_len).
+        block_starts (List[np.ndarray]): Document starts inside each block.
+        args (Namespace): Command-line arguments.
+    """
+    with PoLMDSWriter(partial_dirname(out_dir), COLUMNS, args.compression,
+                      get_list_arg(args.hashes), args.size_limit) as out:
+        batch = {
+            'tokens': [block.astype(TOKEN_DTYPE).tobytes() for block in blocks],
+            'doc_starts': [starts.astype(START_DTYPE).tobytes() for starts in block_starts],
+        }
+        out.write_batch(batch)
+    finalize_group(out_dir)
+
+
+def tail_filename(out_dir: str) -> str:
+    """Get the file that keeps the tokens a shard group left over.
+    Args:
+        out_dir (str): Shard group directory.
+    Returns:
+        str: Path to the file.
+    """
+    return os.path.join(out_dir, 'tail.npz')
+
+
+def packing_params(args: Namespace) -> Dict[str, int]:
+    """Get the arguments that change what packing writes, to journal with each unit of it.
+    Args:
+        args (Namespace): Command-line arguments.
+    Returns:
+        Dict[str, int]: ``max_seq_len`` and ``eos_token_id``.
+    """
+    return {'max_seq_len': args.max_seq_len, 'eos_token_id': args.eos_token_id}
+
+
+def is_packed(journal: ConversionJournal, key: str, args: Namespace) -> bool:
+    """Check whether a split or shard group was packed, with the same packing arguments.
+    Args:
+        journal (ConversionJournal): Journal of the packed shard groups.
+        key (str): Journal key.
+        args (Namespace): Command-line arguments.
+    Returns:
+        bool: Whether it is done and can be kept.
+    """
+    obj = journal.get(key)
+    return obj is not None and \
+        all(obj.get(name) == value for name, value in packing_params(args).items())
+
+
+def pack_shard(task: Tuple[str, Dict, str], args: Namespace) -> Tuple[str, int, int]:
+    """Pack the documents of one pretokenized shard. This is the unit of work of the process pool.
+    Args:
+        task (Tuple[str, Dict, str]): Pretokenized dataset directory, metadata of the shard, and
+            the directory of the shard group to write.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Tuple[str, int, int]: Shard group directory, number of documents and number of blocks.
+    """
+    in_split_dir, info, out_dir = task
+    samples = iter_shard(in_split_dir, info)
+    docs = [np.frombuffer(sample['tokens'], TOKEN_DTYPE) for sample in samples]
+    eos_token_id = args.eos_token_id if args.eos_token_id >= 0 else None
+    tokens, starts = concat_documents(docs, eos_token_id)
+    blocks, block_starts, (tail, tail_starts) = pack_run(tokens, starts, args.max_seq_len)
+    write_blocks(out_dir, blocks, block_starts, args)
+    np.savez(tail_filename(out_dir), tokens=tail, starts=tail_starts)
+    return out_dir, len(docs), len(blocks)
+
+
+def pack_split(in_split_dir: str, out_split_dir: str, split: str, journal: ConversionJournal,
+               args: Namespace) -> None:
+    """Pack every shard of a split in parallel, then their leftovers, and merge them in order.
+    Args:
+        in_split_dir (str): Pretokenized dataset directory of the split.
+        out_split_dir (str): Packed dataset directory of the split.
+        split (str): Split name.
+        journal (ConversionJournal): Journal of the packed shard groups.
+        args (Namespace): Command-line arguments.
+    """
+    if is_packed(journal, split, args):
+        print(f'{split} is already packed')
+        return
+    infos = read_index(in_split_dir)
+    subdirs = [os.path.join(out_split_dir, f'{idx:05}') for idx in range(len(infos))]
+    tail_dir = os.path.join(out_split_dir, 'tail')
+    keys = [split, f'{split}/tail'] + [f'{split}/{os.path.basename(subdir)}' for subdir in subdirs]
+    if any(key in journal and not is_packed(journal, key, args) for key in keys):
+        # None of what was packed with another max_seq_len or eos_token_id can be reused.
+        print(f'{split} was packed with other arguments, repacking')
+        rmtree(out_split_dir)
+        os.makedirs(out_split_dir)
+    remove_partial_groups(out_split_dir)
+
+    tasks = []
+    for info, subdir in zip(infos, subdirs):
+        if not is_packed(journal, f'{split}/{os.path.basename(subdir)}', args):
+            tasks.append((in_split_dir, info, subdir))
+
+    progbar = tqdm(total=len(infos), initial=len(infos) - len(tasks), desc=split)
+    with Pool(args.num_proc) as pool:
+        for subdir, num_docs, num_blocks in pool.imap_unordered(partial(pack_shard, args=args),
+                                                                tasks):
+            journal.record(f'{split}/{os.path.basename(subdir)}',
+                           **packing_params(args),
+                           samples=num_docs,
+                           blocks=num_blocks)
+            progbar.update()
+    progbar.close()
+
+    if not is_packed(journal, f'{split}/tail', args):
+        runs = []
+        for subdir in subdirs:
+            tail = np.load(tail_filename(subdir))
+            runs.append((tail['tokens'], tail['starts']))
+        tokens, starts = join_runs(runs)
+        blocks, block_starts, (dropped, _) = pack_run(tokens, starts, args.max_seq_len)
+        write_blocks(tail_dir, blocks, block_starts, args)
+        journal.record(f'{split}/tail',
+                       **packing_params(args),
+                       blocks=len(blocks),
+                       dropped_tokens=len(dropped))
+
+    merge_shard_groups(out_split_dir, subdirs + [tail_dir])
+    objs = [journal.get(f'{split}/{os.path.basename(subdir)}') or {} for subdir in subdirs]
+    tail_obj = journal.get(f'{split}/tail') or {}
+    journal.record(split,
+                   **packing_params(args),
+                   samples=sum(obj['samples'] for obj in objs),
+                   blocks=sum(obj['blocks'] for obj in objs) + tail_obj['blocks'],
+                   dropped_tokens=tail_obj['dropped_tokens'])
+
+
+def main(args: Namespace) -> None:
+    """Pack each split of a pretokenized MDS dataset.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    if args.max_seq_len > np.iinfo(START_DTYPE).max:
+        raise ValueError(f'max_seq_len must be at most {np.iinfo(START_DTYPE).max}.')
+    os.makedirs(args.out_root, exist_ok=True)
+    journal = ConversionJournal(os.path.join(args.out_root, 'journal.jsonl'))
+    for split in get_list_arg(args.splits):
+        out_split_dir = os.path.join(args.out_root, split)
+        os.makedirs(out_split_dir, exist_ok=True)
+        pack_split(os.path.join(args.in_root, split), out_split_dir, split, journal, args)
+        summary = journal.get(split) or {}
+        print(json.dumps({'split': split, **summary}, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,144 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Pack tokenized documents back to back into fixed-length blocks, keeping document boundaries.
+
+A run of documents is held as one token array plus the offsets at which each document starts.
+Blocks cut from it keep the starts that fall inside them, relative to the block, so attention that
+does not cross documents can be rebuilt per block. A block that does not start with 0 continues a
+document from the previous block.
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def concat_documents(docs: List[np.ndarray],
+                     eos_token_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate documents into one run of tokens.
+    Args:
+        docs (List[np.ndarray]): Token ids of each document.
+        eos_token_id (int, optional): If set, append this token to every document. Defaults to
+            ``None``.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Tokens, and the offset at which each non-empty document
+            starts.
+    """
+    lengths = np.fromiter(map(len, docs), np.int64, len(docs))
+    if eos_token_id is not None and docs:
+        eos = np.array([eos_token_id], docs[0].dtype)
+        docs = [piece for doc in docs for piece in (doc, eos)]
+        lengths += 1
+    if not docs:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    tokens = np.concatenate(docs)
+    starts = np.cumsum(lengths) - lengths
+    return tokens, starts[lengths > 0]
+
+
+def join_runs(runs: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Join runs of tokens end to end.
+    Args:
+        runs (List[Tuple[np.ndarray, np.ndarray]]): Tokens and document starts of each run.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Tokens and document starts of the joined run.
+    """
+    if not runs:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    lengths = np.array([len(tokens) for tokens, _ in runs], np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    tokens = np.concatenate([tokens for tokens, _ in runs])
+    starts = np.concatenate([starts + offset for (_, starts), offset in zip(runs, offsets)])
+    return tokens, starts.astype(np.int64)
+
+
+def pack_run(
+    tokens: np.ndarray, starts: np.ndarray, max_seq_len: int
+) -> Tuple[np.ndarray, List[np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    """Cut a run of tokens into as many full blocks as it holds.
+    Args:
+        tokens (np.ndarray): Tokens of the run.
+        starts (np.ndarray): Offsets at which documents start in the run, ascending.
+        max_seq_len (int): Tokens per block.
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray], Tuple[np.ndarray, np.ndarray]]: Blocks, of shape
+            (blocks, max_seq_len), the document starts inside each block, and the leftover run
+            that did not fill a block.
+    """
+    num_blocks = len(tokens) // max_seq_len
+    end = num_blocks * max_seq_len
+    blocks = tokens[:end].reshape(num_blocks, max_seq_len)
+    edges = np.searchsorted(starts, np.arange(num_blocks + 1) * max_seq_len)
+    block_starts = [
+        starts[edges[idx]:edges[idx + 1]] - idx * max_seq_len for idx in range(num_blocks)
+    ]
+    tail = tokens[end:], starts[edges[-1]:] - end
+    return blocks, block_starts, tail
+
+
+def block_attention_mask(doc_starts: np.ndarray, max_seq_len: int) -> np.ndarray:
+    """Build the causal attention mask of a block that does not attend across documents.
+    Args:
+        doc_starts (np.ndarray): Offsets at which documents start in the block.
+        max_seq_len (int): Tokens per block.
+    Returns:
+        np.ndarray: Boolean mask of shape (max_seq_len, max_seq_len), true where query token
+            (row) may attend to key token (column).
+    """
+    segments = np.zeros(max_seq_len, np.int64)
+    segments[doc_starts[doc_starts > 0]] = 1
+    segments = np.cumsum(segments)
+    same = segments[:, None] == segments[None, :]
+    return np.tril(same)
+
+
+class TokenPacker:
+    """Concatenate token samples and cut them into blocks of ``max_seq_len``, in linear time.
+    Every column of a sample (``input_ids``, ``attention_mask``, ...) is packed alike. Tokens are
+    copied at most once into a buffer of one block and out again; blocks that lie entirely inside
+    one sample are returned as views of it without copying.
+    Args:
+        max_seq_len (int): Tokens per block.
+        dtype (np.dtype): Type of the buffered values. Default: ``np.int64``.
+    """
+
+    def __init__(self, max_seq_len: int, dtype: np.dtype = np.int64) -> None:
+        self.max_seq_len = max_seq_len
+        self.dtype = dtype
+        self.buffers = {}
+        self.size = 0
+
+    def push(self, sample: Dict[str, Sequence[int]]) -> Iterator[Dict[str, np.ndarray]]:
+        """Add a sample, and get every block that is now complete.
+        Args:
+            sample (Dict[str, Sequence[int]]): Column name to values, each of the same length.
+        Returns:
+            Iterator[Dict[str, np.ndarray]]: Column name to the values of each complete block.
+        """
+        columns = {key: np.asarray(value, self.dtype) for key, value in sample.items()}
+        if not columns:
+            return
+        length = len(next(iter(columns.values())))
+        pos = 0
+        if self.size:
+            # Top up the partial block from the head of the sample.
+            pos = min(self.max_seq_len - self.size, length)
+            for key, value in columns.items():
+                self.buffers[key][self.size:self.size + pos] = value[:pos]
+            self.size += pos
+            if self.size < self.max_seq_len:
+                return
+            block = self.buffers
+            self.buffers = {}
+            self.size = 0
+            yield block
+        while length - pos >= self.max_seq_len:
+            yield {key: value[pos:pos + self.max_seq_len] for key, value in columns.items()}
+            pos += self.max_seq_len
+        if pos < length:
+            for key, value in columns.items():
+                if key not in self.buffers:
+                    self.buffers[key] = np.empty(self.max_seq_len, self.dtype)
+                self.buffers[key][:length - pos] = value[pos:]
+            self.size = length - pos
@@ -0,0 +1,141 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Tokenize only as much of each document as truncation keeps, or a document piece by piece.
+
+Truncating to ``max_seq_len`` tokens throws away most of a long document, so we tokenize a
+character prefix of it, sized from a generous chars-per-token ratio, and double the prefix for the
+few documents it falls short on. The prefix is cut just before whitespace that follows a
+non-whitespace character. Pre-tokenizers such as GPT-2's byte-level one never put such a pair in
+one pre-token, and tokens never span pre-tokens, so every token of the prefix is also a token of
+the whole document: the first ``max_seq_len`` of them are exactly what truncation would keep.
+Not every pre-tokenizer splits there (byte-level without its regex splits nowhere), so each
+tokenizer's is checked on a probe text before we rely on it.
+
+Cutting a whole document at such boundaries likewise tokenizes it in pieces whose tokens add up
+to those of the whole, as long as the tokenizer adds nothing to the start of each piece either.
+"""
+
+import json
+import re
+from typing import Any, Iterator, List
+
+# Whitespace right after a non-whitespace character: a pre-token boundary.
+_CUT = re.compile(r'(?<=\S)\s')
+
+# Text with a cut at every kind of whitespace, after every kind of character, to check that a
+# pre-tokenizer splits at each of them.
+_PROBE = ('Id. at 12.  See 28 U.S.C. § 1331(a)(1);\tcf. Fed. R. Civ. P. 12(b)(6),\n\nPlaintiff’s '
+          'claim\r\nfails — "so" it\'s\u00a0dismissed \u3000é  ü\x0b\x0c42 % $3.50 (a) [b] {c} '
+          '_x_ a-b a/b ¶ 5 -- end.\n')
+
+
+def supports_prefix_tokenization(tokenizer: Any) -> bool:
+    """Check that tokenizing a prefix gives the same tokens as truncating, for a tokenizer.
+    It has to be a fast tokenizer whose pre-tokenizer splits text wherever ``text_prefix`` may cut
+    it, and that adds no special tokens, which would go at the end of the prefix instead of the
+    document.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer.
+    Returns:
+        bool: Whether ``tokenize_prefixes`` matches truncation with this tokenizer.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is None or backend.pre_tokenizer is None or \
+            tokenizer.num_special_tokens_to_add() != 0:
+        return False
+    # A cut inside a pre-token could change the tokens on either side of it.
+    for _, (begin, end) in backend.pre_tokenizer.pre_tokenize_str(_PROBE):
+        if _CUT.search(_PROBE[begin:end]):
+            return False
+    return True
+
+
+def supports_chunked_tokenization(tokenizer: Any) -> bool:
+    """Check that tokenizing a text in pieces gives the same tokens as tokenizing it whole.
+    On top of ``supports_prefix_tokenization``, the tokenizer must not prepend anything to each
+    piece, as ``add_prefix_space`` or a ``Prepend`` normalizer would.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer.
+    Returns:
+        bool: Whether ``iter_token_chunks`` matches tokenizing whole texts with this tokenizer.
+    """
+    if not supports_prefix_tokenization(tokenizer):
+        return False
+    obj = json.loads(tokenizer.backend_tokenizer.to_str())
+    todo = [obj.get('normalizer'), obj.get('pre_tokenizer')]
+    while todo:
+        part = todo.pop()
+        if isinstance(part, list):
+            todo += part
+        elif isinstance(part, dict):
+            if part.get('add_prefix_space') or part.get('type') == 'Prepend' or \
+                    part.get('prepend_scheme') in ['always', 'first']:
+                return False
+            todo += part.values()
+    return True
+
+
+def text_prefix(text: str, num_chars: int) -> str:
+    """Cut a text at the first pre-token boundary at or after a number of characters.
+    Args:
+        text (str): Text.
+        num_chars (int): Minimum length of the prefix.
+    Returns:
+        str: Prefix, which is the whole text if it has no boundary that far in.
+    """
+    if len(text) <= num_chars:
+        return text
+    match = _CUT.search(text, num_chars)
+    return text[:match.start()] if match else text
+
+
+def tokenize_prefixes(tokenizer: Any,
+                      texts: List[str],
+                      max_seq_len: int,
+                      chars_per_token: float = 6.0) -> List[List[int]]:
+    """Tokenize texts, truncated to ``max_seq_len`` tokens, by tokenizing prefixes of them.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer, for which ``supports_prefix_tokenization`` holds.
+        texts (List[str]): Texts to tokenize.
+        max_seq_len (int): Tokens to keep per text.
+        chars_per_token (float): Characters of prefix per token to keep, to begin with. The
+            higher, the less often a prefix falls short and is tokenized again twice as long.
+            Default: ``6.0``.
+    Returns:
+        List[List[int]]: Token ids of each text, the same as with ``truncation=True``.
+    """
+    input_ids: List[List[int]] = [[] for _ in texts]
+    todo = list(range(len(texts)))
+    num_chars = int(max_seq_len * chars_per_token)
+    while todo:
+        prefixes = [text_prefix(texts[idx], num_chars) for idx in todo]
+        encoded = tokenizer(prefixes, truncation=False, padding=False,
+                            return_attention_mask=False)['input_ids']
+        short = []
+        for idx, prefix, ids in zip(todo, prefixes, encoded):
+            if len(ids) >= max_seq_len or len(prefix) == len(texts[idx]):
+                input_ids[idx] = ids[:max_seq_len]
+            else:
+                short.append(idx)
+        todo = short
+        num_chars *= 2
+    return input_ids
+
+
+def iter_token_chunks(tokenizer: Any, text: str, num_chars: int) -> Iterator[List[int]]:
+    """Tokenize a text in pieces of at least a number of characters, one piece at a time.
+    Args:
+        tokenizer (Any): HuggingFace tokenizer, for which ``supports_chunked_tokenization`` holds.
+        text (str): Text to tokenize.
+        num_chars (int): Minimum length of each piece but the last.
+    Returns:
+        Iterator[List[int]]: Token ids of each piece, which concatenate to those of the text.
+    """
+    begin = 0
+    while begin < len(text):
+        match = _CUT.search(text, begin + num_chars) if begin + num_chars < len(text) else None
+        end = match.start() if match else len(text)
+        yield tokenizer(text[begin:end], truncation=False, padding=False,
+                        return_attention_mask=False)['input_ids']
+        begin = end
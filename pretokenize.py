@@ -0,0 +1,236 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Tokenize a converted Pile of Law MDS dataset once, storing each document as uint16 token ids.
+
+The tokenizer from create_tokenizer.py has a 52k vocab, so every token id fits in two bytes. Each
+shard of the text dataset is tokenized by a worker process into a shard group of its own, and the
+groups are merged into one index per split, in the order of the text shards. Other columns, such
+as pol_set_name, are copied over as they are. The token count of every document is also saved, in
+order, to lengths.npy in each split, which tells how many windows each document makes. Load the
+result with PretokenizedPileOfLaw in test_load.py.
+
+    python pretokenize.py --in_root mds-pol --out_root mds-pol-tokens
+"""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import transformers
+from streaming.base.util import get_list_arg
+from tqdm import tqdm
+
+from mds_util import (ConversionJournal, PoLMDSWriter, finalize_group, iter_shard,
+                      merge_shard_groups, partial_dirname, read_index, remove_partial_groups)
+
+TOKEN_DTYPE = np.uint16
+
+# Tokenizer of each worker process, loaded once by init_worker.
+tokenizer = None
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--in_root',
+        type=str,
+        required=True,
+        help='Directory path of the text MDS dataset, with one subdirectory per split',
+    )
+    args.add_argument(
+        '--out_root',
+        type=str,
+        required=True,
+        help='Directory path to store the tokenized MDS dataset',
+    )
+    args.add_argument(
+        '--tokenizer',
+        type=str,
+        default='pile-of-law-tokenizer',
+        help='Name or path of the HuggingFace tokenizer, as saved by create_tokenizer.py. ' +
+        'Default: pile-of-law-tokenizer',
+    )
+    args.add_argument(
+        '--splits',
+        type=str,
+        default='train,validation',
+        help='Splits to tokenize. Default: train,validation',
+    )
+    args.add_argument(
+        '--compression',
+        type=str,
+        default='zstd:7',
+        help='Compression algorithm to use. Default: zstd:7',
+    )
+    args.add_argument(
+        '--hashes',
+        type=str,
+        default='sha1,xxh64',
+        help='Hashing algorithms to apply to shard files. Default: sha1,xxh64',
+    )
+    args.add_argument(
+        '--size_limit',
+        type=int,
+        default=1 << 27,
+        help='Shard size limit, after which point to start a new shard. Default: 1 << 27',
+    )
+    args.add_argument(
+        '--batch_size',
+        type=int,
+        default=64,
+        help='Documents per tokenizer call. Default: 64',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of tokenizing processes. Default: all available cores',
+    )
+    return args.parse_args()
+
+
+def load_tokenizer(name: str) -> Any:
+    """Load a tokenizer and check that its token ids fit the token dtype.
+    Args:
+        name (str): Name or path of the HuggingFace tokenizer.
+    Returns:
+        Any: The tokenizer.
+    """
+    os.environ['TRANSFORMERS_NO_ADVISORY_WARNINGS'] = '1'
+    loaded = transformers.AutoTokenizer.from_pretrained(name)
+    # Documents are far longer than any model context; they are split up when loaded.
+    loaded.model_max_length = int(1e30)
+    if len(loaded) > np.iinfo(TOKEN_DTYPE).max + 1:
+        raise ValueError(f'Tokenizer {name} has {len(loaded)} tokens, too many for ' +
+                         f'{np.dtype(TOKEN_DTYPE).name} token ids.')
+    return loaded
+
+
+def init_worker(name: str) -> None:
+    """Load the tokenizer of a worker process.
+    Args:
+        name (str): Name or path of the HuggingFace tokenizer.
+    """
+    global tokenizer
+    # The pool already uses every core.
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    tokenizer = load_tokenizer(name)
+
+
+def lengths_filename(dirname: str) -> str:
+    """Get the file that keeps the token count of each document of a split or shard group.
+    Args:
+        dirname (str): Split or shard group directory.
+    Returns:
+        str: Path to the file.
+    """
+    return os.path.join(dirname, 'lengths.npy')
+
+
+def tokenize_shard(task: Tuple[str, Dict[str, Any], str], args: Namespace) -> Tuple[str, int, int]:
+    """Tokenize one text shard into a shard group. This is the unit of work of the process pool.
+    Args:
+        task (Tuple[str, Dict[str, Any], str]): Text dataset directory, metadata of the shard,
+            and the directory of the shard group to write.
+        args (Namespace): Command-line arguments.
+    Returns:
+        Tuple[str, int, int]: Shard group directory, number of documents and number of tokens.
+    """
+    in_split_dir, info, out_dir = task
+    columns = {'tokens': 'bytes'}
+    for name, encoding in zip(info['column_names'], info['column_encodings']):
+        if name != 'text':
+            columns[name] = encoding
+
+    lengths = []
+    with PoLMDSWriter(partial_dirname(out_dir), columns, args.compression,
+                      get_list_arg(args.hashes), args.size_limit) as out:
+        samples = list(iter_shard(in_split_dir, info))
+        for begin in range(0, len(samples), args.batch_size):
+            batch = samples[begin:begin + args.batch_size]
+            ids = tokenizer([sample['text'] for sample in batch])['input_ids']  # pyright: ignore
+            tokens = [np.array(sample_ids, TOKEN_DTYPE).tobytes() for sample_ids in ids]
+            columns_batch = {'tokens': tokens}
+            for name in columns:
+                if name != 'tokens':
+                    columns_batch[name] = [sample[name] for sample in batch]
+            out.write_batch(columns_batch)
+            lengths += map(len, ids)
+    finalize_group(out_dir)
+    np.save(lengths_filename(out_dir), np.array(lengths, np.int64))
+    return out_dir, len(lengths), sum(lengths)
+
+
+def tokenize_split(in_split_dir: str, out_split_dir: str, split: str,
+                   journal: ConversionJournal, args: Namespace) -> None:
+    """Tokenize every shard of a split in parallel, then merge the shard groups in order.
+    Args:
+        in_split_dir (str): Text dataset directory of the split.
+        out_split_dir (str): Tokenized dataset directory of the split.
+        split (str): Split name.
+        journal (ConversionJournal): Journal of the tokenized shard groups.
+        args (Namespace): Command-line arguments.
+    """
+    if split in journal:
+        print(f'{split} is already tokenized')
+        return
+    remove_partial_groups(out_split_dir)
+
+    infos = read_index(in_split_dir)
+    subdirs = [os.path.join(out_split_dir, f'{idx:05}') for idx in range(len(infos))]
+    tasks = []
+    for info, subdir in zip(infos, subdirs):
+        if f'{split}/{os.path.basename(subdir)}' not in journal:
+            tasks.append((in_split_dir, info, subdir))
+
+    progbar = tqdm(total=len(infos), initial=len(infos) - len(tasks), desc=split)
+    with Pool(args.num_proc, init_worker, (args.tokenizer,)) as pool:
+        for subdir, num_samples, num_tokens in pool.imap_unordered(
+                partial(tokenize_shard, args=args), tasks):
+            journal.record(f'{split}/{os.path.basename(subdir)}',
+                           samples=num_samples,
+                           tokens=num_tokens)
+            progbar.update()
+    progbar.close()
+
+    # The groups are gone once merged, so only gather their lengths if a previous run did not.
+    if not os.path.exists(lengths_filename(out_split_dir)):
+        lengths = [np.load(lengths_filename(subdir)) for subdir in subdirs]
+        lengths = np.concatenate(lengths) if lengths else np.empty(0, np.int64)
+        np.save(lengths_filename(out_split_dir), lengths)
+    merge_shard_groups(out_split_dir, subdirs)
+    counts = [journal.get(f'{split}/{os.path.basename(subdir)}') for subdir in subdirs]
+    journal.record(split,
+                   tokenizer=args.tokenizer,
+                   dtype=np.dtype(TOKEN_DTYPE).name,
+                   samples=sum(obj['samples'] for obj in counts),  # pyright: ignore
+                   tokens=sum(obj['tokens'] for obj in counts))  # pyright: ignore
+
+
+def main(args: Namespace) -> None:
+    """Tokenize each split of a text MDS dataset.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    load_tokenizer(args.tokenizer)
+    os.makedirs(args.out_root, exist_ok=True)
+    journal = ConversionJournal(os.path.join(args.out_root, 'journal.jsonl'))
+    for split in get_list_arg(args.splits):
+        out_split_dir = os.path.join(args.out_root, split)
+        os.makedirs(out_split_dir, exist_ok=True)
+        tokenize_split(os.path.join(args.in_root, split), out_split_dir, split, journal, args)
+        summary = journal.get(split) or {}
+        print(json.dumps({'split': split, **summary}, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,102 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""A mergeable sketch of a distribution of non-negative values, for approximate quantiles.
+
+Values are counted in logarithmic bins, as in DDSketch: with a relative accuracy ``a``, bin ``k``
+holds the values in ``(gamma ** (k - 1), gamma ** k]`` for ``gamma = (1 + a) / (1 - a)``, so any
+quantile is returned within ``a`` of a value of the right rank. The number of bins only grows
+with the log of the range of the values, not with their number, and sketches built from separate
+parts of the data merge exactly, by adding up their bins.
+"""
+
+import math
+from typing import Any, Dict
+
+import numpy as np
+
+
+class QuantileSketch:
+    """Approximate quantiles of non-negative values.
+    Args:
+        relative_accuracy (float): Relative error of quantiles. Default: ``0.01``.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f'relative_accuracy must be in (0, 1), got {relative_accuracy}.')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, values: Any) -> None:
+        """Add values.
+        Args:
+            values (Any): Array-like of non-negative values.
+        """
+        values = np.asarray(values, np.float64).ravel()
+        positive = values[values > 0]
+        self.count += len(values)
+        self.zeros += len(values) - len(positive)
+        keys = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+        for key, count in zip(*map(np.ndarray.tolist, np.unique(keys, return_counts=True))):
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Add the values of another sketch of the same accuracy.
+        Args:
+            other (QuantileSketch): The other sketch.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Can only merge sketches of the same relative accuracy.')
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Get an approximate quantile.
+        Args:
+            q (float): Quantile, from 0 to 1.
+        Returns:
+            float: Value of that quantile, or NaN if the sketch is empty.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma**max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the sketch to JSON-compatible data.
+        Returns:
+            Dict[str, Any]: The sketch.
+        """
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'zeros': self.zeros,
+            'bins': {str(key): count for key, count in sorted(self.bins.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> 'QuantileSketch':
+        """Deserialize a sketch.
+        Args:
+            obj (Dict[str, Any]): The sketch, from ``to_dict``.
+        Returns:
+            QuantileSketch: The sketch.
+        """
+        sketch = cls(obj['relative_accuracy'])
+        sketch.bins = {int(key): count for key, count in obj['bins'].items()}
+        sketch.zeros = obj['zeros']
+        sketch.count = sketch.zeros + sum(sketch.bins.values())
+        return sketch
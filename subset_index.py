@@ -0,0 +1,303 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Index the documents of a split of a Pile of Law MDS dataset by subset, to sample them by subset.
+
+Courtlistener alone is most of the Pile of Law, so a uniform sample barely has any uscode, cfr or
+frcp in it. The index lists the sample ids of each subset (the ``pol_set_name`` column), with the
+character count of each document, so a subset can be drawn from in O(1) per draw, and a stratified
+sample taken to per-subset quotas of documents or characters without reading the dataset again.
+
+Building it scans every shard once, in parallel. It is saved to ``subsets.npz`` in the split
+directory, next to ``subsets.json``, which summarizes the document count, character count and
+sample id ranges of each subset.
+
+    python subset_index.py --root mds-pol --splits train
+"""
+
+import os
+from argparse import ArgumentParser, Namespace
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from streaming.base.util import get_list_arg
+from tqdm import tqdm
+
+from mds_util import iter_shard, read_index, write_json
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+    Args:
+        Namespace: command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument(
+        '--root',
+        type=str,
+        required=True,
+        help='Directory path of the converted MDS dataset, with one subdirectory per split',
+    )
+    args.add_argument(
+        '--splits',
+        type=str,
+        default='train,validation',
+        help='Splits to index. Default: train,validation',
+    )
+    args.add_argument(
+        '--num_proc',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of scanning processes. Default: all available cores',
+    )
+    return args.parse_args()
+
+
+def index_filename(split_dir: str) -> str:
+    """Get the file that keeps the subset index of a split.
+    Args:
+        split_dir (str): Dataset directory of the split.
+    Returns:
+        str: Path to the file.
+    """
+    return os.path.join(split_dir, 'subsets.npz')
+
+
+def parse_quotas(text: str, subsets: List[str]) -> Dict[str, int]:
+    """Parse per-subset quotas, such as ``20000,uscode=50000,cfr=0``.
+    Args:
+        text (str): Comma-separated ``subset=quota`` pairs. A bare quota applies to every subset
+            not listed.
+        subsets (List[str]): Every subset.
+    Returns:
+        Dict[str, int]: Quota of each subset that has one.
+    """
+    quotas = {}
+    default = None
+    for part in get_list_arg(text):
+        if '=' in part:
+            subset, value = part.split('=', 1)
+            if subset not in subsets:
+                raise ValueError(f'Unknown subset {subset}, expected one of {subsets}.')
+            quotas[subset] = int(float(value))
+        else:
+            default = int(float(part))
+    if default is not None:
+        for subset in subsets:
+            quotas.setdefault(subset, default)
+    return quotas
+
+
+class SubsetIndex:
+    """The sample ids and character counts of the documents of each subset of a split.
+    Args:
+        subsets (List[str]): Subset names, sorted.
+        offsets (np.ndarray): Where the documents of each subset start in ``ids``, and the end.
+        ids (np.ndarray): Sample ids, grouped by subset, in dataset order within each.
+        chars (np.ndarray): Character count of the document of each sample id of ``ids``.
+    """
+
+    def __init__(self, subsets: List[str], offsets: np.ndarray, ids: np.ndarray,
+                 chars: np.ndarray) -> None:
+        self.subsets = subsets
+        self.offsets = offsets
+        self.ids = ids
+        self.chars = chars
+
+    @classmethod
+    def from_samples(cls, names: List[str], chars: np.ndarray) -> 'SubsetIndex':
+        """Index documents given in dataset order.
+        Args:
+            names (List[str]): Subset of each document.
+            chars (np.ndarray): Character count of each document.
+        Returns:
+            SubsetIndex: The index.
+        """
+        subsets, codes = np.unique(np.array(names, str), return_inverse=True)
+        ids = np.argsort(codes, kind='stable').astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(subsets)))])
+        return cls(subsets.tolist(), offsets.astype(np.int64), ids,
+                   np.asarray(chars, np.int64)[ids])
+
+    @classmethod
+    def load(cls, split_dir: str) -> 'SubsetIndex':
+        """Load the index of a split.
+        Args:
+            split_dir (str): Dataset directory of the split.
+        Returns:
+            SubsetIndex: The index.
+        """
+        obj = np.load(index_filename(split_dir))
+        return cls(obj['subsets'].tolist(), obj['offsets'], obj['ids'], obj['chars'])
+
+    def save(self, split_dir: str) -> None:
+        """Save the index of a split, with a JSON summary of it.
+        Args:
+            split_dir (str): Dataset directory of the split.
+        """
+        np.savez(index_filename(split_dir),
+                 subsets=np.array(self.subsets, str),
+                 offsets=self.offsets,
+                 ids=self.ids,
+                 chars=self.chars)
+        summary = {}
+        for subset in self.subsets:
+            summary[subset] = {
+                'docs': self.count(subset),
+                'chars': self.num_chars(subset),
+                'ranges': self.ranges(subset),
+            }
+        write_json(os.path.join(split_dir, 'subsets.json'), summary)
+
+    def _bounds(self, subset: str) -> Tuple[int, int]:
+        """Get where the documents of a subset are in ``ids``.
+        Args:
+            subset (str): Subset name.
+        Returns:
+            Tuple[int, int]: Begin and end.
+        """
+        if subset not in self.subsets:
+            raise ValueError(f'Unknown subset {subset}, expected one of {self.subsets}.')
+        idx = self.subsets.index(subset)
+        return int(self.offsets[idx]), int(self.offsets[idx + 1])
+
+    def count(self, subset: str) -> int:
+        """Get the number of documents of a subset.
+        Args:
+            subset (str): Subset name.
+        Returns:
+            int: Document count.
+        """
+        begin, end = self._bounds(subset)
+        return end - begin
+
+    def num_chars(self, subset: str) -> int:
+        """Get the number of characters of the documents of a subset.
+        Args:
+            subset (str): Subset name.
+        Returns:
+            int: Character count.
+        """
+        begin, end = self._bounds(subset)
+        return int(self.chars[begin:end].sum())
+
+    def ranges(self, subset: str) -> List[Tuple[int, int]]:
+        """Get the runs of consecutive sample ids of a subset.
+        Args:
+            subset (str): Subset name.
+        Returns:
+            List[Tuple[int, int]]: Begin and end of each run of sample ids, in order.
+        """
+        begin, end = self._bounds(subset)
+        ids = self.ids[begin:end]
+        if not len(ids):
+            return []
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        stops = np.concatenate([breaks, [len(ids)]])
+        return [(int(ids[a]), int(ids[b - 1]) + 1) for a, b in zip(starts, stops)]
+
+    def draw(self, subset: str, rng: np.random.Generator) -> int:
+        """Draw a random document of a subset, with replacement.
+        Args:
+            subset (str): Subset name.
+            rng (np.random.Generator): Random generator.
+        Returns:
+            int: Sample id.
+        """
+        begin, end = self._bounds(subset)
+        if begin == end:
+            raise ValueError(f'Subset {subset} has no documents.')
+        return int(self.ids[begin + rng.integers(end - begin)])
+
+    def sample(self,
+               quotas: Dict[str, int],
+               unit: str = 'docs',
+               seed: Optional[int] = None) -> np.ndarray:
+        """Draw documents of each subset without replacement, up to a quota per subset.
+        A subset with less than its quota gives all of its documents.
+        Args:
+            quotas (Dict[str, int]): Quota of each subset to draw from. Subsets left out give
+                nothing.
+            unit (str): What quotas count, ``docs`` or ``chars``. A character quota takes
+                documents until their characters reach it. Default: ``docs``.
+            seed (int, optional): Random seed. Default: ``None``.
+        Returns:
+            np.ndarray: Sample ids, sorted.
+        """
+        if unit not in ['docs', 'chars']:
+            raise ValueError(f'Unknown quota unit {unit}, expected docs or chars.')
+        rng = np.random.default_rng(seed)
+        parts = []
+        for subset, quota in sorted(quotas.items()):
+            begin, end = self._bounds(subset)
+            if unit == 'docs':
+                picks = begin + rng.choice(end - begin, min(quota, end - begin), replace=False)
+            else:
+                order = begin + rng.permutation(end - begin)
+                # Keep documents until the one that reaches the quota, inclusive.
+                reached = np.cumsum(self.chars[order]) >= quota
+                num_picks = int(np.argmax(reached)) + 1 if reached.any() else len(order)
+                picks = order[:num_picks] if quota > 0 else order[:0]
+            parts.append(self.ids[picks])
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, np.int64)
+
+
+def shard_subsets(task: Tuple[str, Dict[str, Any]]) -> Tuple[List[str], np.ndarray]:
+    """Read the subset and character count of every document of a shard. This is the unit of work
+    of the process pool.
+    Args:
+        task (Tuple[str, Dict[str, Any]]): Dataset directory of the split, and metadata of the
+            shard.
+    Returns:
+        Tuple[List[str], np.ndarray]: Subset and character count of each document.
+    """
+    split_dir, info = task
+    names = []
+    chars = []
+    for sample in iter_shard(split_dir, info):
+        names.append(sample.get('pol_set_name', 'all'))
+        chars.append(len(sample['text']))
+    return names, np.array(chars, np.int64)
+
+
+def build_index(split_dir: str, split: str, num_proc: int) -> SubsetIndex:
+    """Index a split, scanning its shards in parallel.
+    Args:
+        split_dir (str): Dataset directory of the split.
+        split (str): Split name.
+        num_proc (int): Number of scanning processes.
+    Returns:
+        SubsetIndex: The index.
+    """
+    infos = read_index(split_dir)
+    names = []
+    chars = []
+    with Pool(num_proc) as pool:
+        tasks = [(split_dir, info) for info in infos]
+        # In shard order, so that positions are sample ids.
+        for shard_names, shard_chars in tqdm(pool.imap(shard_subsets, tasks),
+                                             total=len(tasks),
+                                             desc=split):
+            names += shard_names
+            chars.append(shard_chars)
+    chars = np.concatenate(chars) if chars else np.empty(0, np.int64)
+    return SubsetIndex.from_samples(names, chars)
+
+
+def main(args: Namespace) -> None:
+    """Index each split of a text MDS dataset by subset.
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    for split in get_list_arg(args.splits):
+        split_dir = os.path.join(args.root, split)
+        index = build_index(split_dir, split, args.num_proc)
+        index.save(split_dir)
+        for subset in index.subsets:
+            print(f'{split} {subset}: {index.count(subset)} docs')
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -5,18 +5,157 @@
 
 import os
 import sys
-from itertools import islice
-from typing import Any, Dict, Iterator, Optional
+from itertools import chain, islice
+from typing import Any, Dict, Iterator, List, Optional
 
 import numpy as np
 import streaming as ms
+import torch
 import transformers
 from omegaconf import DictConfig
 from omegaconf import OmegaConf as om
-from torch.utils.data import DataLoader
+from streaming.base.storage import download
+from streaming.base.world import World
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from bucketing import bucket_batches, padded_length
+from packing import TokenPacker, block_attention_mask
+from prefix_tokenize import (iter_token_chunks, supports_chunked_tokenization,
+                             supports_prefix_tokenization, tokenize_prefixes)
+from token_cache import TokenCache, hash_file, tokenizer_fingerprint
+from windowing import WindowIndex, iter_windows
+
+# Token ids of unpadded samples in memory. Any vocab we use fits, at half the size of int64.
+TOKEN_DTYPE = np.int32
+
+
+class BatchTokenizing:
+    """Mixin for text datasets that tokenize with ``_tokenize``, to tokenize groups of samples.
+    While iterating, ``tokenize_batch_size`` raw text samples are fetched and tokenized with one
+    batched call of the fast tokenizer, then yielded one by one. The token samples are identical to
+    tokenizing each sample on its own. A ``tokenize_batch_size`` of 1 tokenizes each sample in
+    ``__getitem__``, as before. Indexing the dataset directly always tokenizes one sample.
+
+    If ``token_cache`` is set, the input ids of a sample are looked up there by sample index before
+    its text is fetched, and stored there once it is tokenized. ``_from_cache`` turns them back
+    into a token sample.
+    """
+
+    tokenize_batch_size = 1
+    token_cache: Optional[TokenCache] = None
+
+    def _from_cache(self, input_ids: np.ndarray) -> Dict[str, Any]:
+        """Build the token sample of cached input ids, for samples that are neither truncated nor
+        padded.
+        Args:
+            input_ids (np.ndarray): Cached input ids.
+        Returns:
+            Dict[str, Any]: Token sample.
+        """
+        return {'input_ids': input_ids.tolist(), 'attention_mask': [1] * len(input_ids)}
+
+    def _get_raw(self, idx: int) -> Dict[str, Any]:
+        """Get the text sample of an index, without tokenizing it.
+        Args:
+            idx (int): Sample index.
+        Returns:
+            Dict[str, Any]: Text sample.
+        """
+        return ms.StreamingDataset.__getitem__(self, idx)  # pyright: ignore
+
+    def _get_token_sample(self, idx: int) -> Dict[str, Any]:
+        """Get the token sample of an index, from the cache if it is there. For ``__getitem__``.
+        Args:
+            idx (int): Sample index.
+        Returns:
+            Dict[str, Any]: Token sample.
+        """
+        if self.token_cache is not None:
+            input_ids = self.token_cache.get(idx)
+            if input_ids is not None:
+                return self._from_cache(input_ids)
+        token_sample = self._tokenize(self._get_raw(idx))  # pyright: ignore
+        if self.token_cache is not None:
+            self.token_cache.put(idx, token_sample['input_ids'])
+        return token_sample
 
+    def _tokenize_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Tokenize several texts with one tokenizer call.
+        Args:
+            texts (List[str]): Texts to tokenize.
+        Returns:
+            List[Dict[str, Any]]: Token sample of each text.
+        """
+        batch = self._tokenize({'text': texts})  # pyright: ignore
+        return [{key: values[idx] for key, values in batch.items()} for idx in range(len(texts))]
 
-class SimpleStreamingPileOfLaw(ms.StreamingDataset):
+    def _tokenize_pending(self, pending: List[Any]) -> Iterator[Dict[str, Any]]:
+        """Tokenize the text samples among fetched samples with one call, keeping their order.
+        Args:
+            pending (List[Any]): Token samples, and sample index and text sample pairs.
+        Returns:
+            Iterator[Dict[str, Any]]: Token samples.
+        """
+        texts = [item[1]['text'] for item in pending if isinstance(item, tuple)]
+        token_samples = iter(self._tokenize_batch(texts) if texts else [])
+        for item in pending:
+            if not isinstance(item, tuple):
+                yield item
+                continue
+            token_sample = next(token_samples)
+            if self.token_cache is not None:
+                self.token_cache.put(item[0], token_sample['input_ids'])
+            yield token_sample
+
+    def _iter_sample_ids(self) -> Iterator[int]:
+        """Iterate over the sample indices of this worker's partition of one epoch, downloading
+        ahead, as ``StreamingDataset.__iter__`` does before it indexes each one.
+        Returns:
+            Iterator[int]: Sample indices.
+        """
+        # Exit the thread that is downloading the shards for last epoch, if it exists.
+        if self._partition_state:  # pyright: ignore
+            self._partition_state.stop()  # pyright: ignore
+        world = World()
+        epoch, sample_in_epoch = self._get_progress(world)  # pyright: ignore
+        sample_ids = self._get_partition(world, epoch, sample_in_epoch)  # pyright: ignore
+        if not len(sample_ids):  # Resumed at end of epoch, out of samples.
+            return
+        yield from self._each_sample(sample_ids)  # pyright: ignore
+
+    def _iter_raw_samples(self) -> Iterator[Any]:
+        """Iterate over the samples of one epoch without tokenizing them.
+        Returns:
+            Iterator[Any]: Token samples that are cached, and sample index and text sample pairs
+                for the rest.
+        """
+        for idx in self._iter_sample_ids():
+            if self.token_cache is not None:
+                input_ids = self.token_cache.get(idx)
+                if input_ids is not None:
+                    yield self._from_cache(input_ids)
+                    continue
+            yield idx, self._get_raw(idx)
+
+    def _iter_token_samples(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the token samples of one epoch.
+        Returns:
+            Iterator[Dict[str, Any]]: Token samples.
+        """
+        if self.tokenize_batch_size <= 1:
+            yield from super().__iter__()  # pyright: ignore
+            return
+        pending = []
+        for item in self._iter_raw_samples():
+            pending.append(item)
+            if len(pending) == self.tokenize_batch_size:
+                yield from self._tokenize_pending(pending)
+                pending = []
+        if pending:
+            yield from self._tokenize_pending(pending)
+
+
+class SimpleStreamingPileOfLaw(BatchTokenizing, ms.StreamingDataset):
     """Implementation of the the Pile using StreamingDataset.
     Args:
         tokenizer_name (str): The name of the HuggingFace tokenizer to use to tokenize samples.
@@ -44,6 +183,12 @@ class SimpleStreamingPileOfLaw(ms.StreamingDataset):
             Defaults to ``None``, which is interpreted as the number of nodes of the initial run.
         batch_size (int, optional): Batch size of its DataLoader, which affects how the dataset is
             partitioned over the workers. Defaults to ``None``.
+        tokenize_batch_size (int): Number of samples to tokenize per tokenizer call while
+            iterating. Defaults to ``1``.
+        cache_dir (str, optional): If set, cache the token ids of samples on local disk in this
+            directory, shared by every worker and run with the same dataset and tokenizer.
+            Defaults to ``None``.
+        cache_size_limit (int): Bytes of token ids to keep in the cache. Defaults to ``1 << 34``.
     """
 
     def __init__(self,
@@ -60,13 +205,17 @@ class SimpleStreamingPileOfLaw(ms.StreamingDataset):
                  validate_hash: Optional[str] = None,
                  shuffle_seed: Optional[int] = None,
                  num_canonical_nodes: Optional[int] = None,
-                 batch_size: Optional[int] = None) -> None:
+                 batch_size: Optional[int] = None,
+                 tokenize_batch_size: int = 1,
+                 cache_dir: Optional[str] = None,
+                 cache_size_limit: int = 1 << 34) -> None:
 
         super().__init__(local, remote, split, shuffle, predownload, keep_zip, download_retry,
                          download_timeout, validate_hash, shuffle_seed, num_canonical_nodes,
                          batch_size)
         self.tokenizer_name = tokenizer_name
         self.max_seq_len = max_seq_len
+        self.tokenize_batch_size = tokenize_batch_size
 
         # Build tokenizer
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.tokenizer_name)
@@ -74,6 +223,13 @@ class SimpleStreamingPileOfLaw(ms.StreamingDataset):
             # Some tokenizers (e.g. GPT2 tokenizer) have no padding token which causes bugs
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
+        if cache_dir:
+            index_filename = os.path.join(local, split or '', 'index.json')
+            dtype = np.uint16 if len(self.tokenizer) <= 1 << 16 else TOKEN_DTYPE
+            self.token_cache = TokenCache(cache_dir, hash_file(index_filename),
+                                          tokenizer_fingerprint(self.tokenizer), cache_size_limit,
+                                          dtype)
+
     def _tokenize(self, text_sample: Dict[str, Any]):
         """Apply the tokenizer to a sample.
         Args:
@@ -90,13 +246,14 @@ class SimpleStreamingPileOfLaw(ms.StreamingDataset):
         Returns:
             Any: Sample data.
         """
-        text_sample = super().__getitem__(idx)
-        token_sample = self._tokenize(text_sample)
         # Skip any token grouping
-        return token_sample
+        return self._get_token_sample(idx)
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._iter_token_samples()
 
 
-class StreamingPileOfLaw(ms.StreamingDataset):
+class StreamingPileOfLaw(BatchTokenizing, ms.StreamingDataset):
     """Implementation of the C4 dataset using MosaicML's streaming Dataset V2.
     Args:
         remote (str): Remote directory (S3 or local filesystem) where dataset
@@ -109,9 +266,23 @@ class StreamingPileOfLaw(ms.StreamingDataset):
             tokenize samples.
         max_seq_len (int): The max sequence length of each sample.
         group_method (str): How to group text samples into token samples.
-            Supports 'truncate' or 'concat'.
+            Supports 'truncate', 'concat', or 'window' to cut each document into
+            windows of max_seq_len tokens. Truncated samples and windows are
+            unpadded arrays of input ids, to be padded per batch by
+            DynamicPaddingCollator.
         batch_size (Optional[int]): Hint batch_size that will be used on
             each device's DataLoader. Default: ``None``.
+        tokenize_batch_size (int): Number of samples to tokenize per tokenizer
+            call while iterating. Default: ``1``.
+        prefix_chars_per_token (float): If group_method=='truncate', only
+            tokenize a prefix of each text of about this many characters per
+            token kept, doubling it if it falls short. The tokens are the same
+            as truncating the whole text. Tokenizers that do not guarantee it
+            (see prefix_tokenize.py) tokenize the whole text. ``0`` disables.
+            Default: ``6.0``.
+        window_stride (Optional[int]): If group_method=='window', tokens
+            between the starts of consecutive windows of a document, up to
+            max_seq_len. Default: ``None``, max_seq_len, for no overlap.
     """
 
     def __init__(self,
@@ -122,15 +293,22 @@ class StreamingPileOfLaw(ms.StreamingDataset):
                  tokenizer_name: str,
                  max_seq_len: int,
                  group_method: str = 'truncate',
-                 batch_size: Optional[int] = None):
+                 batch_size: Optional[int] = None,
+                 tokenize_batch_size: int = 1,
+                 prefix_chars_per_token: float = 6.0,
+                 window_stride: Optional[int] = None):
         # Validation
         if split not in ['train', 'validation']:
             raise ValueError(
                 f"split='{split}' must be one of ['train', 'validation'].")
-        if group_method not in ['truncate', 'concat']:
+        if group_method not in ['truncate', 'concat', 'window']:
             raise ValueError(
-                f"group_method='{group_method}' must be one of ['truncate', 'concat']."
+                f"group_method='{group_method}' must be one of ['truncate', 'concat', 'window']."
             )
+        window_stride = window_stride or max_seq_len
+        if not 0 < window_stride <= max_seq_len:
+            raise ValueError(
+                f'window_stride={window_stride} must be from 1 to max_seq_len={max_seq_len}.')
 
         # Build Dataset
         super().__init__(remote=remote,
@@ -142,6 +320,7 @@ class StreamingPileOfLaw(ms.StreamingDataset):
         self.tokenizer_name = tokenizer_name
         self.max_seq_len = max_seq_len
         self.group_method = group_method
+        self.tokenize_batch_size = tokenize_batch_size
 
         # Build tokenizer
         os.environ['TRANSFORMERS_NO_ADVISORY_WARNINGS'] = '1'
@@ -152,29 +331,59 @@ class StreamingPileOfLaw(ms.StreamingDataset):
             self.tokenizer.pad_token = self.tokenizer.eos_token
         # suppress warnings when using group_method='concat' and no truncation
         self.tokenizer.model_max_length = int(1e30)
-
-    # How to tokenize a text sample to a token sample
+        self.prefix_chars_per_token = prefix_chars_per_token
+        if not supports_prefix_tokenization(self.tokenizer):
+            self.prefix_chars_per_token = 0
+        self.window_stride = window_stride
+        self.chunked = supports_chunked_tokenization(self.tokenizer)
+
+    # How to tokenize a text sample (or a batch of them) to a token sample
+    # If group_method=='truncate', only the input ids are kept, as an unpadded
+    # array; the attention mask is all ones until the batch is padded.
     def _tokenize(self, text_sample):
         if self.group_method == 'truncate':
-            truncation = True
-            padding = 'max_length'
-            max_length = self.max_seq_len
+            texts = text_sample['text']
+            if self.prefix_chars_per_token:
+                batch = [texts] if isinstance(texts, str) else texts
+                input_ids = tokenize_prefixes(self.tokenizer, batch, self.max_seq_len,
+                                              self.prefix_chars_per_token)
+                if isinstance(texts, str):
+                    input_ids = input_ids[0]
+            else:
+                input_ids = self.tokenizer(texts,
+                                           truncation=True,
+                                           padding=False,
+                                           max_length=self.max_seq_len,
+                                           return_attention_mask=False)['input_ids']
+            if isinstance(texts, str):
+                return {'input_ids': np.asarray(input_ids, TOKEN_DTYPE)}
+            return {'input_ids': [np.asarray(ids, TOKEN_DTYPE) for ids in input_ids]}
         elif self.group_method == 'concat':
-            truncation = False
-            padding = False
-            max_length = None
+            return self.tokenizer(text_sample['text'], truncation=False, padding=False)
+        elif self.group_method == 'window':
+            return {'input_ids': list(self._iter_windows(text_sample['text']))}
         else:
             raise ValueError(f"Got unknown group_method='{self.group_method}'.")
-        return self.tokenizer(text_sample['text'],
-                              truncation=truncation,
-                              padding=padding,
-                              max_length=max_length)
+
+    # Cut a text into windows, tokenizing it a few windows' worth at a time
+    # unless the tokenizer could tokenize pieces differently from the whole.
+    def _iter_windows(self, text: str) -> Iterator[np.ndarray]:
+        if self.chunked:
+            chunks = iter_token_chunks(self.tokenizer, text, 4 * self.max_seq_len)
+        else:
+            chunks = [self.tokenizer(text, truncation=False, padding=False)['input_ids']]
+        for window in iter_windows(chunks, self.max_seq_len, self.window_stride):
+            yield window.astype(TOKEN_DTYPE)
 
     # How to process a sample
+    # If group_method=='window', samples are windows, which are only known
+    # once each document is tokenized, so they have no index to get them by.
     def __getitem__(self, idx: int) -> Dict[str, Any]:
-        text_sample = super().__getitem__(idx)
-        token_sample = self._tokenize(text_sample)
-        return token_sample
+        if self.group_method == 'window':
+            raise ValueError(
+                "Windows of group_method='window' can only be iterated over. " +
+                'PretokenizedPileOfLaw.get_window gets windows by index.')
+        return self._get_token_sample(idx)
 
     # Define iterable over samples
     # Usually this can be left alone and inherited directly from super()
@@ -182,25 +391,24 @@ class StreamingPileOfLaw(ms.StreamingDataset):
     # If group_method=='truncate', we simply return the token sample.
     # If group_method=='concat', then we keep fetching token samples until we
     # fill up max_seq_len.
+    # If group_method=='window', we yield each window of each document.
     def __iter__(self) -> Iterator[Any]:
         if self.group_method == 'truncate':
-            iterator = super().__iter__()
+            iterator = self._iter_token_samples()
             yield from iterator
 
         elif self.group_method == 'concat':
-            buffer = {}
+            packer = TokenPacker(self.max_seq_len)
             while True:
-                iterator = super().__iter__()
+                iterator = self._iter_token_samples()
                 for sample in iterator:
+                    for block in packer.push(sample):
+                        yield {k: v.tolist() for k, v in block.items()}
 
-                    for k, v in sample.items():
-                        buffer[k] = buffer.get(k, []) + v
-                    while len(buffer['input_ids']) >= self.max_seq_len:
-                        concat_sample = {}
-                        for k, v in buffer.items():
-                            concat_sample[k] = v[:self.max_seq_len]
-                            buffer[k] = v[self.max_seq_len:]
-                        yield concat_sample
+        elif self.group_method == 'window':
+            for idx in self._iter_sample_ids():
+                for window in self._iter_windows(self._get_raw(idx)['text']):
+                    yield {'input_ids': window}
         else:
             raise ValueError(f"Got unknown group_method='{self.group_method}'.")
 
@@ -209,27 +417,365 @@ class StreamingPileOfLaw(ms.StreamingDataset):
     # Dataset, but concatenating samples is custom behavior.
     # If group_method=='truncate', we simply return the # samples.
     # If group_method=='concat', we repeat forever, and have no defined length.
+    # If group_method=='window', the number of windows is not known until the
+    # documents are tokenized. See PretokenizedPileOfLaw for one that is.
     def __len__(self) -> Optional[int]:
         if self.group_method in ['truncate']:
             return super().__len__()
-        elif self.group_method == 'concat':
+        elif self.group_method in ['concat', 'window']:
             return None
         else:
             raise ValueError(f"Got unknown group_method='{self.group_method}'.")
 
 
+class PretokenizedPileOfLaw(ms.StreamingDataset):
+    """The Pile of Law as tokenized once by pretokenize.py, with no tokenizer in the loop.
+    Args:
+        remote (str): Remote directory (S3 or local filesystem) where dataset
+            is stored.
+        local (str): Local filesystem directory where dataset is cached
+            during operation.
+        split (str): The dataset split to use, either 'train' or 'validation'.
+        shuffle (bool): Whether to shuffle the samples in this dataset.
+        max_seq_len (int): The max sequence length of each sample.
+        group_method (str): How to group text samples into token samples.
+            Supports 'truncate', 'concat', 'window' to cut each document into
+            windows of max_seq_len tokens, or 'none' to return whole documents.
+            Truncated samples and windows are unpadded arrays of input ids, to
+            be padded per batch by DynamicPaddingCollator.
+        batch_size (Optional[int]): Hint batch_size that will be used on
+            each device's DataLoader. Default: ``None``.
+        window_stride (Optional[int]): If group_method=='window', tokens
+            between the starts of consecutive windows of a document, up to
+            max_seq_len. Default: ``None``, max_seq_len, for no overlap.
+
+    With group_method=='window', the document lengths that pretokenize.py
+    writes to lengths.npy give the number of windows, and get_window reads any
+    window by its index.
+    """
+
+    def __init__(self,
+                 remote: str,
+                 local: str,
+                 split: str,
+                 shuffle: bool,
+                 max_seq_len: int,
+                 group_method: str = 'truncate',
+                 batch_size: Optional[int] = None,
+                 window_stride: Optional[int] = None):
+        # Validation
+        if split not in ['train', 'validation']:
+            raise ValueError(
+                f"split='{split}' must be one of ['train', 'validation'].")
+        if group_method not in ['truncate', 'concat', 'window', 'none']:
+            raise ValueError(
+                f"group_method='{group_method}' must be one of " +
+                "['truncate', 'concat', 'window', 'none'].")
+        window_stride = window_stride or max_seq_len
+        if not 0 < window_stride <= max_seq_len:
+            raise ValueError(
+                f'window_stride={window_stride} must be from 1 to max_seq_len={max_seq_len}.')
+
+        # Build Dataset
+        super().__init__(remote=remote,
+                         local=local,
+                         split=split,
+                         shuffle=shuffle,
+                         keep_zip=False,
+                         batch_size=batch_size)
+        self.max_seq_len = max_seq_len
+        self.group_method = group_method
+        self.window_stride = window_stride
+        self.window_index = None
+        if group_method == 'window':
+            lengths_filename = os.path.join(local, split, 'lengths.npy')
+            if not os.path.exists(lengths_filename) and remote:
+                download(os.path.join(remote, split, 'lengths.npy'), lengths_filename, 60)
+            self.window_index = WindowIndex(np.load(lengths_filename), max_seq_len,
+                                            window_stride)
+
+    # Token ids are stored as uint16, see pretokenize.py.
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        sample = super().__getitem__(idx)
+        input_ids = np.frombuffer(sample['tokens'], np.uint16)
+        if self.group_method == 'truncate':
+            return {'input_ids': input_ids[:self.max_seq_len]}
+        if self.group_method == 'window':
+            return {'input_ids': input_ids}
+        input_ids = input_ids.tolist()
+        return {'input_ids': input_ids, 'attention_mask': [1] * len(input_ids)}
+
+    def get_window(self, idx: int) -> Dict[str, Any]:
+        """Get a window by its index over all windows of all documents.
+        Args:
+            idx (int): Window index.
+        Returns:
+            Dict[str, Any]: Input ids of the window.
+        """
+        if self.window_index is None:
+            raise ValueError(f"Windows need group_method='window', not '{self.group_method}'.")
+        doc, start = self.window_index.locate(idx)
+        input_ids = self[doc]['input_ids']
+        return {'input_ids': input_ids[start:start + self.max_seq_len]}
+
+    # Same grouping as StreamingPileOfLaw.
+    def __iter__(self) -> Iterator[Any]:
+        if self.group_method == 'window':
+            for sample in super().__iter__():
+                for window in iter_windows([sample['input_ids']], self.max_seq_len,
+                                           self.window_stride):
+                    yield {'input_ids': window}
+        elif self.group_method != 'concat':
+            yield from super().__iter__()
+        else:
+            packer = TokenPacker(self.max_seq_len)
+            while True:
+                for sample in super().__iter__():
+                    for block in packer.push(sample):
+                        yield {k: v.tolist() for k, v in block.items()}
+
+    def __len__(self) -> Optional[int]:
+        if self.window_index is not None:
+            return len(self.window_index)
+        if self.group_method != 'concat':
+            return super().__len__()
+        return None
+
+
+class PackedPileOfLaw(ms.StreamingDataset):
+    """The Pile of Law as packed once by pack.py into blocks of exactly max_seq_len tokens.
+    Unlike the concat group method, every sample is one block, so the dataset has a length.
+    Args:
+        remote (str): Remote directory (S3 or local filesystem) where dataset
+            is stored.
+        local (str): Local filesystem directory where dataset is cached
+            during operation.
+        split (str): The dataset split to use, either 'train' or 'validation'.
+        shuffle (bool): Whether to shuffle the samples in this dataset.
+        block_attention (bool): Whether to add a causal attention mask that does not cross
+            documents, built from the document starts of the block. Default: ``False``.
+        batch_size (Optional[int]): Hint batch_size that will be used on
+            each device's DataLoader. Default: ``None``.
+    """
+
+    def __init__(self,
+                 remote: str,
+                 local: str,
+                 split: str,
+                 shuffle: bool,
+                 block_attention: bool = False,
+                 batch_size: Optional[int] = None):
+        # Validation
+        if split not in ['train', 'validation']:
+            raise ValueError(
+                f"split='{split}' must be one of ['train', 'validation'].")
+
+        # Build Dataset
+        super().__init__(remote=remote,
+                         local=local,
+                         split=split,
+                         shuffle=shuffle,
+                         keep_zip=False,
+                         batch_size=batch_size)
+        self.block_attention = block_attention
+
+    # Token ids are stored as uint16 and document starts as uint32, see pack.py.
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        sample = super().__getitem__(idx)
+        input_ids = np.frombuffer(sample['tokens'], np.uint16).astype(np.int64)
+        doc_starts = np.frombuffer(sample['doc_starts'], np.uint32).astype(np.int64)
+        token_sample = {'input_ids': input_ids, 'doc_starts': doc_starts}
+        if self.block_attention:
+            token_sample['attention_mask'] = block_attention_mask(doc_starts, len(input_ids))
+        return token_sample
+
+
+def collate_packed(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Batch packed samples, which all have the same length, for causal language modeling.
+    Args:
+        samples (List[Dict[str, Any]]): Samples of PackedPileOfLaw.
+    Returns:
+        Dict[str, Any]: Input ids, labels, the attention mask if the samples have one, and the
+            document starts of each sample.
+    """
+    input_ids = torch.from_numpy(np.stack([sample['input_ids'] for sample in samples]))
+    batch = {
+        'input_ids': input_ids,
+        'labels': input_ids.clone(),
+        'doc_starts': [torch.from_numpy(sample['doc_starts']) for sample in samples],
+    }
+    if 'attention_mask' in samples[0]:
+        masks = [sample['attention_mask'] for sample in samples]
+        batch['attention_mask'] = torch.from_numpy(np.stack(masks))
+    return batch
+
+
+class DynamicPaddingCollator:
+    """Pad unpadded samples once per batch, to the longest sample, for causal language modeling.
+    Args:
+        pad_token_id (int): Token id to pad with.
+        pad_to_multiple_of (int, optional): If set, round the padded length up to a multiple of
+            this, so that batches come in fewer distinct shapes. Defaults to ``None``.
+        max_seq_len (int, optional): If set, never round the padded length up past this. Defaults
+            to ``None``.
+    """
+
+    def __init__(self,
+                 pad_token_id: int,
+                 pad_to_multiple_of: Optional[int] = None,
+                 max_seq_len: Optional[int] = None) -> None:
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.max_seq_len = max_seq_len
+
+    def __call__(self, samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Batch samples, padding them on the right.
+        Args:
+            samples (List[Dict[str, Any]]): Samples with unpadded ``input_ids``.
+        Returns:
+            Dict[str, Any]: Input ids, attention mask, and labels, which are ``-100`` at padding.
+        """
+        lengths = [len(sample['input_ids']) for sample in samples]
+        length = padded_length(max(lengths), self.pad_to_multiple_of, self.max_seq_len)
+        input_ids = np.full((len(samples), length), self.pad_token_id, np.int64)
+        attention_mask = np.zeros((len(samples), length), np.int64)
+        for row, (sample, sample_len) in enumerate(zip(samples, lengths)):
+            input_ids[row, :sample_len] = sample['input_ids']
+            attention_mask[row, :sample_len] = 1
+        labels = np.where(attention_mask == 1, input_ids, -100)
+        return {
+            'input_ids': torch.from_numpy(input_ids),
+            'attention_mask': torch.from_numpy(attention_mask),
+            'labels': torch.from_numpy(labels),
+        }
+
+
+class LengthBucketedDataset(IterableDataset):
+    """Reorder the samples of a dataset so that each batch holds samples of similar length.
+    Each DataLoader worker sorts windows of ``window`` batches of its own samples by length, and
+    shuffles the batches of each window (see bucketing.py). Batches are yielded sample by sample,
+    so the DataLoader must use the same ``batch_size``. The order is deterministic given the order
+    of the wrapped dataset, ``seed``, the epoch and the worker. The epoch is the one the wrapped
+    StreamingDataset is iterating, which it keeps in shared memory, so persistent workers see it.
+
+    Mid-epoch resumption is not supported: a worker reads a whole window ahead of the samples it
+    has yielded, so no sample count marks where the wrapped dataset could pick up. ``state_dict``
+    records the start of the current epoch instead, which is then replayed whole.
+    Args:
+        dataset (IterableDataset): Dataset whose samples have ``input_ids``.
+        batch_size (int): Batch size of the DataLoader.
+        window (int): Number of batches sorted together.
+        seed (int): Seed for ordering ties and batches. Default: ``0``.
+    """
+
+    def __init__(self, dataset: IterableDataset, batch_size: int, window: int, seed: int = 0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.window = window
+        self.seed = seed
+
+    def __iter__(self) -> Iterator[Any]:
+        worker_info = get_worker_info()
+        worker = worker_info.id if worker_info is not None else 0
+        samples = iter(self.dataset)
+        # The wrapped dataset counts the epoch once it starts iterating.
+        first = next(samples, None)
+        if first is None:
+            return
+        epoch = getattr(self.dataset, 'next_epoch', 1) - 1
+        batches = bucket_batches(chain([first], samples), lambda sample: len(sample['input_ids']),
+                                 self.batch_size, self.window, [self.seed, epoch, worker])
+        for batch in batches:
+            yield from batch
+
+    def state_dict(self, num_samples: int, from_beginning: bool) -> Dict[str, Any]:
+        """Get the state of the wrapped dataset at the start of the current epoch.
+        Args:
+            num_samples (int): Samples yielded so far, which are not where the wrapped dataset is.
+            from_beginning (bool): Whether ``num_samples`` counts from the start of the epoch.
+        Returns:
+            Dict[str, Any]: The state.
+        """
+        return self.dataset.state_dict(0, True)  # pyright: ignore
+
+    def load_state_dict(self, obj: Dict[str, Any]) -> None:
+        """Load the state of the wrapped dataset.
+        Args:
+            obj (Dict[str, Any]): The state.
+        """
+        self.dataset.load_state_dict(obj)  # pyright: ignore
+
+    # The wrapped dataset may have no length, as with the 'window' and 'concat' group methods.
+    def __len__(self) -> Optional[int]:
+        return self.dataset.__len__()  # pyright: ignore
+
+
 def build_pile_of_law_dataloader(cfg: DictConfig, device_batch_size: int):
     assert cfg.name == 'pile_of_law', f'Tried to build pile_of_law dataloader with cfg.name={cfg.name}'
-    dataset = SimpleStreamingPileOfLaw(split=cfg.dataset.split,
-                                 remote=cfg.dataset.remote,
-                                 local=cfg.dataset.local,
-                                 shuffle=cfg.dataset.shuffle,
-                                 tokenizer_name=cfg.dataset.tokenizer_name,
-                                 max_seq_len=cfg.dataset.max_seq_len,
-                                 batch_size=device_batch_size)
-
-    collate_fn = transformers.DataCollatorForLanguageModeling(
-        tokenizer=dataset.tokenizer, mlm=False)
+    collate_fn = None
+    if cfg.dataset.get('packed', False):
+        dataset = PackedPileOfLaw(split=cfg.dataset.split,
+                                  remote=cfg.dataset.remote,
+                                  local=cfg.dataset.local,
+                                  shuffle=cfg.dataset.shuffle,
+                                  block_attention=cfg.dataset.get('block_attention', False),
+                                  batch_size=device_batch_size)
+        collate_fn = collate_packed
+    elif cfg.dataset.get('pretokenized', False):
+        # The tokenizer is only needed to pad batches.
+        tokenizer = transformers.AutoTokenizer.from_pretrained(cfg.dataset.tokenizer_name)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        dataset = PretokenizedPileOfLaw(split=cfg.dataset.split,
+                                        remote=cfg.dataset.remote,
+                                        local=cfg.dataset.local,
+                                        shuffle=cfg.dataset.shuffle,
+                                        max_seq_len=cfg.dataset.max_seq_len,
+                                        group_method=cfg.dataset.get('group_method', 'truncate'),
+                                        batch_size=device_batch_size,
+                                        window_stride=cfg.dataset.get('window_stride', None))
+    elif cfg.dataset.get('group_method', 'none') in ['truncate', 'concat', 'window']:
+        dataset = StreamingPileOfLaw(split=cfg.dataset.split,
+                                     remote=cfg.dataset.remote,
+                                     local=cfg.dataset.local,
+                                     shuffle=cfg.dataset.shuffle,
+                                     tokenizer_name=cfg.dataset.tokenizer_name,
+                                     max_seq_len=cfg.dataset.max_seq_len,
+                                     group_method=cfg.dataset.group_method,
+                                     batch_size=device_batch_size,
+                                     tokenize_batch_size=cfg.dataset.get('tokenize_batch_size', 1),
+                                     prefix_chars_per_token=cfg.dataset.get(
+                                         'prefix_chars_per_token', 6.0),
+                                     window_stride=cfg.dataset.get('window_stride', None))
+        tokenizer = dataset.tokenizer
+    else:
+        dataset = SimpleStreamingPileOfLaw(split=cfg.dataset.split,
+                                     remote=cfg.dataset.remote,
+                                     local=cfg.dataset.local,
+                                     shuffle=cfg.dataset.shuffle,
+                                     tokenizer_name=cfg.dataset.tokenizer_name,
+                                     max_seq_len=cfg.dataset.max_seq_len,
+                                     batch_size=device_batch_size,
+                                     tokenize_batch_size=cfg.dataset.get('tokenize_batch_size', 1),
+                                     cache_dir=cfg.dataset.get('cache_dir', None),
+                                     cache_size_limit=cfg.dataset.get('cache_size_limit', 1 << 34))
+        tokenizer = dataset.tokenizer
+
+    group_method = getattr(dataset, 'group_method', None)
+    bucket_window = cfg.dataset.get('bucket_window', 0)
+    if bucket_window and collate_fn is None and group_method != 'concat':
+        # Samples of uneven length: batch similar lengths together to pad less.
+        dataset = LengthBucketedDataset(dataset, device_batch_size, bucket_window,
+                                        cfg.dataset.get('bucket_seed', 0))
+
+    if collate_fn is None and group_method in ['truncate', 'window']:
+        # Truncated samples and windows are unpadded; pad each batch only as far as it needs.
+        collate_fn = DynamicPaddingCollator(tokenizer.pad_token_id,
+                                            cfg.dataset.get('pad_to_multiple_of', None),
+                                            cfg.dataset.max_seq_len)
+    if collate_fn is None:
+        collate_fn = transformers.DataCollatorForLanguageModeling(
+            tokenizer=tokenizer, mlm=False)
 
     return DataLoader(
         dataset,
@@ -263,7 +809,12 @@ if __name__ == '__main__':
             'prefetch': 1000,
             'tokenizer_name': 'gpt2',
             'max_seq_len': 256000,  # don't want to truncate for test, these are LONG
-            'group_method': 'none' # for length test
+            'group_method': 'none',
+            'pad_to_multiple_of': None,  # with 'truncate', round padded batches up to this
+            'bucket_window': 0,  # batches to sort by length together, 0 to not bucket
+            'cache_dir': None,  # cache token ids here to skip tokenizing on later epochs and runs
+            'pretokenized': False,  # True to read the output of pretokenize.py
+            'packed': False,  # True to read the output of pack.py
         },
         'drop_last': False,
         'num_workers': 8,
@@ -279,32 +830,38 @@ if __name__ == '__main__':
     print(f'Reading {cfg.dataset.split} split from {remote} -> {local}')
 
     loader = build_pile_of_law_dataloader(cfg, device_batch_size)
-    tokenizer = loader.dataset.tokenizer  # type: ignore
-    # for batch_ix, batch in enumerate(islice(loader, 5)):
-    #     print('\n')
-    #     print('#' * 20, f'Batch {batch_ix}', '#' * 20)
-    #     for k, v in batch.items():
-    #         print(k, v.shape, v.dtype)
-    #     for sample_ix, token_sample in enumerate(batch['input_ids']):
-    #         if sample_ix == 0:
-    #             print('-' * 20, f' Sample {sample_ix} ', '-' * 20)
-    #             print(tokenizer.decode(token_sample))
-
-    # get average token's per sample
-    token_lengths = []
-    print('\n')
-    for batch in islice(loader, 150_000):
-        for sample in batch['input_ids']:
-            token_lengths.append(len(sample))
-    mean = np.mean(token_lengths)
-    print('#' * 20, "Sequence Length distribution", '#' * 20)
+    tokenizer = getattr(loader.collate_fn, 'tokenizer', None)
+    for batch_ix, batch in enumerate(islice(loader, 1)):
+        print('\n')
+        print('#' * 20, f'Batch {batch_ix}', '#' * 20)
+        for k, v in batch.items():
+            if isinstance(v, torch.Tensor):
+                print(k, v.shape, v.dtype)
+        if tokenizer is not None:
+            print('-' * 20, ' Sample 0 ', '-' * 20)
+            print(tokenizer.decode(batch['input_ids'][0])[:1000])
+
+    # Read some batches to check that the dataloader keeps working. For the length statistics of
+    # the whole corpus, run corpus_stats.py instead.
+    num_samples = 0
+    real_tokens = 0
+    padded_tokens = 0
+    for batch in islice(loader, 1000):
+        num_samples += len(batch['input_ids'])
+        mask = batch.get('attention_mask')
+        if mask is not None and mask.dim() == 2:
+            real_tokens += int(mask.sum())
+            padded_tokens += mask.numel()
     print('#' * 20)
-    print(f"mean sample length: {mean}")
-    for percentile in [1, 5, 10, 30, 50, 75, 80, 90, 95, 99]:
-        print(f"p{percentile}: {np.percentile(token_lengths, percentile)}")
+    print(f"read {num_samples} samples")
+    if padded_tokens:
+        print(f"padding efficiency: {real_tokens / padded_tokens:.3f} real tokens per position")
+    # The workers count their cache lookups in memory shared with this process.
+    dataset = loader.dataset
+    if isinstance(dataset, LengthBucketedDataset):
+        dataset = dataset.dataset
+    token_cache = getattr(dataset, 'token_cache', None)
+    if token_cache is not None:
+        print(f"token cache: {token_cache.stats()}")
     print('#' * 20)
-
-    print(f"{loader.dataset.index.total_samples} total samples")
-    print(f"mean sample length: {round(mean)} tokens")
-    print(f"{round(loader.dataset.index.total_samples * mean)} tokens")
     exit() # need to run with torchrun and doesn't know to die
@@ -0,0 +1,181 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""On-disk cache of tokenized samples, shared by the DataLoader workers of a node.
+
+Each cache lives in a directory named after the dataset and the tokenizer, so changing either
+starts a new cache rather than serving stale tokens. Every sample is one file of raw token ids,
+named after its sample index, which is memory-mapped when read. Files are written under a
+temporary name and renamed into place, so processes never see partial samples and need no locks.
+
+When the cache grows past its size limit, the oldest files are deleted until it is back under 90%
+of the limit. Every process only counts what it wrote itself, so it rescans the directory once it
+has written a sixteenth of the limit since its last scan.
+
+Hits, misses and evictions are counted in shared memory, so the process that creates a cache sees
+the lookups of every DataLoader worker it is copied to.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+from multiprocessing import Array
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Sample files per subdirectory, to keep directories small.
+FILES_PER_DIR = 4096
+
+
+def hash_file(filename: str) -> str:
+    """Hash a file, such as the index.json of a dataset split, which lists its shards' hashes.
+    Args:
+        filename (str): Path to the file.
+    Returns:
+        str: Hex digest.
+    """
+    with open(filename, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    """Hash everything that decides how a HuggingFace tokenizer maps text to token ids.
+    Args:
+        tokenizer (Any): The tokenizer.
+    Returns:
+        str: Hex digest.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        # Fast tokenizers serialize their whole pipeline: normalizer, pre-tokenizer, model, ...
+        data = backend.to_str()
+    else:
+        data = json.dumps([type(tokenizer).__name__, sorted(tokenizer.get_vocab().items())])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """Cache of the token ids of samples, keyed by sample index, on local disk.
+    Hit, miss and eviction counts are shared by this process and the workers it is copied to.
+    Args:
+        root (str): Directory holding all caches.
+        dataset_fingerprint (str): Fingerprint of the dataset split, see ``hash_file``.
+        tokenizer_fingerprint (str): Fingerprint of the tokenizer, see ``tokenizer_fingerprint``.
+        size_limit (int): Bytes of token ids to keep, across every process. Default: ``1 << 34``.
+        dtype (np.dtype): Type of the stored token ids. Default: ``np.int32``.
+    """
+
+    def __init__(self,
+                 root: str,
+                 dataset_fingerprint: str,
+                 tokenizer_fingerprint: str,
+                 size_limit: int = 1 << 34,
+                 dtype: np.dtype = np.int32) -> None:
+        name = f'{dataset_fingerprint[:16]}-{tokenizer_fingerprint[:16]}'
+        self.dirname = os.path.join(root, name)
+        self.size_limit = size_limit
+        self.dtype = np.dtype(dtype)
+        # Hits, misses and evictions.
+        self._counts = Array('q', 3)
+        self._written = 0
+        os.makedirs(self.dirname, exist_ok=True)
+
+    def filename(self, idx: int) -> str:
+        """Get the file of a sample.
+        Args:
+            idx (int): Sample index.
+        Returns:
+            str: Path to the file.
+        """
+        return os.path.join(self.dirname, f'{idx // FILES_PER_DIR:06}', f'{idx}.bin')
+
+    def get(self, idx: int) -> Optional[np.ndarray]:
+        """Read the token ids of a sample, if cached.
+        Args:
+            idx (int): Sample index.
+        Returns:
+            Optional[np.ndarray]: Read-only token ids, or ``None`` on a miss.
+        """
+        try:
+            with open(self.filename(idx), 'rb') as file:
+                if not os.fstat(file.fileno()).st_size:
+                    data = b''
+                else:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self._count(1)
+            return None
+        self._count(0)
+        return np.frombuffer(data, self.dtype)
+
+    def put(self, idx: int, input_ids: Any) -> None:
+        """Store the token ids of a sample.
+        Args:
+            idx (int): Sample index.
+            input_ids (Any): Token ids.
+        """
+        data = np.asarray(input_ids, self.dtype).tobytes()
+        filename = self.filename(idx)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_filename, filename)
+        self._written += len(data)
+        if self._written * 16 >= self.size_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete the oldest samples while the cache is over its size limit."""
+        self._written = 0
+        files = []
+        for subdir in os.scandir(self.dirname):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(file_size for _, file_size, _ in files)
+        if size <= self.size_limit:
+            return
+        files.sort()
+        for _, file_size, filename in files:
+            if size <= self.size_limit * 0.9:
+                break
+            try:
+                os.remove(filename)
+                self._count(2)
+            except FileNotFoundError:
+                # Another process evicted it first.
+                pass
+            size -= file_size
+
+    def _count(self, field: int) -> None:
+        """Add one to a shared counter.
+        Args:
+            field (int): ``0`` for hits, ``1`` for misses, ``2`` for evictions.
+        """
+        with self._counts.get_lock():
+            self._counts[field] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the counters of this process and its DataLoader workers.
+        Returns:
+            Dict[str, Any]: Hits, misses, evictions and the hit rate.
+        """
+        with self._counts.get_lock():
+            hits, misses, evictions = self._counts[:]
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': evictions,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
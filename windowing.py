@@ -0,0 +1,88 @@
+# Copyright 2022 MosaicML Streaming authors
+# SPDX-License-Identifier: Apache-2.0
+
+"""Cut documents into windows of at most ``max_seq_len`` tokens, every ``stride`` tokens.
+
+A document of ``L`` tokens becomes windows starting at 0, ``stride``, ``2 * stride``, ... up to
+the first one that reaches its end, so a stride below ``max_seq_len`` makes consecutive windows
+overlap by the difference. Only the last window of a document can be shorter than ``max_seq_len``.
+Windows are cut from a stream of token chunks, so a document never has to be held whole, and the
+number of windows of each document follows from its length, which ``WindowIndex`` uses to map a
+global window index to a document and an offset.
+"""
+
+from typing import Iterable, Iterator, Sequence, Tuple
+
+import numpy as np
+
+
+def count_windows(lengths: Sequence[int], max_seq_len: int, stride: int) -> np.ndarray:
+    """Count the windows of documents.
+    Args:
+        lengths (Sequence[int]): Token count of each document.
+        max_seq_len (int): Tokens per window.
+        stride (int): Tokens between the starts of consecutive windows.
+    Returns:
+        np.ndarray: Number of windows of each document, 0 for empty documents.
+    """
+    lengths = np.asarray(lengths, np.int64)
+    extra = np.maximum(lengths - max_seq_len, 0)
+    counts = 1 + (extra + stride - 1) // stride
+    return np.where(lengths > 0, counts, 0)
+
+
+def iter_windows(chunks: Iterable[Sequence[int]], max_seq_len: int,
+                 stride: int) -> Iterator[np.ndarray]:
+    """Cut a document, given as consecutive chunks of its tokens, into windows.
+    Holds at most one window and one chunk of tokens at a time.
+    Args:
+        chunks (Iterable[Sequence[int]]): Token ids of the document, in pieces.
+        max_seq_len (int): Tokens per window.
+        stride (int): Tokens between the starts of consecutive windows, from 1 to
+            ``max_seq_len``.
+    Returns:
+        Iterator[np.ndarray]: Token ids of each window.
+    """
+    buffer = np.empty(0, np.int64)
+    # Document offsets of the start of the buffer and of the end of the last window yielded.
+    start = 0
+    covered = 0
+    for chunk in chunks:
+        buffer = np.concatenate([buffer, np.asarray(chunk, np.int64)])
+        while len(buffer) >= max_seq_len:
+            yield buffer[:max_seq_len]
+            covered = start + max_seq_len
+            buffer = buffer[stride:]
+            start += stride
+    if start + len(buffer) > covered:
+        yield buffer
+
+
+class WindowIndex:
+    """Map the windows of a sequence of documents, numbered in order, to where they start.
+    Args:
+        lengths (Sequence[int]): Token count of each document.
+        max_seq_len (int): Tokens per window.
+        stride (int): Tokens between the starts of consecutive windows.
+    """
+
+    def __init__(self, lengths: Sequence[int], max_seq_len: int, stride: int) -> None:
+        self.max_seq_len = max_seq_len
+        self.stride = stride
+        counts = count_windows(lengths, max_seq_len, stride)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, idx: int) -> Tuple[int, int]:
+        """Find a window.
+        Args:
+            idx (int): Window index.
+        Returns:
+            Tuple[int, int]: Document index, and the token offset the window starts at in it.
+        """
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Window index {idx} out of range [0, {len(self)}).')
+        doc = int(np.searchsorted(self.offsets, idx, 'right')) - 1
+        return doc, int(idx - self.offsets[doc]) * self.stride